@@ -0,0 +1,359 @@
+"""
+Async serving mode for the MedSnap backend.
+
+Serves the same routes as main.py on an ASGI server, with async Groq,
+Vision and Firestore clients so a worker isn't blocked while an upstream
+call is in flight. Face searches and uploads go through main's FaceStore in
+a thread, so both modes share its mirror and replay queue. CPU-bound stages
+(PDF parsing, mpnet, DeepFace) run in threads, and each upstream has its
+own concurrency limit.
+
+Run with:
+    hypercorn asgi:app --bind 0.0.0.0:5000
+"""
+import asyncio
+import os
+import re
+import time
+
+from quart import Quart, Response, g, request, jsonify
+from quart_cors import cors
+
+from main import (
+    allowed_file,
+    face_store,
+    job_queue,
+    extract_text_from_pdf_file,
+    match_organs,
+    patient_update_fields,
+)
+from firestore_db import get_async_db
+from llm_gateway import gateway
+from face_service import face_service
+from face_preprocess import decode_image
+from face_search import face_point
+from jobs import QueueFull
+from pdf_extract import PdfTooLarge, read_pdf_bytes
+from metrics import CONTENT_TYPE, metrics, observe_request, requests_in_flight, span
+
+
+# Maximum in-flight calls per upstream; the CPU limit bounds how many
+# thread-offloaded model calls run at once
+UPSTREAM_LIMITS = {
+    'groq': int(os.environ.get('ASGI_GROQ_CONCURRENCY', '32')),
+    'vision': int(os.environ.get('ASGI_VISION_CONCURRENCY', '16')),
+    'qdrant': int(os.environ.get('ASGI_QDRANT_CONCURRENCY', '32')),
+    'firestore': int(os.environ.get('ASGI_FIRESTORE_CONCURRENCY', '64')),
+    'cpu': int(os.environ.get('ASGI_CPU_CONCURRENCY', str(os.cpu_count() or 4))),
+}
+
+limits = {name: asyncio.Semaphore(limit) for name, limit in UPSTREAM_LIMITS.items()}
+clients = {}
+
+app = Quart(__name__)
+app = cors(app, allow_origin='*')
+
+
+@app.before_serving
+async def create_clients():
+    from google.cloud import vision
+
+    clients['vision'] = vision.ImageAnnotatorAsyncClient()
+    clients['firestore'] = get_async_db()
+    await asyncio.to_thread(face_store.start)
+
+
+@app.after_serving
+async def close_clients():
+    await gateway.aclose()
+
+
+@app.before_request
+async def start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_start = time.perf_counter()
+    requests_in_flight.inc(route=g.metrics_route)
+
+
+@app.after_request
+async def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+async def finish_request_metrics(error=None):
+    if 'metrics_start' not in g:
+        return
+    requests_in_flight.dec(route=g.metrics_route)
+    observe_request(g.metrics_route, request.method, g.get('metrics_status', 500),
+                    time.perf_counter() - g.metrics_start)
+
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+async def run_blocking(func, *args):
+    """Run a CPU-bound call in a thread under the CPU concurrency limit."""
+    async with limits['cpu']:
+        return await asyncio.to_thread(func, *args)
+
+
+async def summarize_report(report_text):
+    async with limits['groq']:
+        with span('llm_summary'):
+            return await gateway.asummarize_organ(report_text)
+
+
+async def discharge_summary_to_json(report_text):
+    async with limits['groq']:
+        with span('llm_timeline'):
+            return await gateway.aextract_timeline(report_text)
+
+
+async def detect_text(image_content):
+    from google.cloud import vision
+
+    request_ = vision.AnnotateImageRequest(
+        image=vision.Image(content=image_content),
+        features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+    )
+    async with limits['vision']:
+        with span('ocr'):
+            response = await clients['vision'].batch_annotate_images(requests=[request_])
+
+    texts = response.responses[0].text_annotations
+    if not texts:
+        return ""
+    return texts[0].description
+
+
+async def update_patient_record(patient_id, organ_updates=None, history_entry=None):
+    from google.api_core.exceptions import NotFound
+
+    fields = patient_update_fields(organ_updates, history_entry)
+    if not fields:
+        return True
+    try:
+        async with limits['firestore']:
+            with span('firestore_update'):
+                await clients['firestore'].collection('patients').document(patient_id).update(fields)
+        return True
+    except NotFound:
+        print(f"Patient with ID {patient_id} not found")
+        return False
+    except Exception as e:
+        print(f"Error updating patient record: {str(e)}")
+        return False
+
+
+def decode_and_embed(image_bytes):
+    with span('face_decode'):
+        img = decode_image(image_bytes)
+    if img is None:
+        raise ValueError("Could not decode image")
+    with span('face_embed'):
+        return face_service.embed(img)
+
+
+async def face_embedding(image_bytes):
+    # Decoding and detection run on the worker thread; the embedding forward
+    # pass is batched with other in-flight requests by the face service
+    return await run_blocking(decode_and_embed, image_bytes)
+
+
+@app.route('/message', methods=['POST'])
+async def receive_message():
+    try:
+        files = await request.files
+        form = await request.form
+        if 'file' not in files:
+            return jsonify({'error': 'No file provided'}), 400
+
+        file = files['file']
+        aadhar_number = form.get('aadhar_number')
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        if not aadhar_number:
+            return jsonify({'error': 'No Aadhar number provided'}), 400
+        if not re.match(r'^\d{12}$', aadhar_number):
+            return jsonify({'error': 'Invalid Aadhar number format'}), 400
+
+        if not file.filename.endswith('.pdf'):
+            return jsonify({'error': 'Invalid file type'}), 400
+
+        if request.args.get('wait') != '1':
+            # Same job queue as the Flask app; ingestion runs on its worker
+            # threads and the client polls /jobs/<job_id>
+            try:
+                pdf_bytes = read_pdf_bytes(file.stream)
+                job_id = await asyncio.to_thread(
+                    job_queue.submit, 'ingest_report', {'aadhar_number': aadhar_number}, pdf_bytes)
+            except PdfTooLarge as e:
+                return jsonify({'error': str(e)}), 413
+            except QueueFull:
+                response = jsonify({'error': 'Too many reports are being processed, try again shortly'})
+                return response, 503, {'Retry-After': '30'}
+            return jsonify({"status": "queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+        extracted_text = await run_blocking(extract_text_from_pdf_file, file.stream)
+        if not extracted_text:
+            return jsonify({
+                "status": "error",
+                "message": "Failed to extract text from PDF"
+            }), 500
+
+        organs, summary, history_data = await asyncio.gather(
+            run_blocking(match_organs, extracted_text),
+            summarize_report(extracted_text),
+            discharge_summary_to_json(extracted_text),
+        )
+        organ_data = {organ: summary for organ in organs}
+        success = await update_patient_record(aadhar_number, organ_data, history_data)
+        print(organ_data)
+        print(history_data)
+
+        return jsonify({
+            "status": "success",
+            "message": "PDF text extracted successfully",
+            "success": success,
+            "text": extracted_text
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+async def job_status(job_id):
+    status = await asyncio.to_thread(job_queue.status, job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+
+@app.route('/search-face', methods=['POST'])
+async def search_face():
+    files = await request.files
+    form = await request.form
+    if 'image' not in files:
+        return jsonify({"error": "No image file provided"}), 400
+
+    image = files['image']
+    if not allowed_file(image.filename):
+        return jsonify({"error": "Invalid file type"}), 400
+
+    try:
+        embedding = await face_embedding(image.read())
+        async with limits['qdrant']:
+            with span('qdrant_search'):
+                match, ranked = await asyncio.to_thread(
+                    face_store.search, embedding, hospital=form.get('hospital'))
+
+        if match is None:
+            return jsonify({
+                "adhaar": None,
+                "match": False,
+                "score": ranked[0][1] if ranked else None,
+            })
+
+        return jsonify({
+            "adhaar": match.aadhaar,
+            "match": True,
+            "score": match.score,
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/upload-face', methods=['POST'])
+async def upload_face():
+    files = await request.files
+    form = await request.form
+    if 'image' not in files:
+        return jsonify({"error": "No image file provided"}), 400
+
+    image = files['image']
+    some_number = form.get('some_number')
+
+    if not some_number:
+        return jsonify({"error": "some_number is required"}), 400
+
+    try:
+        some_number = int(some_number)
+    except ValueError:
+        return jsonify({"error": "some_number must be an integer"}), 400
+
+    if not allowed_file(image.filename):
+        return jsonify({"error": "Invalid file type"}), 400
+
+    try:
+        image_bytes = image.read()
+        embedding = await face_embedding(image_bytes)
+        async with limits['qdrant']:
+            with span('qdrant_upsert'):
+                await asyncio.to_thread(
+                    face_store.upsert,
+                    [face_point(some_number, embedding, image_bytes, hospital=form.get('hospital'))],
+                )
+
+        return jsonify({"message": "Face uploaded successfully"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/prescribe', methods=['POST'])
+async def process_prescription():
+    try:
+        files = await request.files
+        form = await request.form
+        if 'image' not in files:
+            return jsonify({'error': 'No image file provided'}), 400
+
+        if 'aadhar_number' not in form:
+            return jsonify({'error': 'No Aadhar number provided'}), 400
+
+        image = files['image']
+        aadhar_number = form['aadhar_number']
+
+        if not re.match(r'^\d{12}$', aadhar_number):
+            return jsonify({'error': 'Invalid Aadhar number format'}), 400
+
+        if image.filename == '':
+            return jsonify({'error': 'No selected file'}), 400
+
+        if not image.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+            return jsonify({'error': 'Invalid file format'}), 400
+
+        extracted_text = await detect_text(image.read())
+        if not extracted_text:
+            return jsonify({'error': 'No text detected in image'}), 400
+
+        async with limits['groq']:
+            with span('llm_medications'):
+                generated_text = await gateway.aextract_medications(extracted_text)
+
+        try:
+            async with limits['firestore']:
+                with span('firestore_set'):
+                    await clients['firestore'].collection('patients').document(aadhar_number).set({
+                        'medicalDetails': {
+                            'currentMedications': generated_text
+                        }
+                    }, merge=True)
+        except Exception as e:
+            print(f"Firebase update error: {str(e)}")
+            return jsonify({'error': 'Failed to update medications in database'}), 500
+
+        return jsonify({
+            'text': generated_text,
+            'message': 'Prescription processed and stored successfully',
+            'aadhar_number': aadhar_number
+        }), 200
+
+    except Exception as e:
+        print(f"Error processing prescription: {str(e)}")
+        return jsonify({'error': str(e)}), 500
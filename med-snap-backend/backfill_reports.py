@@ -0,0 +1,355 @@
+"""
+Bulk backfill of a hospital's historical discharge summaries.
+
+Takes a directory or .zip archive of PDFs named by Aadhaar number, laid out
+as for enroll_faces.py:
+
+    1234567890.pdf            one report
+    1234567890_2019-03.pdf    further reports of the same patient
+    1234567890/admit-3.pdf    or a folder per patient
+
+or a CSV manifest (--manifest) with "aadhaar,path" rows. Each report goes
+through the same steps as an upload to /message: text extraction (with OCR
+of scanned pages when --ocr is given), organ matching plus the Groq
+summary, and the Groq timeline entry, then one field-path update of the
+patient document.
+
+Stages overlap: PDFs are parsed across worker processes while the parent
+analyzes them a batch at a time, encoding each batch in mpnet forward
+passes and running the Groq calls on a bounded thread pool. Requests that
+miss the LLM cache go through the gateway's scheduler at BACKGROUND
+priority, within its per-model RPM/TPM budgets (--llm-rpm/--llm-tpm
+override them for this run). Updates are committed to Firestore in
+batched writes of up to 500 operations.
+
+The checkpoint file lists every report whose update has been committed;
+after a crash, re-run the same command to pick up where it stopped (LLM
+results for reports that were analyzed but not written come back from the
+LLM cache). Each report's history entry is keyed by the file's name and
+modification time, so a report committed just before a crash, but not yet
+checkpointed, overwrites its own entry when it is redone instead of adding
+a second one. Reports that fail are appended to <checkpoint>.errors and
+tried again on the next run. Progress is reported in docs/sec.
+
+Usage:
+    python backfill_reports.py reports/ [--manifest reports.csv] [--workers 4]
+    python backfill_reports.py reports.zip --ocr --llm-rpm 30 --dry-run
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from bulk_source import FileSource, list_files, load_checkpoint
+
+
+BACKFILL_BATCH_SIZE = int(os.environ.get('BACKFILL_BATCH_SIZE', '32'))
+BACKFILL_LLM_CONCURRENCY = int(os.environ.get('BACKFILL_LLM_CONCURRENCY', '8'))
+BACKFILL_COMMIT_RETRIES = int(os.environ.get('BACKFILL_COMMIT_RETRIES', '3'))
+# Firestore rejects a batched write with more than 500 operations
+FIRESTORE_MAX_BATCH_WRITES = 500
+PDF_EXTENSIONS = ('.pdf',)
+
+
+_worker_source = None
+_worker_ocr = None
+
+
+def _init_worker(source_path, ocr):
+    global _worker_source, _worker_ocr
+    _worker_source = FileSource(source_path, PDF_EXTENSIONS)
+    if ocr:
+        from ocr import ocr_service
+
+        _worker_ocr = ocr_service.detect_texts
+
+
+def parse_report(pair):
+    """
+    Read and extract one PDF. Runs in a worker process.
+
+    Returns:
+        tuple: (aadhaar, name, text or None, error or None)
+    """
+    import io
+
+    from pdf_extract import extract_pdf
+
+    aadhaar, name = pair
+    try:
+        int(aadhaar)
+        # Already in a worker process; workers=0 extracts the pages inline
+        # instead of handing them to a page-worker subprocess of its own
+        extraction = extract_pdf(io.BytesIO(_worker_source.read(name)), ocr=_worker_ocr, workers=0)
+    except Exception as e:
+        return aadhaar, name, None, str(e)
+
+    if not extraction.text.strip():
+        return aadhaar, name, None, "no text extracted"
+    if extraction.failed_pages:
+        print(f"{name}: failed pages {sorted(extraction.failed_pages)}")
+    return aadhaar, name, extraction.text, None
+
+
+def iter_parsed(executor, pairs, window):
+    """parse_report over pairs in order, keeping at most window PDFs in flight."""
+    pairs = iter(pairs)
+    pending = collections.deque()
+    for pair in pairs:
+        pending.append(executor.submit(parse_report, pair))
+        if len(pending) >= window:
+            break
+    while pending:
+        yield pending.popleft().result()
+        pair = next(pairs, None)
+        if pair is not None:
+            pending.append(executor.submit(parse_report, pair))
+
+
+def analyze_batch(texts, llm_executor):
+    """
+    find_organ_details and discharge_summary_to_json for a batch of reports:
+    one batched mpnet/FAISS pass for the organs while the Groq summaries
+    and timelines run on llm_executor.
+
+    Returns:
+        list: (organ_data, history_data) or the exception raised, per report
+    """
+    from report_analysis import discharge_summary_to_json, match_organs_batch, summarize_report
+
+    summaries = [llm_executor.submit(summarize_report, text) for text in texts]
+    timelines = [llm_executor.submit(discharge_summary_to_json, text) for text in texts]
+    organs = match_organs_batch(texts)
+
+    results = []
+    for report_organs, summary, timeline in zip(organs, summaries, timelines):
+        try:
+            summary_text = summary.result()
+            results.append(({organ: summary_text for organ in report_organs}, timeline.result()))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+class BatchWriter:
+    """
+    Collects patient updates and commits them as Firestore batched writes
+    of at most max_writes operations each.
+
+    A batch is atomic, and update() of a missing document fails the whole
+    batch, so patients are checked to exist (once each) before their first
+    update is queued.
+    """
+
+    def __init__(self, db, max_writes=FIRESTORE_MAX_BATCH_WRITES, retries=BACKFILL_COMMIT_RETRIES):
+        self.db = db
+        self.max_writes = min(max_writes, FIRESTORE_MAX_BATCH_WRITES)
+        self.retries = retries
+        self.pending = []
+        self._known = {}
+
+    def missing_patients(self, patient_ids):
+        unknown = sorted({patient_id for patient_id in patient_ids if patient_id not in self._known})
+        if unknown:
+            refs = [self.db.collection('patients').document(patient_id) for patient_id in unknown]
+            for snapshot in self.db.get_all(refs):
+                self._known[snapshot.id] = snapshot.exists
+        return {patient_id for patient_id in patient_ids if not self._known.get(patient_id, False)}
+
+    def add(self, patient_id, fields, name):
+        self.pending.append((patient_id, fields, name))
+
+    def full(self):
+        return len(self.pending) >= self.max_writes
+
+    def commit(self):
+        """
+        Commit everything queued.
+
+        Returns:
+            list: Names of the reports whose updates were committed
+        """
+        from firestore_db import firestore_pool
+
+        if not self.pending:
+            return []
+        for attempt in range(1, self.retries + 1):
+            batch = self.db.batch()
+            for patient_id, fields, _ in self.pending:
+                batch.update(self.db.collection('patients').document(patient_id), fields)
+            try:
+                batch.commit()
+                break
+            except Exception as e:
+                firestore_pool.report_failure(e)
+                if attempt == self.retries:
+                    raise
+                print(f"Batch commit failed ({e}), retrying")
+                time.sleep(2 ** attempt)
+
+        names = [name for _, _, name in self.pending]
+        self.pending = []
+        return names
+
+
+def backfill(source_path, db, manifest=None, checkpoint=None, workers=None, batch_size=BACKFILL_BATCH_SIZE,
+             write_batch_size=FIRESTORE_MAX_BATCH_WRITES, llm_concurrency=BACKFILL_LLM_CONCURRENCY, ocr=False):
+    """
+    Parse, analyze and write every report in a source not already in the
+    checkpoint.
+
+    Args:
+        source_path (str): Directory or zip archive of PDFs
+        db (firestore.Client): Client to write with, or None for a dry run
+        manifest (str): Optional CSV of aadhaar,path rows
+        checkpoint (str): File recording reports already written
+        workers (int): PDF parsing processes (default: CPU count)
+        batch_size (int): Reports analyzed together
+        write_batch_size (int): Operations per Firestore batched write
+        llm_concurrency (int): Groq calls in flight at once
+        ocr (bool): OCR pages without a text layer
+
+    Returns:
+        dict: Counts of written, skipped and failed reports
+    """
+    from report_analysis import history_key, patient_update_fields
+
+    source = FileSource(source_path, PDF_EXTENSIONS)
+    pairs, unnamed = list_files(source, manifest)
+    done = load_checkpoint(checkpoint)
+    todo = [(aadhaar, name) for aadhaar, name in pairs if name not in done]
+    counts = {'written': 0, 'skipped': len(pairs) - len(todo), 'failed': len(unnamed)}
+    print(f"{len(pairs)} reports, {counts['skipped']} already written, {len(todo)} to go")
+
+    checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+    errors_file = open(checkpoint + '.errors', 'a') if checkpoint else None
+
+    def fail(name, error):
+        counts['failed'] += 1
+        print(f"{name}: {error}")
+        if errors_file:
+            errors_file.write(f"{name}\t{error}\n")
+            errors_file.flush()
+
+    for name in unnamed:
+        fail(name, "no Aadhaar number in file name")
+
+    writer = BatchWriter(db, write_batch_size) if db is not None else None
+    started = time.perf_counter()
+    processed = 0
+
+    def report_progress():
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        print(f"processed {processed}/{len(todo)}, written {counts['written']}, failed {counts['failed']} "
+              f"({processed / elapsed:.2f} docs/s)")
+
+    def commit():
+        names = writer.commit()
+        # Only record reports once their batch is committed, so a crash
+        # redoes the batch that was in flight
+        if checkpoint_file and names:
+            checkpoint_file.write(''.join(f"{name}\n" for name in names))
+            checkpoint_file.flush()
+        counts['written'] += len(names)
+
+    def handle(batch):
+        nonlocal processed
+        analyzed = analyze_batch([text for _, _, text in batch], llm_executor)
+        missing = writer.missing_patients([aadhaar for aadhaar, _, _ in batch]) if writer else set()
+        for (aadhaar, name, _), result in zip(batch, analyzed):
+            processed += 1
+            if isinstance(result, Exception):
+                fail(name, result)
+            elif aadhaar in missing:
+                fail(name, f"patient {aadhaar} not found")
+            elif writer is None:
+                counts['written'] += 1
+            else:
+                history_id = history_key(name, source.modified_ns(name))
+                writer.add(aadhaar, patient_update_fields(*result, history_id=history_id), name)
+                if writer.full():
+                    commit()
+        report_progress()
+
+    # Spawned rather than forked: by the time the pool starts, the
+    # Firestore client has opened gRPC channels and background threads that
+    # a fork would copy
+    context = multiprocessing.get_context('spawn')
+    batch = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(source_path, ocr)) as executor, \
+                ThreadPoolExecutor(max_workers=llm_concurrency, thread_name_prefix='backfill-llm') as llm_executor:
+            for aadhaar, name, text, error in iter_parsed(executor, todo, window=batch_size * 4):
+                if error is not None:
+                    processed += 1
+                    fail(name, error)
+                    continue
+                batch.append((aadhaar, name, text))
+                if len(batch) >= batch_size:
+                    handle(batch)
+                    batch = []
+            if batch:
+                handle(batch)
+            if writer:
+                commit()
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+        if errors_file:
+            errors_file.close()
+
+    elapsed = time.perf_counter() - started
+    counts['docs_per_second'] = round(processed / elapsed, 2) if elapsed else 0.0
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Directory or .zip archive of discharge summary PDFs')
+    parser.add_argument('--manifest', help='CSV of aadhaar,path rows instead of Aadhaar-named files')
+    parser.add_argument('--checkpoint', help='Progress file (default: <source>.backfilled)')
+    parser.add_argument('--workers', type=int, default=None, help='PDF parsing processes')
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE, help='Reports analyzed together')
+    parser.add_argument('--write-batch-size', type=int, default=FIRESTORE_MAX_BATCH_WRITES,
+                        help='Operations per Firestore batched write (at most 500)')
+    parser.add_argument('--llm-rpm', type=float, default=None,
+                        help='Groq requests per minute per model (default: GROQ_RPM, 0 for no limit)')
+    parser.add_argument('--llm-tpm', type=float, default=None,
+                        help='Groq tokens per minute per model (default: GROQ_TPM, 0 for no limit)')
+    parser.add_argument('--llm-concurrency', type=int, default=BACKFILL_LLM_CONCURRENCY)
+    parser.add_argument('--ocr', action='store_true', help='OCR pages that have no text layer')
+    parser.add_argument('--dry-run', action='store_true', help='Analyze but write nothing to Firestore')
+    args = parser.parse_args()
+
+    from firestore_db import get_db
+    from llm_gateway import gateway
+
+    if args.llm_rpm is not None or args.llm_tpm is not None:
+        gateway.scheduler.set_limits(rpm=args.llm_rpm, tpm=args.llm_tpm)
+
+    db = None
+    if not args.dry_run:
+        db = get_db()
+        if not db:
+            parser.error("Failed to initialize Firebase")
+
+    counts = backfill(
+        args.source,
+        db,
+        manifest=args.manifest,
+        checkpoint=None if args.dry_run else args.checkpoint or args.source.rstrip('/\\') + '.backfilled',
+        workers=args.workers,
+        batch_size=args.batch_size,
+        write_batch_size=args.write_batch_size,
+        llm_concurrency=args.llm_concurrency,
+        ocr=args.ocr,
+    )
+    print(f"written {counts['written']}, skipped {counts['skipped']}, failed {counts['failed']} "
+          f"({counts['docs_per_second']} docs/s)")
+
+
+if __name__ == '__main__':
+    main()
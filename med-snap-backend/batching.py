@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads into batches.
+
+    A batch is dispatched when it reaches max_batch_size or max_wait_ms after
+    its first item arrived, whichever comes first. process_batch receives a
+    list of items and returns one result per item; a result that is an
+    Exception instance fails only that item's future.
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait_ms=5, workers=1, name='batcher'):
+        self._process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._name = name
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{name}-worker')
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.batches = 0
+        self.items = 0
+        self.last_batch_size = 0
+        self.max_batch_seen = 0
+        self.in_flight = 0
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, item):
+        """Queue an item; returns a Future for its result."""
+        self._start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def map(self, items):
+        """Submit every item and wait for all results, in order."""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.batches += 1
+            self.items += len(batch)
+            self.last_batch_size = len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            with self._lock:
+                self.in_flight += 1
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            results = list(self._process_batch([item for item, _ in batch]))
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self._name}: got {len(results)} results for a batch of {len(batch)}")
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            # Never leave a caller blocked on a future nobody will resolve
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'in_flight_batches': self.in_flight,
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else None,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size_seen': self.max_batch_seen,
+        }
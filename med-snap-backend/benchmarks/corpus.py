@@ -0,0 +1,175 @@
+"""
+Synthetic inputs for the end-to-end benchmark: discharge summary PDFs,
+prescription photos and face photos, generated from a seed so every run
+sees the same corpus.
+"""
+import random
+
+import cv2
+import numpy as np
+
+
+FIRST_NAMES = ['Patricia', 'Rahul', 'Anita', 'James', 'Meera', 'Arjun', 'Lisa', 'Vikram', 'Sara', 'Imran']
+LAST_NAMES = ['Lewis', 'Sharma', 'Iyer', 'Walker', 'Nair', 'Singh', 'Martin', 'Rao', 'Khan', 'Das']
+MEDICINES = ['Aspirin', 'Metoprolol', 'Atorvastatin', 'Omeprazole', 'Amoxicillin', 'Metformin',
+             'Paracetamol', 'Lisinopril', 'Clopidogrel', 'Pantoprazole', 'Cetirizine', 'Azithromycin']
+
+PARAGRAPHS = [
+    "The patient presented with {condition} and was admitted for evaluation and management. "
+    "Vital signs were monitored closely and symptomatic treatment was started on admission.",
+    "Laboratory investigations including complete blood count, renal and liver function tests "
+    "were performed. Imaging confirmed the working diagnosis of {condition}.",
+    "The patient was managed with intravenous fluids, analgesics and {medicine}. The condition "
+    "improved steadily and the patient was mobilised on the third day.",
+    "The patient was educated on medication adherence, warning signs of recurrence and "
+    "lifestyle modifications, and advised to follow up in the outpatient clinic in two weeks.",
+]
+
+LINES_PER_PAGE = 48
+CHARS_PER_LINE = 90
+
+
+def _wrap(text, width=CHARS_PER_LINE):
+    lines = []
+    line = ''
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def discharge_summary_lines(rng, conditions, paragraphs=8):
+    condition = rng.choice(conditions)
+    day = rng.randint(1, 20)
+    lines = [
+        'City General Hospital',
+        'Discharge Summary',
+        f"Name: {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        f"Age: {rng.randint(18, 90)} years",
+        f"Date of Admission: {day}th March 2024",
+        f"Date of Discharge: {day + rng.randint(2, 8)}th March 2024",
+        f"Admission Diagnosis: {condition.title()}",
+        '',
+    ]
+    for _ in range(paragraphs):
+        paragraph = rng.choice(PARAGRAPHS).format(condition=condition, medicine=rng.choice(MEDICINES))
+        lines.extend(_wrap(paragraph))
+        lines.append('')
+    lines.append('Discharge Medications')
+    lines.extend(f"- {name} {rng.choice([5, 10, 20, 40, 75, 500])} mg PO daily"
+                 for name in rng.sample(MEDICINES, 4))
+    return lines
+
+
+def _pdf_string(text):
+    text = text.encode('latin-1', 'replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_pdf(pages):
+    """
+    Minimal PDF with one Helvetica text stream per page. A page given as
+    None has no text layer, like a scanned page, to exercise OCR fallback.
+
+    Args:
+        pages (list): Lines of text per page, or None for a blank page
+
+    Returns:
+        bytes: The PDF file
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for lines in pages:
+        if lines:
+            text = ' T* '.join(f"({_pdf_string(line)}) Tj" for line in lines)
+            content = f"BT /F1 10 Tf 12 TL 50 800 Td {text} ET".encode('latin-1')
+        else:
+            content = b""
+        stream = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {page_tree} 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {stream} 0 R >>".encode('latin-1')
+        ))
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {page_tree} 0 R >>".encode('latin-1')
+    kids = ' '.join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[page_tree - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode('latin-1')
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def discharge_pdf(rng, conditions, pages=2, scanned=False):
+    """A discharge summary spread over pages; scanned adds a page with no text layer."""
+    lines = discharge_summary_lines(rng, conditions, paragraphs=12 * pages)
+    page_lines = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)][:pages]
+    if scanned:
+        page_lines.append(None)
+    return build_pdf(page_lines)
+
+
+def _noise(rng, shape, amplitude):
+    return np.random.default_rng(rng.randint(0, 2 ** 32 - 1)).integers(0, amplitude, shape, dtype=np.uint8)
+
+
+def prescription_image(rng, width=900, height=1200):
+    """PNG of a typed prescription on slightly noisy paper."""
+    img = np.full((height, width, 3), 245, dtype=np.uint8)
+    img = cv2.add(img, _noise(rng, img.shape, 8))
+    lines = ['Dr. A. Kumar, MBBS', 'Rx', ''] + [
+        f"Tab {name} {rng.choice([5, 10, 20, 75, 500])}mg  1-0-1  x {rng.randint(3, 30)} days"
+        for name in rng.sample(MEDICINES, rng.randint(2, 5))
+    ]
+    for row, line in enumerate(lines):
+        cv2.putText(img, line, (60, 120 + row * 60), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (20, 20, 20), 2)
+    ok, encoded = cv2.imencode('.png', img)
+    return encoded.tobytes()
+
+
+def face_image(rng, width=1200, height=1600):
+    """JPEG with a face-like arrangement of ellipses; only the fake embedder accepts it."""
+    img = np.full((height, width, 3), rng.randint(120, 220), dtype=np.uint8)
+    center = (width // 2 + rng.randint(-80, 80), height // 2 + rng.randint(-80, 80))
+    skin = tuple(int(c) for c in (rng.randint(90, 200), rng.randint(110, 200), rng.randint(150, 230)))
+    cv2.ellipse(img, center, (260, 340), 0, 0, 360, skin, -1)
+    for dx in (-100, 100):
+        cv2.circle(img, (center[0] + dx, center[1] - 80), 30, (40, 40, 40), -1)
+    cv2.ellipse(img, (center[0], center[1] + 150), (100, 30), 0, 0, 180, (60, 60, 150), 8)
+    img = cv2.add(img, _noise(rng, img.shape, 12))
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def build_corpus(conditions, size=20, seed=7, pdf_pages=2, scanned_ratio=0.2):
+    """
+    Returns:
+        dict: Lists of bytes under 'pdfs', 'prescriptions' and 'faces'
+    """
+    rng = random.Random(seed)
+    return {
+        'pdfs': [discharge_pdf(rng, conditions, pages=pdf_pages, scanned=rng.random() < scanned_ratio)
+                 for _ in range(size)],
+        'prescriptions': [prescription_image(rng) for _ in range(size)],
+        'faces': [face_image(rng) for _ in range(size)],
+    }
@@ -0,0 +1,372 @@
+"""
+End-to-end benchmark of the Flask routes against local stand-ins.
+
+Runs /message, /prescribe, /upload-face and /search-face through Flask's
+test client with Groq, Vision, Qdrant and Firestore replaced by the fakes in
+benchmarks/fakes.py, each with injected latency. Inputs come from a seeded
+synthetic corpus (benchmarks/corpus.py): multi-page discharge PDFs, some
+with a scanned page to exercise OCR fallback, prescription photos and face
+photos.
+
+Reports throughput and p50/p95/p99 per route and per stage (PDF extraction,
+organ matching, each LLM call, OCR, Firestore writes, face decode/embed,
+vector search). With --json the results are saved; with --baseline the run
+fails (exit 1) if any route or stage p95 regressed by more than
+--max-regression against a saved run, which makes it a CPU-only gate for
+performance work.
+
+--fake-models also swaps mpnet and Facenet for cheap stand-ins so the run
+needs no model downloads; without it the real models run on CPU and the
+face routes need real photos (--faces DIR), since detection rejects the
+synthetic faces. --firestore emulator writes to the Firestore emulator at
+FIRESTORE_EMULATOR_HOST instead of the in-memory store.
+
+Usage:
+    python benchmarks/e2e_bench.py --fake-models --requests 100 --concurrency 8
+    python benchmarks/e2e_bench.py --json baseline.json
+    python benchmarks/e2e_bench.py --baseline baseline.json --max-regression 0.15
+"""
+import argparse
+import functools
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# How long to poll /jobs/<job_id> for a queued request before counting it
+# as an error
+JOB_POLL_TIMEOUT = 120.0
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def summarize(seconds):
+    ms = [value * 1000 for value in seconds]
+    return {
+        'count': len(ms),
+        'mean': sum(ms) / len(ms),
+        'p50': percentile(ms, 50),
+        'p95': percentile(ms, 95),
+        'p99': percentile(ms, 99),
+    }
+
+
+class StageRecorder:
+    """Collects wall time per named stage from wrapped functions."""
+
+    def __init__(self):
+        self._samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._samples = defaultdict(list)
+
+    def summary(self):
+        with self._lock:
+            return {stage: summarize(samples) for stage, samples in self._samples.items() if samples}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=50, help='Measured requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests per route first')
+    parser.add_argument('--routes', default='message,prescribe,upload-face,search-face')
+    parser.add_argument('--corpus-size', type=int, default=20)
+    parser.add_argument('--pdf-pages', type=int, default=2)
+    parser.add_argument('--scanned-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--faces', help='Directory of real face photos (needed without --fake-models)')
+    parser.add_argument('--llm-latency-ms', type=float, default=400)
+    parser.add_argument('--ocr-latency-ms', type=float, default=150)
+    parser.add_argument('--vector-latency-ms', type=float, default=5)
+    parser.add_argument('--db-latency-ms', type=float, default=20)
+    parser.add_argument('--jitter', type=float, default=0.2, help='Latency varies by +/- this fraction')
+    parser.add_argument('--llm-cache', action='store_true', help='Keep the LLM cache (in a temp file)')
+    parser.add_argument('--fake-models', action='store_true')
+    parser.add_argument('--firestore', choices=['memory', 'emulator'], default='memory')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--baseline', help='Results file from an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Allowed p95 increase over the baseline, as a fraction')
+    return parser.parse_args()
+
+
+def configure_environment(args, workdir):
+    # Must happen before main is imported: these are read at import time
+    os.environ['LLM_CACHE_PATH'] = os.path.join(workdir, 'llm_cache.sqlite3')
+    os.environ['FACE_STORE_MODE'] = 'offline'
+    os.environ['FACE_LOCAL_PATH'] = os.path.join(workdir, 'face_data')
+    os.environ['FIRESTORE_HEALTH_CHECK_SECONDS'] = '0'
+    os.environ['MEDSNAP_PRELOAD_MODELS'] = ''
+    os.environ['JOB_DB_PATH'] = os.path.join(workdir, 'jobs.sqlite3')
+    os.environ['JOB_WORKERS'] = '0'
+    # FakeGroq has no rate limits; unless asked for, don't let the
+    # scheduler's budgets turn the run into a measurement of GROQ_RPM
+    os.environ.setdefault('GROQ_RPM', '0')
+    os.environ.setdefault('GROQ_TPM', '0')
+    if args.fake_models:
+        # Keep the fake condition embeddings out of the real on-disk cache
+        os.environ['MEDSNAP_CACHE_DIR'] = os.path.join(workdir, 'cache')
+
+
+def emulator_db():
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore
+
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        raise SystemExit("--firestore emulator needs FIRESTORE_EMULATOR_HOST")
+    return firestore.Client(project=os.environ.get('GCLOUD_PROJECT', 'medsnap-bench'),
+                            credentials=AnonymousCredentials())
+
+
+def install_fakes(args, main, recorder):
+    """Swap every upstream client main.py uses for a fake and time each stage."""
+    from fakes import (
+        FakeFaceService,
+        FakeGroq,
+        FakeOcrBackend,
+        FakeSentenceModel,
+        InMemoryFaceStore,
+        Latency,
+        MemoryFirestore,
+        NullLLMCache,
+    )
+    from llm_cache import LLMCache
+    from llm_gateway import gateway
+    from model_registry import registry
+    from ocr import ocr_service
+
+    def latency(ms):
+        return Latency(ms, args.jitter, seed=args.seed)
+
+    gateway._client = FakeGroq(latency(args.llm_latency_ms))
+    gateway._cache = LLMCache(os.environ['LLM_CACHE_PATH']) if args.llm_cache else NullLLMCache()
+    ocr_service.backend = FakeOcrBackend(latency(args.ocr_latency_ms))
+    main.face_store = InMemoryFaceStore(latency(args.vector_latency_ms))
+
+    if args.firestore == 'emulator':
+        db = emulator_db()
+    else:
+        db = MemoryFirestore(latency(args.db_latency_ms))
+        db.write = recorder.wrap('firestore', db.write)
+    main.get_db = lambda: db
+
+    if args.fake_models:
+        registry.register('mpnet', FakeSentenceModel)
+        main.face_service = FakeFaceService()
+
+    # Routes look these up as module globals (and the gateway/face objects
+    # as attributes) at call time, so wrapping them here times every call
+    for name in ('extract_pdf_pages', 'detect_text', 'detect_text_batch', 'match_organs',
+                 'summarize_report', 'discharge_summary_to_json', 'update_patient_record',
+                 'decode_image'):
+        setattr(main, name, recorder.wrap(name, getattr(main, name)))
+    gateway.extract_medications = recorder.wrap('extract_medications', gateway.extract_medications)
+    main.face_service.embed = recorder.wrap('face_embed', main.face_service.embed)
+    main.face_store.search = recorder.wrap('face_search', main.face_store.search)
+    main.face_store.upsert = recorder.wrap('face_upsert', main.face_store.upsert)
+    return db
+
+
+def seed_patients(db, patient_ids):
+    for patient_id in patient_ids:
+        document = {'medicalDetails': {'organs': {}, 'medicalHistory': {}, 'currentMedications': ''}}
+        if hasattr(db, 'seed'):
+            db.seed('patients', patient_id, document)
+        else:
+            db.collection('patients').document(patient_id).set(document)
+
+
+def load_faces(directory):
+    return [
+        open(os.path.join(directory, name), 'rb').read()
+        for name in sorted(os.listdir(directory))
+        if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    ]
+
+
+def route_requests(corpus, patient_ids):
+    """Form builders per route; each takes a request number."""
+    def pick(items, i):
+        return items[i % len(items)]
+
+    return {
+        # wait=1 runs the ingestion inline, so the route time covers it
+        'message': ('/message?wait=1', lambda i: {
+            'file': (io.BytesIO(pick(corpus['pdfs'], i)), 'report.pdf'),
+            'aadhar_number': pick(patient_ids, i),
+        }),
+        'prescribe': ('/prescribe', lambda i: {
+            'image': (io.BytesIO(pick(corpus['prescriptions'], i)), 'prescription.png'),
+            'aadhar_number': pick(patient_ids, i),
+        }),
+        'upload-face': ('/upload-face', lambda i: {
+            'image': (io.BytesIO(pick(corpus['faces'], i)), 'face.jpg'),
+            'some_number': pick(patient_ids, i % len(corpus['faces'])),
+        }),
+        'search-face': ('/search-face', lambda i: {
+            'image': (io.BytesIO(pick(corpus['faces'], i)), 'face.jpg'),
+        }),
+    }
+
+
+def request_failed(client, response, job_timeout=JOB_POLL_TIMEOUT):
+    """
+    Whether a request failed. /message?wait=1 answers 200 with success false
+    when the Firestore write fails, and a queued report only fails once its
+    job does, so the status code alone undercounts errors.
+    """
+    if response.status_code >= 400:
+        return True
+    body = response.get_json(silent=True) or {}
+    if body.get('success') is False:
+        return True
+    if response.status_code == 202 and body.get('job_id'):
+        deadline = time.perf_counter() + job_timeout
+        while time.perf_counter() < deadline:
+            job = client.get(f"/jobs/{body['job_id']}").get_json(silent=True) or {}
+            if job.get('status') in ('done', 'failed'):
+                return job['status'] == 'failed'
+            time.sleep(0.01)
+        return True
+    return False
+
+
+def run_route(app, path, build, requests, concurrency, warmup, recorder):
+    local = threading.local()
+
+    def send(i):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        start = time.perf_counter()
+        response = local.client.post(path, data=build(i), content_type='multipart/form-data')
+        failed = request_failed(local.client, response)
+        return time.perf_counter() - start, failed
+
+    for i in range(warmup):
+        send(i)
+    recorder.reset()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(warmup, warmup + requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [seconds for seconds, _ in results]
+    result = summarize(latencies)
+    result['errors'] = sum(1 for _, failed in results if failed)
+    result['throughput'] = len(results) / elapsed
+    result['stages'] = recorder.summary()
+    return result
+
+
+def print_results(results):
+    header = f"{'':<28}{'count':>7}{'err':>5}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    for route, result in results.items():
+        print(f"{route:<28}{result['count']:>7}{result['errors']:>5}{result['throughput']:>8.1f}"
+              f"{result['p50']:>10.1f}{result['p95']:>10.1f}{result['p99']:>10.1f}")
+        for stage, stats in sorted(result['stages'].items()):
+            print(f"  {stage:<26}{stats['count']:>7}{'':>13}"
+                  f"{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}")
+
+
+def regressions(results, baseline, max_regression):
+    """p95 values that grew by more than max_regression over the baseline."""
+    found = []
+    for route, result in results.items():
+        base = baseline.get(route)
+        if not base:
+            continue
+        pairs = [(route, result['p95'], base['p95'])]
+        for stage, stats in result['stages'].items():
+            if stage in base.get('stages', {}):
+                pairs.append((f"{route}/{stage}", stats['p95'], base['stages'][stage]['p95']))
+        for name, current, previous in pairs:
+            if previous > 0 and current > previous * (1 + max_regression):
+                found.append(f"{name}: p95 {previous:.1f} -> {current:.1f} ms")
+    return found
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='medsnap-bench-')
+    configure_environment(args, workdir)
+
+    import main as backend
+    from corpus import build_corpus
+
+    recorder = StageRecorder()
+    db = install_fakes(args, backend, recorder)
+
+    if not args.fake_models and not args.faces:
+        print("No --faces directory: face routes need real photos without --fake-models, skipping them")
+    corpus = build_corpus(backend.conditions_list, size=args.corpus_size, seed=args.seed,
+                          pdf_pages=args.pdf_pages, scanned_ratio=args.scanned_ratio)
+    if args.faces:
+        corpus['faces'] = load_faces(args.faces)
+    patient_ids = [f"{900000000000 + i}" for i in range(args.corpus_size)]
+    seed_patients(db, patient_ids)
+
+    routes = route_requests(corpus, patient_ids)
+    selected = [name.strip() for name in args.routes.split(',') if name.strip()]
+    results = {}
+    for name in selected:
+        if name in ('upload-face', 'search-face') and not (args.fake_models or args.faces):
+            continue
+        path, build = routes[name]
+        print(f"benchmarking {path} ...")
+        results[name] = run_route(backend.app, path, build, args.requests, args.concurrency,
+                                  args.warmup, recorder)
+
+    print()
+    print(f"concurrency {args.concurrency}, latency ms: llm {args.llm_latency_ms}, "
+          f"ocr {args.ocr_latency_ms}, vector {args.vector_latency_ms}, db {args.db_latency_ms}")
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'routes': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['routes']
+        found = regressions(results, baseline, args.max_regression)
+        if found:
+            print()
+            print(f"p95 regressions over {args.max_regression:.0%}:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nno p95 regression over {args.max_regression:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Compare the reduced-resolution face pipeline with the original full-size one.
+
+For every image in a directory, runs:
+  full:    cv2.imdecode(IMREAD_COLOR) + DeepFace.represent (the old path)
+  reduced: face_preprocess.decode_image + detect once + Facenet embedding
+
+and reports decode and detect+embed time, peak traced memory per image, and
+the cosine similarity between the two embeddings (1.0 means the reduced path
+produced the same vector).
+
+Usage:
+    python benchmarks/face_preprocess_bench.py path/to/photos [--max-side 1024]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+
+import face_preprocess
+from face_service import FACE_MODEL_NAME, face_service
+from model_registry import registry
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def cosine(a, b):
+    a = np.asarray(a)
+    b = np.asarray(b)
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--max-side', type=int, default=face_preprocess.FACE_MAX_SIDE)
+    args = parser.parse_args()
+
+    DeepFace = registry.get('facenet').deepface
+
+    paths = sorted(
+        os.path.join(args.directory, name)
+        for name in os.listdir(args.directory)
+        if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+    )
+    rows = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        try:
+            full_img, full_decode, full_decode_peak = measure(
+                lambda: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR))
+            full_embedding, full_embed, full_embed_peak = measure(
+                lambda: DeepFace.represent(full_img, model_name=FACE_MODEL_NAME)[0]['embedding'])
+
+            reduced_img, reduced_decode, reduced_decode_peak = measure(
+                lambda: face_preprocess.decode_image(data, max_side=args.max_side))
+            reduced_embedding, reduced_embed, reduced_embed_peak = measure(
+                lambda: face_service.embed(reduced_img))
+        except Exception as e:
+            print(f"{os.path.basename(path)}: skipped ({str(e)})")
+            continue
+
+        rows.append({
+            'name': os.path.basename(path),
+            'full_shape': full_img.shape[:2],
+            'reduced_shape': reduced_img.shape[:2],
+            'full_decode': full_decode,
+            'reduced_decode': reduced_decode,
+            'full_embed': full_embed,
+            'reduced_embed': reduced_embed,
+            'full_peak': max(full_decode_peak, full_embed_peak),
+            'reduced_peak': max(reduced_decode_peak, reduced_embed_peak),
+            'similarity': cosine(full_embedding, reduced_embedding),
+        })
+        row = rows[-1]
+        print(f"{row['name']}: {row['full_shape']} -> {row['reduced_shape']}, "
+              f"decode {row['full_decode'] * 1000:.1f} -> {row['reduced_decode'] * 1000:.1f} ms, "
+              f"embed {row['full_embed'] * 1000:.1f} -> {row['reduced_embed'] * 1000:.1f} ms, "
+              f"peak {row['full_peak'] / 1e6:.1f} -> {row['reduced_peak'] / 1e6:.1f} MB, "
+              f"cosine {row['similarity']:.4f}")
+
+    if not rows:
+        print("No images benchmarked")
+        return
+
+    print()
+    print(f"images: {len(rows)}")
+    for label, key in (('decode', 'decode'), ('detect+embed', 'embed')):
+        full = [row[f'full_{key}'] * 1000 for row in rows]
+        reduced = [row[f'reduced_{key}'] * 1000 for row in rows]
+        print(f"{label} ms p50/p95: full {percentile(full, 50):.1f}/{percentile(full, 95):.1f}, "
+              f"reduced {percentile(reduced, 50):.1f}/{percentile(reduced, 95):.1f}")
+    print(f"peak MB mean: full {statistics.mean(row['full_peak'] for row in rows) / 1e6:.1f}, "
+          f"reduced {statistics.mean(row['reduced_peak'] for row in rows) / 1e6:.1f}")
+    similarities = [row['similarity'] for row in rows]
+    print(f"cosine similarity full vs reduced: mean {statistics.mean(similarities):.4f}, "
+          f"min {min(similarities):.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Local stand-ins for the backend's upstream services, with injected latency.
+
+Each fake answers the way the real service would for the calls main.py
+makes, sleeping for a configurable time first so a benchmark measures our
+own overhead plus a realistic wait instead of a live network:
+
+  FakeGroq:           Groq chat completions (install on the LLM gateway)
+  FakeOcrBackend:     OcrService backend in place of Vision
+  InMemoryFaceStore:  FaceStore in place of Qdrant, brute-force cosine
+  MemoryFirestore:    Firestore client with collection/document writes
+  FakeSentenceModel,
+  FakeFaceService:    optional CPU-cheap stand-ins for mpnet and Facenet
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+
+from face_search import (FACE_MATCH_THRESHOLD, FACE_SEARCH_TOP_K, best_match, candidates_of, patient_of,
+                         rank_candidates)
+
+
+class Latency:
+    """Sleep for latency_ms, varied uniformly by +/- jitter (a fraction)."""
+
+    def __init__(self, latency_ms=0.0, jitter=0.2, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.latency_ms <= 0:
+            return
+        with self._lock:
+            factor = self._random.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(self.latency_ms * factor / 1000.0)
+
+
+class FakeGroq:
+    """
+    Groq client whose chat.completions.create returns canned answers in the
+    formats the gateway parses: a short summary, a "Date:, Issue:,
+    Treatment:" line, or a **medicine** list.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _answer(self, prompt):
+        if 'Extracted Result:' in prompt:
+            return ("Date: 17-08-2024, Issue: Acute Myocardial Infarction, "
+                    "Treatment: PCI with stent placement, antiplatelet therapy and statins.")
+        if 'medical prescription' in prompt:
+            names = re.findall(r'(?:Tab|Cap|Syp)\.?\s+([A-Z][a-z]+)', prompt)
+            return ' '.join(f"**{name}**" for name in names) or "**Paracetamol**"
+        return "Mild Arrhythmia"
+
+    def _create(self, model, messages, **params):
+        self.latency.wait()
+        self.calls += 1
+        prompt = messages[-1]['content']
+        message = SimpleNamespace(content=self._answer(prompt))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class NullLLMCache:
+    """LLM cache that never hits, so every request pays for the model call."""
+
+    def get_or_compute(self, namespace, text, prompt_version, model, compute):
+        return compute()
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def stats(self):
+        return {'enabled': False}
+
+
+class FakeOcrBackend:
+    """
+    OcrService backend returning a fixed prescription text per image, one
+    simulated round trip per batch as with Vision's batch_annotate_images.
+    """
+
+    max_batch_size = 16
+
+    def __init__(self, latency=None, text=None):
+        self.latency = latency or Latency()
+        self.text = text or "Dr. A. Kumar\nRx\nTab Aspirin 75mg 1-0-0\nTab Metoprolol 50mg 1-0-1\nCap Omeprazole 20mg 0-0-1"
+        self.batches = 0
+
+    def annotate(self, images):
+        self.latency.wait()
+        self.batches += 1
+        return [self.text if image else "" for image in images]
+
+
+ScoredPoint = namedtuple('ScoredPoint', ['id', 'score', 'payload', 'vector'])
+
+
+class InMemoryFaceStore:
+    """
+    FaceStore with the same search/upsert/status interface, holding points
+    in memory and searching exhaustively with numpy. Scores match a cosine
+    Qdrant collection.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self._points = {}
+        self._lock = threading.Lock()
+        self.mode = 'memory'
+
+    def upsert(self, points, wait=True):
+        self.latency.wait()
+        with self._lock:
+            for point in points:
+                self._points[point['id']] = ScoredPoint(
+                    point['id'], None, dict(point.get('payload') or {}), list(point['vector']))
+
+    def search(self, embedding, top_k=FACE_SEARCH_TOP_K, threshold=FACE_MATCH_THRESHOLD,
+               rerank=True, hospital=None, **options):
+        self.latency.wait()
+        with self._lock:
+            points = [p for p in self._points.values()
+                      if not hospital or p.payload.get('hospital') == hospital]
+        if not points:
+            return None, []
+
+        query = np.asarray(embedding, dtype='float32')
+        vectors = np.asarray([p.vector for p in points], dtype='float32')
+        scores = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+        top = np.argsort(-scores)[:top_k]
+        hits = [points[i]._replace(score=float(scores[i])) for i in top]
+
+        stored = None
+        if rerank:
+            candidates = set(candidates_of(hits))
+            stored = {}
+            with self._lock:
+                enrolled = list(self._points.values())
+            for point in enrolled:
+                patient = patient_of(point)
+                if patient in candidates:
+                    stored.setdefault(patient, []).append(point.vector)
+        ranked = rank_candidates(embedding, hits, stored)
+        return best_match(ranked, threshold), ranked
+
+    def status(self):
+        return {'mode': self.mode, 'points': len(self._points)}
+
+
+def _field_path(path):
+    """Split a Firestore field path, honouring `backtick` quoted segments."""
+    return [part.strip('`') for part in re.findall(r'`[^`]*`|[^.]+', path)]
+
+
+def _merge(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class MemoryDocument:
+    def __init__(self, db, collection, document_id):
+        self._db = db
+        self._key = (collection, document_id)
+
+    def get(self):
+        data = self._db.write('get', self._key)
+        return SimpleNamespace(exists=data is not None, to_dict=lambda: data)
+
+    def set(self, data, merge=False):
+        self._db.write('set', self._key, data, merge)
+
+    def update(self, fields):
+        self._db.write('update', self._key, fields)
+
+
+class MemoryCollection:
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+
+    def document(self, document_id):
+        return MemoryDocument(self._db, self._name, document_id)
+
+
+class MemoryFirestore:
+    """
+    In-memory document store for the subset of the Firestore client the
+    routes use: collection().document() with get, set(merge=) and field-path
+    update(). update() on a missing document raises NotFound, as Firestore
+    does. Every operation goes through write(), so one wrapper times them all.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.documents = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        return MemoryCollection(self, name)
+
+    def seed(self, collection, document_id, data):
+        self.documents[(collection, document_id)] = data
+
+    def write(self, op, key, data=None, merge=False):
+        self.latency.wait()
+        with self._lock:
+            if op == 'get':
+                return self.documents.get(key)
+            if op == 'set':
+                if merge and key in self.documents:
+                    _merge(self.documents[key], data)
+                else:
+                    self.documents[key] = data
+                return None
+
+            if key not in self.documents:
+                from google.api_core.exceptions import NotFound
+
+                raise NotFound(f"No document to update: {key[0]}/{key[1]}")
+            for path, value in data.items():
+                target = self.documents[key]
+                parts = _field_path(path)
+                for part in parts[:-1]:
+                    target = target.setdefault(part, {})
+                target[parts[-1]] = value
+            return None
+
+
+def _hashed_vector(tokens, dimensions):
+    vector = np.zeros(dimensions, dtype='float32')
+    for token in tokens:
+        digest = hashlib.md5(token.encode('utf-8')).digest()
+        vector[int.from_bytes(digest[:4], 'little') % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class FakeSentenceModel:
+    """
+    mpnet stand-in: unit-length hashed bag-of-words vectors, so reports that
+    share words with a condition still land near it. Costs microseconds.
+    """
+
+    def __init__(self, dimensions=768):
+        self.dimensions = dimensions
+
+    def encode(self, texts, batch_size=32, **options):
+        return np.stack([_hashed_vector(re.findall(r'\w+', text.lower()), self.dimensions) for text in texts])
+
+
+class FakeFaceService:
+    """
+    Facenet stand-in: embeds a downscaled grayscale thumbnail, so the same
+    photo always maps to the same vector. No face detection.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = latency or Latency()
+        self.calls = 0
+
+    def embed(self, img, detector_backend=None):
+        import cv2
+
+        self.latency.wait()
+        self.calls += 1
+        thumbnail = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), (8, 16), interpolation=cv2.INTER_AREA)
+        vector = thumbnail.astype('float32').ravel() - 127.5
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def stats(self):
+        return {'fake': True, 'calls': self.calls}
@@ -0,0 +1,98 @@
+"""
+Input helpers shared by the bulk command-line tools (enroll_faces.py,
+backfill_reports.py): files in a directory or .zip archive named by Aadhaar
+number, an optional CSV manifest, and the append-only checkpoint file.
+"""
+import calendar
+import csv
+import os
+import re
+import zipfile
+
+
+_AADHAAR_NAME = re.compile(r'^(\d+)(?:_[^/]*)?$')
+_AADHAAR_NUMBER = re.compile(r'^\d{12}$')
+
+
+def valid_aadhaar(aadhaar):
+    """Whether aadhaar has the 12-digit format the HTTP routes require."""
+    return bool(_AADHAAR_NUMBER.match(aadhaar or ''))
+
+
+def aadhaar_from_path(path):
+    """
+    Aadhaar number encoded in a file's path, or None.
+
+    Accepts <aadhaar>.jpg, <aadhaar>_<n>.jpg and <aadhaar>/<anything>.jpg.
+    """
+    parts = path.replace('\\', '/').split('/')
+    stem = os.path.splitext(parts[-1])[0]
+    match = _AADHAAR_NAME.match(stem)
+    if match:
+        return match.group(1)
+    if len(parts) > 1 and parts[-2].isdigit():
+        return parts[-2]
+    return None
+
+
+class FileSource:
+    """Files in a directory or zip archive, addressed by relative path."""
+
+    def __init__(self, path, extensions):
+        self.path = path
+        self.extensions = tuple(extensions)
+        self._zip = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+
+    def names(self):
+        if self._zip is not None:
+            names = [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        else:
+            names = []
+            for root, _, files in os.walk(self.path):
+                for name in files:
+                    names.append(os.path.relpath(os.path.join(root, name), self.path).replace(os.sep, '/'))
+        return sorted(name for name in names if name.lower().endswith(self.extensions))
+
+    def read(self, name):
+        if self._zip is not None:
+            return self._zip.read(name)
+        with open(os.path.join(self.path, name), 'rb') as f:
+            return f.read()
+
+    def modified_ns(self, name):
+        """Modification time of a file in nanoseconds; zip entry times are read as UTC."""
+        if self._zip is not None:
+            return calendar.timegm(self._zip.getinfo(name).date_time + (0, 0, 0)) * 10 ** 9
+        return os.stat(os.path.join(self.path, name)).st_mtime_ns
+
+
+def list_files(source, manifest=None):
+    """
+    (aadhaar, name) pairs to process, from the manifest or from file names.
+
+    Returns:
+        tuple: (pairs, names whose Aadhaar number could not be determined)
+    """
+    if manifest:
+        with open(manifest, newline='') as f:
+            rows = [row for row in csv.reader(f) if row and not row[0].startswith('#')]
+        if rows and not rows[0][0].strip().isdigit():
+            rows = rows[1:]  # header
+        return [(row[0].strip(), row[1].strip()) for row in rows], []
+
+    pairs = []
+    unnamed = []
+    for name in source.names():
+        aadhaar = aadhaar_from_path(name)
+        if aadhaar is None:
+            unnamed.append(name)
+        else:
+            pairs.append((aadhaar, name))
+    return pairs, unnamed
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
@@ -0,0 +1,95 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+CACHE_DIR = os.environ.get(
+    'MEDSNAP_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'),
+)
+
+
+def condition_cache_key(conditions, model_name):
+    """
+    Hash of the embedding model name and the ordered condition list.
+
+    The FAISS row ids map back to positions in the list, so a reorder has to
+    invalidate the cache just like an added or renamed condition.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode('utf-8'))
+    for condition in conditions:
+        digest.update(b'\0')
+        digest.update(condition.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def _read_index(index_path):
+    import faiss
+
+    # Memory-map the index so every worker on the host shares the same pages;
+    # older FAISS builds can't mmap flat indexes, so fall back to a plain read
+    try:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception:
+        return faiss.read_index(index_path)
+
+
+def _atomic_save(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    # Several workers may build the cache at once; rename is atomic so
+    # readers only ever see a complete file
+    os.replace(tmp_path, path)
+
+
+def load_condition_index(conditions, model_name, encode, cache_dir=CACHE_DIR):
+    """
+    Load the FAISS index of condition embeddings from disk, building and
+    saving it only when the condition list or model changed.
+
+    Args:
+        conditions (list): Condition names, in the order used for lookups
+        model_name (str): Name of the embedding model
+        encode (callable): Encodes a list of strings, called only on a miss
+        cache_dir (str): Directory holding the cached files
+
+    Returns:
+        faiss.Index: L2 index whose row i is the embedding of conditions[i]
+    """
+    import faiss
+
+    key = condition_cache_key(conditions, model_name)
+    index_path = os.path.join(cache_dir, f'conditions-{key}.faiss')
+    embeddings_path = os.path.join(cache_dir, f'conditions-{key}.npy')
+
+    if os.path.exists(index_path):
+        try:
+            index = _read_index(index_path)
+            if index.ntotal == len(conditions):
+                print(f"Loaded cached condition index {key}")
+                return index
+        except Exception as e:
+            print(f"Error reading cached condition index: {str(e)}")
+
+    embeddings = np.ascontiguousarray(encode(conditions), dtype='float32')
+    index = faiss.IndexFlatL2(embeddings.shape[1])
+    index.add(embeddings)
+
+    def save_embeddings(path):
+        # np.save appends .npy to bare paths, so write through a file object
+        with open(path, 'wb') as f:
+            np.save(f, embeddings)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _atomic_save(embeddings_path, save_embeddings)
+        _atomic_save(index_path, lambda path: faiss.write_index(index, path))
+        print(f"Saved condition index {key} to {cache_dir}")
+    except Exception as e:
+        # A read-only filesystem shouldn't stop the app from serving
+        print(f"Error saving condition index: {str(e)}")
+
+    return index
+
@@ -0,0 +1,236 @@
+"""
+Bulk face enrollment for onboarding a hospital's existing patient photos.
+
+Takes a directory or .zip archive of photos named by Aadhaar number:
+
+    1234567890.jpg            one photo
+    1234567890_2.jpg          further photos of the same patient
+    1234567890/front.jpg      or a folder per patient
+
+or a CSV manifest (--manifest) with "aadhaar,path" rows, paths relative to
+the source. Photos are decoded at reduced resolution and embedded in chunks
+across worker processes, each running one Facenet forward pass per chunk.
+Points go to Qdrant in large batches with wait=False, so the server indexes
+while we embed; every ENROLL_CHECKPOINT_EVERY batches, and for the last
+one, the upsert waits until it is applied.
+
+Point ids are derived from the Aadhaar number and the image bytes, so
+re-running over the same photos overwrites rather than duplicates. The
+checkpoint file lists every photo Qdrant has applied, written only after a
+waited upsert; after a crash, re-run the same command to pick up where it
+stopped. Photos that fail (no face found, an Aadhaar number that isn't 12
+digits) are appended to <checkpoint>.errors and tried again on
+the next run.
+With --hospital every point is tagged so searches can be filtered to it.
+
+Usage:
+    python enroll_faces.py photos/ [--manifest photos.csv] [--workers 4]
+    python enroll_faces.py photos.zip --hospital AIIMS-DEL --batch-size 512
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bulk_source import FileSource, list_files, load_checkpoint, valid_aadhaar
+from face_preprocess import decode_image
+from face_search import face_point
+
+
+ENROLL_BATCH_SIZE = int(os.environ.get('ENROLL_BATCH_SIZE', '256'))
+ENROLL_CHUNK_SIZE = int(os.environ.get('ENROLL_CHUNK_SIZE', '32'))
+# Batches sent with wait=False between waited upserts; the checkpoint only
+# records photos up to the last waited one
+ENROLL_CHECKPOINT_EVERY = int(os.environ.get('ENROLL_CHECKPOINT_EVERY', '8'))
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+_worker_source = None
+_worker_hospital = None
+
+
+def _init_worker(source_path, hospital=None):
+    global _worker_source, _worker_hospital
+    from face_service import face_service
+
+    _worker_source = FileSource(source_path, IMAGE_EXTENSIONS)
+    _worker_hospital = hospital
+    # Load Facenet once per process, before the first chunk arrives
+    face_service.load()
+
+
+def embed_chunk(chunk):
+    """
+    Read, decode and embed a chunk of (aadhaar, name) pairs in one forward
+    pass. Runs in a worker process.
+
+    Returns:
+        list: (aadhaar, name, point or None, error or None) per pair
+    """
+    from face_service import face_service
+
+    results = []
+    images = []
+    pending = []
+    for aadhaar, name in chunk:
+        try:
+            image_bytes = _worker_source.read(name)
+            img = decode_image(image_bytes)
+            if img is None:
+                raise ValueError("Could not decode image")
+        except Exception as e:
+            results.append((aadhaar, name, None, str(e)))
+            continue
+        images.append(img)
+        pending.append((aadhaar, name, image_bytes))
+
+    embeddings = face_service.embed_many(images) if images else []
+    for (aadhaar, name, image_bytes), embedding in zip(pending, embeddings):
+        if isinstance(embedding, Exception):
+            results.append((aadhaar, name, None, str(embedding)))
+        else:
+            results.append((aadhaar, name, face_point(aadhaar, embedding, image_bytes, hospital=_worker_hospital), None))
+    return results
+
+
+def enroll(source_path, store, manifest=None, checkpoint=None, workers=None,
+           batch_size=ENROLL_BATCH_SIZE, chunk_size=ENROLL_CHUNK_SIZE, hospital=None,
+           checkpoint_every=ENROLL_CHECKPOINT_EVERY):
+    """
+    Embed and upsert every photo in a source not already in the checkpoint.
+
+    Args:
+        source_path (str): Directory or zip archive of photos
+        store (FaceStore): Where to upsert the points
+        manifest (str): Optional CSV of aadhaar,path rows
+        checkpoint (str): File recording photos already enrolled
+        workers (int): Embedding processes (default: CPU count)
+        batch_size (int): Points per Qdrant upsert
+        chunk_size (int): Photos per Facenet forward pass
+        hospital (str): Hospital to tag the enrolled faces with
+        checkpoint_every (int): Batches per waited upsert and checkpoint write
+
+    Returns:
+        dict: Counts of enrolled, skipped and failed photos
+    """
+    source = FileSource(source_path, IMAGE_EXTENSIONS)
+    pairs, unnamed = list_files(source, manifest)
+    done = load_checkpoint(checkpoint)
+    todo = [(aadhaar, name) for aadhaar, name in pairs if name not in done]
+    invalid = [(aadhaar, name) for aadhaar, name in todo if not valid_aadhaar(aadhaar)]
+    todo = [(aadhaar, name) for aadhaar, name in todo if valid_aadhaar(aadhaar)]
+    counts = {'enrolled': 0, 'skipped': len(pairs) - len(todo) - len(invalid),
+              'failed': len(unnamed) + len(invalid)}
+    print(f"{len(pairs)} photos, {counts['skipped']} already enrolled, {len(todo)} to go")
+
+    checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+    errors_file = open(checkpoint + '.errors', 'a') if checkpoint else None
+    for name in unnamed:
+        print(f"{name}: no Aadhaar number in file name")
+        if errors_file:
+            errors_file.write(f"{name}\tno Aadhaar number in file name\n")
+    for aadhaar, name in invalid:
+        print(f"{name}: invalid Aadhaar number {aadhaar}")
+        if errors_file:
+            errors_file.write(f"{name}\tinvalid Aadhaar number {aadhaar}\n")
+
+    batch = []
+    batch_names = []
+    unconfirmed = []
+    last_sent = []
+    sent_since_wait = 0
+
+    def flush(final=False):
+        nonlocal last_sent, sent_since_wait
+        if batch:
+            sent_since_wait += 1
+            wait = final or sent_since_wait >= checkpoint_every
+            last_sent = list(batch)
+            store.upsert(last_sent, wait=wait)
+            counts['enrolled'] += len(batch)
+            unconfirmed.extend(batch_names)
+            batch.clear()
+            batch_names.clear()
+        elif final and unconfirmed:
+            # The last batch went out unwaited; point ids are deterministic,
+            # so sending it again with wait=True is harmless
+            store.upsert(last_sent, wait=True)
+            wait = True
+        else:
+            return
+        if not wait:
+            return
+        # Only record photos once a waited upsert has returned: Qdrant
+        # applies updates in order, so the unwaited batches before it are
+        # applied too. A crash re-sends everything after the last one.
+        if checkpoint_file and unconfirmed:
+            checkpoint_file.write(''.join(f"{name}\n" for name in unconfirmed))
+            checkpoint_file.flush()
+        unconfirmed.clear()
+        sent_since_wait = 0
+
+    started = time.perf_counter()
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(source_path, hospital)) as executor:
+            for results in executor.map(embed_chunk, chunks):
+                for aadhaar, name, point, error in results:
+                    if error is not None:
+                        counts['failed'] += 1
+                        print(f"{name}: {error}")
+                        if errors_file:
+                            errors_file.write(f"{name}\t{error}\n")
+                        continue
+                    batch.append(point)
+                    batch_names.append(name)
+                    if len(batch) >= batch_size:
+                        flush()
+                        elapsed = time.perf_counter() - started
+                        print(f"enrolled {counts['enrolled']}/{len(todo)} "
+                              f"({counts['enrolled'] / elapsed:.1f} photos/s)")
+            flush(final=True)
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+        if errors_file:
+            errors_file.close()
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Directory or .zip archive of photos')
+    parser.add_argument('--manifest', help='CSV of aadhaar,path rows instead of Aadhaar-named files')
+    parser.add_argument('--hospital', help='Tag enrolled faces with this hospital id')
+    parser.add_argument('--checkpoint', help='Progress file (default: <source>.enrolled)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=ENROLL_BATCH_SIZE)
+    parser.add_argument('--chunk-size', type=int, default=ENROLL_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+
+    from face_store import QDRANT_API_KEY, QDRANT_URL, FaceStore
+
+    # No background sync for a one-off run; the serving processes pull
+    # these points into their mirrors themselves
+    store = FaceStore(QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY), sync_interval=0)
+    store.start()
+
+    counts = enroll(
+        args.source,
+        store,
+        manifest=args.manifest,
+        checkpoint=args.checkpoint or args.source.rstrip('/\\') + '.enrolled',
+        workers=args.workers,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        hospital=args.hospital,
+    )
+    print(f"enrolled {counts['enrolled']}, skipped {counts['skipped']}, failed {counts['failed']}")
+
+
+if __name__ == '__main__':
+    main()
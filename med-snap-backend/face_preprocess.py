@@ -0,0 +1,81 @@
+import os
+
+import cv2
+import numpy as np
+
+
+# Longest image side handed to face detection. Facenet only ever sees a
+# 160x160 crop, so anything much above this is wasted decode and detector
+# time on 12MP phone photos.
+FACE_MAX_SIDE = int(os.environ.get('FACE_MAX_SIDE', '1024'))
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# JPEG start-of-frame markers carry the image size; C4, C8 and CC share the
+# range but are other segment types
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_dimensions(data):
+    """
+    Read (width, height) from a JPEG or PNG header without decoding pixels.
+
+    Returns:
+        tuple: (width, height), or None for other formats or corrupt headers
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before the real marker
+            i += 1
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+
+def decode_image(data, max_side=FACE_MAX_SIDE):
+    """
+    Decode an uploaded photo at reduced resolution, longest side <= max_side.
+
+    JPEGs are decoded with libjpeg's DCT scaling (IMREAD_REDUCED_COLOR_*),
+    which skips most of the work and never allocates the full-size bitmap;
+    the result is then resized down to the cap.
+
+    Returns:
+        numpy.ndarray: BGR image, or None if the data can't be decoded
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    flag = cv2.IMREAD_COLOR
+    dimensions = image_dimensions(data)
+    if dimensions and max_side:
+        longest = max(dimensions)
+        for factor, reduced_flag in _REDUCED_FLAGS:
+            if longest // factor >= max_side:
+                flag = reduced_flag
+                break
+
+    img = cv2.imdecode(buffer, flag)
+    if img is None or not max_side:
+        return img
+
+    longest = max(img.shape[:2])
+    if longest > max_side:
+        scale = max_side / longest
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return img
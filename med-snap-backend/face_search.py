@@ -0,0 +1,216 @@
+import hashlib
+import os
+import time
+import uuid
+from collections import namedtuple
+
+import numpy as np
+
+
+FACE_COLLECTION = "face_data"
+# Scores assume the collection uses cosine distance, so they are similarities
+# in [-1, 1]; a best match below the threshold is reported as "no match"
+FACE_MATCH_THRESHOLD = float(os.environ.get('FACE_MATCH_THRESHOLD', '0.7'))
+FACE_SEARCH_TOP_K = int(os.environ.get('FACE_SEARCH_TOP_K', '5'))
+# HNSW beam width at query time: higher finds the true nearest neighbours
+# more often as the collection grows, at the cost of latency
+FACE_SEARCH_HNSW_EF = int(os.environ.get('FACE_SEARCH_HNSW_EF', '128'))
+# Re-score the candidates against their stored faces; costs one batched
+# request on top of the search
+FACE_RERANK = os.environ.get('FACE_RERANK', '1') == '1'
+# With a quantized collection the HNSW walk scores compressed vectors; fetch
+# oversampling * top_k candidates and rescore them with the original vectors
+# so quantization error doesn't reorder the top matches
+FACE_SEARCH_RESCORE = os.environ.get('FACE_SEARCH_RESCORE', '1') == '1'
+FACE_SEARCH_OVERSAMPLING = float(os.environ.get('FACE_SEARCH_OVERSAMPLING', '2.0'))
+MAX_EMBEDDINGS_PER_PATIENT = int(os.environ.get('FACE_MAX_EMBEDDINGS_PER_PATIENT', '10'))
+
+
+FaceMatch = namedtuple('FaceMatch', ['aadhaar', 'score', 'candidates'])
+
+# Fixed namespace so the same photo of the same patient always maps to the
+# same point id, making re-uploads and resumed enrollments idempotent
+_FACE_POINT_NAMESPACE = uuid.UUID('5b0c8a52-4f5e-4c59-9d57-3f1a6b0e2d41')
+
+
+def face_point_id(aadhaar, image_bytes):
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return str(uuid.uuid5(_FACE_POINT_NAMESPACE, f"{aadhaar}:{digest}"))
+
+
+def face_point(aadhaar, embedding, image_bytes, payload=None, hospital=None):
+    """
+    Point for one enrolled face. Patients may have several; each carries
+    its Aadhaar number, enrollment time and, if given, the enrolling
+    hospital in the payload.
+    """
+    point_payload = {'aadhaar': int(aadhaar), 'enrolled_at': time.time()}
+    if hospital:
+        point_payload['hospital'] = hospital
+    point_payload.update(payload or {})
+    return {
+        "id": face_point_id(aadhaar, image_bytes),
+        "vector": embedding,
+        "payload": point_payload,
+    }
+
+
+def patient_of(point):
+    """
+    Aadhaar number a stored point belongs to. Points written before faces
+    carried a payload used the Aadhaar number as the point id.
+    """
+    payload = getattr(point, 'payload', None) or {}
+    return payload.get('aadhaar', point.id)
+
+
+def search_params(hnsw_ef=FACE_SEARCH_HNSW_EF, rescore=FACE_SEARCH_RESCORE,
+                  oversampling=FACE_SEARCH_OVERSAMPLING):
+    from qdrant_client.http.models import QuantizationSearchParams, SearchParams
+
+    # Ignored by the server when the collection isn't quantized
+    quantization = QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+    return SearchParams(hnsw_ef=hnsw_ef, quantization=quantization)
+
+
+def face_filter(hospital=None, query_filter=None):
+    """Combine a hospital restriction with an optional caller filter."""
+    if not hospital:
+        return query_filter
+
+    from qdrant_client.http.models import FieldCondition, Filter, MatchValue
+
+    condition = FieldCondition(key='hospital', match=MatchValue(value=hospital))
+    if query_filter is None:
+        return Filter(must=[condition])
+    return Filter(must=[condition, query_filter])
+
+
+def candidate_filter(patient):
+    """
+    Every stored face of one patient: points carrying its Aadhaar number in
+    the payload, plus the legacy point whose id is the Aadhaar number.
+    """
+    from qdrant_client.http.models import FieldCondition, Filter, HasIdCondition, MatchValue
+
+    conditions = [FieldCondition(key='aadhaar', match=MatchValue(value=patient))]
+    if isinstance(patient, int):
+        conditions.append(HasIdCondition(has_id=[patient]))
+    return Filter(should=conditions)
+
+
+def _cosine(query, vectors):
+    query = np.asarray(query, dtype='float32')
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    return vectors @ query / np.maximum(norms, 1e-12)
+
+
+def candidates_of(hits):
+    """Distinct patients behind the hits, nearest first."""
+    return list(dict.fromkeys(patient_of(hit) for hit in hits))
+
+
+def rank_candidates(query, hits, stored=None):
+    """
+    Rank the patients behind the top-k hits.
+
+    Without stored vectors each patient scores its best hit. With stored
+    vectors ({aadhaar: [vector, ...]}, see stored_faces) every patient is
+    scored as the mean similarity to those faces, which is more robust to one
+    unusually close photo of a different person than the single nearest hit.
+    The rule is the same however many candidates there are; a patient whose
+    stored faces could not be fetched falls back to its best hit.
+
+    Returns:
+        list: (aadhaar, score) pairs, best first
+    """
+    scores = {}
+    for hit in hits:
+        patient = patient_of(hit)
+        scores[patient] = max(scores.get(patient, -1.0), float(hit.score))
+
+    if stored is not None:
+        for patient in scores:
+            vectors = stored.get(patient)
+            if vectors is not None and len(vectors):
+                scores[patient] = float(np.mean(_cosine(query, vectors)))
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def best_match(ranked, threshold=FACE_MATCH_THRESHOLD):
+    """FaceMatch for the top candidate, or None if it is below the threshold."""
+    if not ranked or ranked[0][1] < threshold:
+        return None
+    patient, score = ranked[0]
+    return FaceMatch(patient, score, ranked)
+
+
+def stored_faces(client, embedding, patients, hnsw_ef=FACE_SEARCH_HNSW_EF):
+    """
+    Each candidate's stored faces nearest the query, at most
+    MAX_EMBEDDINGS_PER_PATIENT per patient.
+
+    One batched request with a filtered search per patient, so re-ranking
+    costs a single extra round trip and a patient with many faces can't use
+    up another candidate's share of a shared limit.
+
+    Returns:
+        dict: {aadhaar: [vector, ...]}
+    """
+    from qdrant_client.http.models import SearchRequest
+
+    if not patients:
+        return {}
+    results = client.search_batch(
+        collection_name=FACE_COLLECTION,
+        requests=[
+            SearchRequest(
+                vector=embedding,
+                filter=candidate_filter(patient),
+                limit=MAX_EMBEDDINGS_PER_PATIENT,
+                params=search_params(hnsw_ef),
+                with_payload=False,
+                with_vector=True,
+            )
+            for patient in patients
+        ],
+    )
+    return {
+        patient: [point.vector for point in points if point.vector is not None]
+        for patient, points in zip(patients, results)
+    }
+
+
+def search_face_embedding(client, embedding, top_k=FACE_SEARCH_TOP_K, threshold=FACE_MATCH_THRESHOLD,
+                          hnsw_ef=FACE_SEARCH_HNSW_EF, rerank=FACE_RERANK, query_filter=None,
+                          hospital=None):
+    """
+    Find the patient a face embedding belongs to.
+
+    Args:
+        client (QdrantClient): Client for the face collection
+        embedding (list): Facenet embedding of the query face
+        top_k (int): Nearest points to consider
+        threshold (float): Minimum similarity to accept a match
+        hnsw_ef (int): HNSW search beam width
+        rerank (bool): Score candidates against their stored faces
+        query_filter (Filter): Optional payload filter for the search
+        hospital (str): Only match faces enrolled by this hospital
+
+    Returns:
+        tuple: (FaceMatch or None, ranked candidates)
+    """
+    hits = client.search(
+        collection_name=FACE_COLLECTION,
+        query_vector=embedding,
+        query_filter=face_filter(hospital, query_filter),
+        limit=top_k,
+        search_params=search_params(hnsw_ef),
+        with_payload=True,
+    )
+
+    stored = stored_faces(client, embedding, candidates_of(hits), hnsw_ef) if rerank else None
+    ranked = rank_candidates(embedding, hits, stored)
+    return best_match(ranked, threshold), ranked
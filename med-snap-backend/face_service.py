@@ -0,0 +1,159 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from batching import MicroBatcher
+from metrics import span, traced
+from model_registry import registry
+
+
+FACE_MODEL_NAME = 'Facenet'
+FACE_DETECTOR = os.environ.get('FACE_DETECTOR', 'opencv')
+FACE_MAX_BATCH_SIZE = int(os.environ.get('FACE_MAX_BATCH_SIZE', '32'))
+FACE_MAX_WAIT_MS = float(os.environ.get('FACE_MAX_WAIT_MS', '5'))
+
+
+# deepface is the DeepFace module, model the built Facenet client, and
+# batched whether this DeepFace release exposes what the batched path needs
+Facenet = namedtuple('Facenet', ['deepface', 'model', 'batched'])
+
+
+def _supports_batching(DeepFace, model):
+    """
+    Whether detect_face/_forward can run against this DeepFace release; its
+    preprocessing helpers and model attributes moved between versions.
+    """
+    try:
+        from deepface.modules import preprocessing
+    except ImportError:
+        return False
+    return all([
+        hasattr(DeepFace, 'extract_faces'),
+        hasattr(preprocessing, 'resize_image'),
+        hasattr(preprocessing, 'normalize_input'),
+        hasattr(model, 'model'),
+        hasattr(model, 'input_shape'),
+    ])
+
+
+def _load_facenet():
+    from deepface import DeepFace
+
+    # build_model caches Facenet inside DeepFace, so later represent() calls
+    # reuse the resident weights
+    model = DeepFace.build_model(FACE_MODEL_NAME)
+    batched = _supports_batching(DeepFace, model)
+    if not batched:
+        print("Batched face embedding unavailable in this DeepFace release, using DeepFace.represent")
+    return Facenet(DeepFace, model, batched)
+
+
+registry.register('facenet', _load_facenet)
+
+
+class FaceEmbeddingService:
+    """
+    Facenet embeddings with concurrent requests batched into one forward pass.
+
+    Face detection and alignment run on the calling request's thread, since
+    detectors work one image at a time. The aligned 160x160 crops are then
+    handed to a micro-batcher that stacks whatever arrived within
+    FACE_MAX_WAIT_MS and runs the resident Facenet model once for all of
+    them. Releases of DeepFace without the pieces that needs fall back to
+    DeepFace.represent per image; the loader decides which, once.
+    """
+
+    def __init__(self):
+        self._batcher = MicroBatcher(
+            self._forward,
+            max_batch_size=FACE_MAX_BATCH_SIZE,
+            max_wait_ms=FACE_MAX_WAIT_MS,
+            workers=1,
+            name='face-embedding',
+        )
+
+    @traced('face_detect')
+    def detect_face(self, img, detector_backend=FACE_DETECTOR):
+        """
+        Detect, align and normalize the first face the way DeepFace.represent
+        does, returning the model-ready crop so detection runs only once.
+
+        Raises:
+            ValueError: If no face is detected
+        """
+        from deepface.modules import preprocessing
+
+        facenet = registry.get('facenet')
+        faces = facenet.deepface.extract_faces(
+            img_path=img,
+            detector_backend=detector_backend,
+            enforce_detection=True,
+            align=True,
+        )
+        # extract_faces returns RGB; represent feeds the model BGR
+        face = faces[0]['face'][:, :, ::-1]
+        target_size = facenet.model.input_shape
+        face = preprocessing.resize_image(img=face, target_size=(target_size[1], target_size[0]))
+        return preprocessing.normalize_input(img=face, normalization='base')
+
+    def _forward(self, faces):
+        batch = np.concatenate(faces, axis=0)
+        with span('facenet_forward'):
+            embeddings = registry.get('facenet').model.model(batch, training=False).numpy()
+        return [embedding.tolist() for embedding in embeddings]
+
+    def load(self):
+        """Load Facenet now rather than on the first embedding."""
+        return registry.get('facenet')
+
+    def embed_face(self, face):
+        """Embed a crop from detect_face, batched with other in-flight requests."""
+        return self._batcher.submit(face).result()
+
+    def embed(self, img, detector_backend=FACE_DETECTOR):
+        """
+        Return the Facenet embedding of the first face in a BGR image.
+
+        Raises:
+            ValueError: If no face is detected
+        """
+        facenet = registry.get('facenet')
+        if facenet.batched:
+            return self.embed_face(self.detect_face(img, detector_backend))
+        return facenet.deepface.represent(
+            img, model_name=FACE_MODEL_NAME, detector_backend=detector_backend)[0]['embedding']
+
+    def embed_many(self, imgs, detector_backend=FACE_DETECTOR):
+        """
+        Embed many images in one forward pass, without the micro-batcher.
+        Used by bulk enrollment, which already has its images in hand.
+
+        Returns:
+            list: Embedding per image, or the Exception raised for it
+        """
+        batched = registry.get('facenet').batched
+        results = [None] * len(imgs)
+        faces = []
+        for position, img in enumerate(imgs):
+            try:
+                if batched:
+                    faces.append((position, self.detect_face(img, detector_backend)))
+                else:
+                    results[position] = self.embed(img, detector_backend)
+            except Exception as e:
+                results[position] = e
+
+        if faces:
+            embeddings = self._forward([face for _, face in faces])
+            for (position, _), embedding in zip(faces, embeddings):
+                results[position] = embedding
+        return results
+
+    def stats(self):
+        stats = self._batcher.stats()
+        stats['batched'] = registry.get('facenet').batched if registry.is_loaded('facenet') else None
+        return stats
+
+
+face_service = FaceEmbeddingService()
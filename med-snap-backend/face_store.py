@@ -0,0 +1,392 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from condition_index import CACHE_DIR
+from face_search import FACE_COLLECTION, search_face_embedding
+
+
+QDRANT_URL = "QDRANT URL"
+QDRANT_API_KEY = "QDRANT API KEY"
+
+# remote:   every call goes to the Qdrant server (the original behaviour)
+# fallback: search the server, answer from the local mirror if it fails
+# local:    search the local mirror; writes go to both, server writes are
+#           queued while it is unreachable
+# offline:  local mirror only, no server at all (development and tests)
+FACE_STORE_MODE = os.environ.get('FACE_STORE_MODE', 'remote')
+FACE_LOCAL_PATH = os.environ.get('FACE_LOCAL_PATH', os.path.join(CACHE_DIR, 'face_data'))
+FACE_SYNC_INTERVAL = float(os.environ.get('FACE_SYNC_INTERVAL_SECONDS', '60'))
+FACE_SYNC_BATCH_SIZE = int(os.environ.get('FACE_SYNC_BATCH_SIZE', '1000'))
+# Writers stamp synced_at with their own clock just before a point reaches the
+# server, so an incremental sync re-reads this much before the newest stamp
+# it has seen to cover clock skew between writers and in-flight upserts
+FACE_SYNC_OVERLAP = float(os.environ.get('FACE_SYNC_OVERLAP_SECONDS', '300'))
+FACE_VECTOR_SIZE = 128  # Facenet
+# HNSW graph degree and build-time beam width for the face collection; only
+# applied when the collection is created
+FACE_HNSW_M = int(os.environ.get('FACE_HNSW_M', '16'))
+FACE_HNSW_EF_CONSTRUCT = int(os.environ.get('FACE_HNSW_EF_CONSTRUCT', '200'))
+# Per million faces the float32 vectors take ~512 MB. With quantization the
+# originals live on disk (FACE_VECTORS_ON_DISK) and only the compressed copy
+# stays in RAM: int8 scalar ~128 MB, product (x16) ~32 MB. Searches rescore
+# the top candidates against the on-disk originals, see face_search.
+#   scalar:  int8, ~4x smaller, near-lossless for Facenet embeddings
+#   product: ~16x smaller, lossier; relies on rescoring
+#   none:    raw float vectors in RAM (the original layout)
+FACE_QUANTIZATION = os.environ.get('FACE_QUANTIZATION', 'scalar')
+FACE_VECTORS_ON_DISK = os.environ.get('FACE_VECTORS_ON_DISK', '1') == '1'
+# Payload fields searches and the mirror sync filter on
+FACE_PAYLOAD_INDEXES = {
+    'aadhaar': 'integer',
+    'hospital': 'keyword',
+    'enrolled_at': 'float',
+    'synced_at': 'float',
+}
+
+
+def face_quantization_config(kind=FACE_QUANTIZATION):
+    from qdrant_client.http.models import (
+        CompressionRatio,
+        ProductQuantization,
+        ProductQuantizationConfig,
+        ScalarQuantization,
+        ScalarQuantizationConfig,
+        ScalarType,
+    )
+
+    if kind == 'scalar':
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8,
+            quantile=0.99,
+            always_ram=True,
+        ))
+    if kind == 'product':
+        return ProductQuantization(product=ProductQuantizationConfig(
+            compression=CompressionRatio.X16,
+            always_ram=True,
+        ))
+    if kind == 'none':
+        return None
+    raise ValueError(f"Unknown FACE_QUANTIZATION: {kind}")
+
+
+def ensure_face_collection(client):
+    """
+    Bring the face collection to the layout search relies on: cosine
+    distance, Facenet vector size, quantized in-RAM copy of on-disk vectors
+    and payload indexes for the filters.
+
+    A missing collection is created. An existing one created before this
+    layout (raw vectors, no payload indexes) is updated in place; Qdrant
+    builds the quantized copy and indexes in the background. Distance and
+    vector size can't be changed in place, and the match threshold and
+    re-ranking assume cosine similarity of Facenet vectors, so a collection
+    with any other layout is an error. Call once at startup, not per request.
+
+    Returns:
+        bool: True if the collection was created or changed
+
+    Raises:
+        ValueError: If the existing collection isn't cosine over
+            FACE_VECTOR_SIZE-dimensional vectors
+    """
+    from qdrant_client.http.models import Distance, HnswConfigDiff, VectorParams, VectorParamsDiff
+
+    quantization = face_quantization_config()
+    changed = False
+    if not client.collection_exists(FACE_COLLECTION):
+        client.create_collection(
+            collection_name=FACE_COLLECTION,
+            vectors_config=VectorParams(
+                size=FACE_VECTOR_SIZE,
+                distance=Distance.COSINE,
+                on_disk=FACE_VECTORS_ON_DISK and quantization is not None,
+            ),
+            hnsw_config=HnswConfigDiff(m=FACE_HNSW_M, ef_construct=FACE_HNSW_EF_CONSTRUCT),
+            quantization_config=quantization,
+        )
+        indexed = {}
+        changed = True
+    else:
+        info = client.get_collection(FACE_COLLECTION)
+        vectors = info.config.params.vectors
+        if isinstance(vectors, dict):
+            vectors = vectors.get('')
+        if vectors is None or vectors.distance != Distance.COSINE or vectors.size != FACE_VECTOR_SIZE:
+            if vectors is None:
+                layout = "only named vectors"
+            else:
+                layout = f"{getattr(vectors.distance, 'value', vectors.distance)} distance, size {vectors.size}"
+            raise ValueError(
+                f"Qdrant collection {FACE_COLLECTION} has {layout}; face search needs "
+                f"{Distance.COSINE.value} distance over {FACE_VECTOR_SIZE}-dimensional vectors"
+            )
+        indexed = info.payload_schema or {}
+        if quantization is not None and info.config.quantization_config is None:
+            client.update_collection(
+                collection_name=FACE_COLLECTION,
+                vectors_config={'': VectorParamsDiff(on_disk=FACE_VECTORS_ON_DISK)},
+                quantization_config=quantization,
+            )
+            changed = True
+
+    for field, schema in FACE_PAYLOAD_INDEXES.items():
+        if field not in indexed:
+            client.create_payload_index(FACE_COLLECTION, field, field_schema=schema)
+            changed = True
+    return changed
+
+
+def _point_dict(point):
+    return {'id': point.id, 'vector': point.vector, 'payload': point.payload or {}}
+
+
+def _stamped(points):
+    """Copies of points with synced_at set to now, for a write to the server."""
+    now = time.time()
+    return [dict(point, payload={**(point.get('payload') or {}), 'synced_at': now}) for point in points]
+
+
+class FaceStore:
+    """
+    Face collection access with an optional embedded Qdrant mirror.
+
+    The mirror runs Qdrant in local mode (on-disk, in-process) with the same
+    collection layout as the server, so the same search code answers from
+    either. A background thread replays queued upserts to the server once it
+    is reachable and pulls points enrolled elsewhere into the mirror.
+
+    Qdrant local mode locks its directory, so each serving process needs its
+    own FACE_LOCAL_PATH.
+    """
+
+    def __init__(self, remote=None, mode=FACE_STORE_MODE, local_path=FACE_LOCAL_PATH,
+                 sync_interval=FACE_SYNC_INTERVAL):
+        self.remote = remote
+        self.mode = mode
+        self._local_path = local_path
+        self._sync_interval = sync_interval
+        self._local = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._sync_thread = None
+        self._start_lock = threading.Lock()
+        self._started = False
+        self.collection_error = None
+        self.last_sync = None
+        self.local_searches = 0
+        self.remote_failures = 0
+
+    @property
+    def uses_local(self):
+        return self.mode in ('fallback', 'local', 'offline')
+
+    @property
+    def local(self):
+        if self._local is None:
+            with self._lock:
+                if self._local is None:
+                    from qdrant_client import QdrantClient
+                    from qdrant_client.http.models import Distance, VectorParams
+
+                    os.makedirs(self._local_path, exist_ok=True)
+                    local = QdrantClient(path=self._local_path)
+                    # Local mode searches exhaustively and ignores quantization
+                    # and payload indexes, so the mirror keeps the plain layout
+                    if not local.collection_exists(FACE_COLLECTION):
+                        local.create_collection(
+                            collection_name=FACE_COLLECTION,
+                            vectors_config=VectorParams(size=FACE_VECTOR_SIZE, distance=Distance.COSINE),
+                        )
+                    self._local = local
+                    self._start_sync()
+        return self._local
+
+    def start(self):
+        """
+        Make sure the server collection exists with the right layout, then
+        open the mirror and begin syncing, so it is warm before a failover.
+
+        Runs once per store; later calls return at once, so serving code can
+        call it from its startup hook or lazily before the first request.
+        A collection with the wrong layout is reported loudly and makes
+        search and upsert raise, rather than return meaningless scores.
+        """
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            if self.mode != 'offline':
+                try:
+                    if ensure_face_collection(self.remote):
+                        print(f"Updated Qdrant collection {FACE_COLLECTION} schema")
+                except ValueError as e:
+                    self.collection_error = str(e)
+                    print(f"ERROR: {self.collection_error}; face search and upload are disabled")
+                except Exception as e:
+                    print(f"Could not check Qdrant collection {FACE_COLLECTION}: {str(e)}")
+            if self.uses_local:
+                self.local
+
+    def _check_collection(self):
+        if self.collection_error:
+            raise ValueError(self.collection_error)
+
+    def _pending_db(self):
+        if self._pending is None:
+            os.makedirs(self._local_path, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self._local_path, 'pending.sqlite3'), check_same_thread=False)
+            conn.execute('CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY AUTOINCREMENT, points TEXT NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)')
+            conn.commit()
+            self._pending = conn
+        return self._pending
+
+    def search(self, embedding, **options):
+        """search_face_embedding against the server or the mirror, per mode."""
+        self._check_collection()
+        if self.mode in ('local', 'offline'):
+            self.local_searches += 1
+            return search_face_embedding(self.local, embedding, **options)
+
+        try:
+            return search_face_embedding(self.remote, embedding, **options)
+        except Exception as e:
+            if self.mode != 'fallback':
+                raise
+            self.remote_failures += 1
+            print(f"Qdrant search failed, answering from local mirror: {str(e)}")
+            self.local_searches += 1
+            return search_face_embedding(self.local, embedding, **options)
+
+    def upsert(self, points, wait=True):
+        """
+        Store face points. With a mirror they are written locally first, so
+        they are searchable at once, and queued if the server is unreachable.
+        """
+        self._check_collection()
+        if not self.uses_local:
+            self.remote.upsert(collection_name=FACE_COLLECTION, points=_stamped(points), wait=wait)
+            return
+
+        self.local.upsert(collection_name=FACE_COLLECTION, points=points)
+        if self.mode == 'offline':
+            return
+        try:
+            self.remote.upsert(collection_name=FACE_COLLECTION, points=_stamped(points), wait=wait)
+        except Exception as e:
+            self.remote_failures += 1
+            print(f"Qdrant upsert failed, queued for replay: {str(e)}")
+            with self._lock:
+                conn = self._pending_db()
+                conn.execute('INSERT INTO pending (points) VALUES (?)', (json.dumps(points),))
+                conn.commit()
+
+    def replay_pending(self):
+        """
+        Send queued upserts to the server in order; stops at the first failure.
+        Points are stamped at replay time, so other mirrors pick up faces
+        enrolled offline however long ago they were taken.
+        """
+        with self._lock:
+            conn = self._pending_db()
+            rows = conn.execute('SELECT id, points FROM pending ORDER BY id').fetchall()
+        replayed = 0
+        for row_id, points in rows:
+            self.remote.upsert(collection_name=FACE_COLLECTION, points=_stamped(json.loads(points)))
+            with self._lock:
+                conn.execute('DELETE FROM pending WHERE id = ?', (row_id,))
+                conn.commit()
+            replayed += 1
+        return replayed
+
+    def sync(self):
+        """
+        Pull points written to the server since the last sync into the mirror.
+
+        The first sync copies the whole collection; after that only points
+        whose synced_at payload, stamped when the write reached the server,
+        is past the watermark are fetched. Filtering on enrolled_at instead
+        would miss faces enrolled offline and replayed later.
+        """
+        from qdrant_client.http.models import FieldCondition, Filter, Range
+
+        with self._lock:
+            conn = self._pending_db()
+            row = conn.execute("SELECT value FROM sync_state WHERE key = 'synced_after'").fetchone()
+        synced_after = float(row[0]) if row else None
+
+        scroll_filter = None
+        if synced_after is not None:
+            scroll_filter = Filter(must=[FieldCondition(key='synced_at', range=Range(gt=synced_after))])
+
+        copied = 0
+        newest = synced_after
+        offset = None
+        while True:
+            points, offset = self.remote.scroll(
+                collection_name=FACE_COLLECTION,
+                scroll_filter=scroll_filter,
+                limit=FACE_SYNC_BATCH_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            if points:
+                self.local.upsert(collection_name=FACE_COLLECTION, points=[_point_dict(p) for p in points])
+                copied += len(points)
+                for point in points:
+                    stamp = (point.payload or {}).get('synced_at')
+                    if stamp is not None and (newest is None or stamp > newest):
+                        newest = stamp
+            if offset is None:
+                break
+
+        # The watermark trails the newest stamp seen so writes that landed
+        # while this sync ran, or from a writer with a lagging clock, are
+        # picked up next time; upserts are idempotent. Points without a
+        # stamp predate it and came over with the first full copy.
+        if newest is not None or synced_after is None:
+            watermark = (newest - FACE_SYNC_OVERLAP) if newest is not None else 0.0
+            if synced_after is not None:
+                watermark = max(watermark, synced_after)
+            with self._lock:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('synced_after', ?)",
+                    (str(watermark),),
+                )
+                conn.commit()
+        self.last_sync = time.time()
+        return copied
+
+    def _start_sync(self):
+        if self.mode == 'offline' or self._sync_thread is not None or self._sync_interval <= 0:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.replay_pending()
+                    self.sync()
+                except Exception as e:
+                    print(f"Face mirror sync failed: {str(e)}")
+                time.sleep(self._sync_interval)
+
+        self._sync_thread = threading.Thread(target=run, name='face-sync', daemon=True)
+        self._sync_thread.start()
+
+    def status(self):
+        status = {
+            'mode': self.mode,
+            'collection_error': self.collection_error,
+            'last_sync': self.last_sync,
+            'local_searches': self.local_searches,
+            'remote_failures': self.remote_failures,
+        }
+        if self.uses_local and self._pending is not None:
+            with self._lock:
+                status['pending_upserts'] = self._pending.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+        return status
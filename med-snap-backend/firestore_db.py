@@ -0,0 +1,202 @@
+import itertools
+import os
+import threading
+import time
+
+
+FIREBASE_CONFIG = {
+    #Firebase credentials
+}
+
+# Each Firestore client owns one gRPC channel; a channel multiplexes calls
+# over a single HTTP/2 connection, so a few of them spread load under bursts
+POOL_SIZE = int(os.environ.get('FIRESTORE_POOL_SIZE', '4'))
+HEALTH_CHECK_INTERVAL = float(os.environ.get('FIRESTORE_HEALTH_CHECK_SECONDS', '30'))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get('FIRESTORE_HEALTH_CHECK_TIMEOUT', '5'))
+# After a reconnect, replaced clients stay open this long so requests that
+# already hold one can finish; longer than any call deadline we use
+RETIRED_CLIENT_GRACE_SECONDS = float(os.environ.get('FIRESTORE_RETIRED_CLIENT_GRACE_SECONDS', '120'))
+
+
+def _app_credentials(config):
+    """Initialize the Firebase app once and return its project and credentials."""
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(config))
+    app = firebase_admin.get_app()
+    return app.project_id, app.credential.get_credential()
+
+
+class FirestorePool:
+    """
+    Process-wide pool of Firestore clients.
+
+    Clients are created once on first use and handed out round-robin. A
+    background thread pings Firestore periodically and rebuilds the pool
+    when the check fails; callers can also report a failed call so the next
+    request reconnects instead of reusing a broken channel.
+
+    A rebuild connects the new clients off to the side and swaps them in
+    under the lock; until then other threads keep using the old ones. The
+    old clients are closed retire_grace seconds later, once calls already
+    running on them are done.
+    """
+
+    def __init__(self, config, size=POOL_SIZE, health_check_interval=HEALTH_CHECK_INTERVAL,
+                 retire_grace=RETIRED_CLIENT_GRACE_SECONDS):
+        self._config = config
+        self._size = max(1, size)
+        self._health_check_interval = health_check_interval
+        self._retire_grace = retire_grace
+        # (clients, round-robin iterator), replaced as a whole so a reader
+        # never sees one without the other
+        self._pool = None
+        self._lock = threading.Lock()
+        self._healthy = False
+        self._last_check = None
+        self._monitor = None
+
+    def _connect(self):
+        from google.cloud import firestore
+
+        project_id, google_credentials = _app_credentials(self._config)
+        return [
+            firestore.Client(project=project_id, credentials=google_credentials)
+            for _ in range(self._size)
+        ]
+
+    def _retire(self, clients):
+        def close():
+            for client in clients:
+                try:
+                    client.close()
+                except Exception:
+                    pass
+
+        timer = threading.Timer(self._retire_grace, close)
+        timer.daemon = True
+        timer.start()
+
+    def client(self):
+        """
+        Return a pooled Firestore client, connecting on first use or after a
+        reported failure.
+        """
+        pool = self._pool
+        if pool is None or not self._healthy:
+            # While another thread reconnects, keep serving from the old pool
+            # rather than queueing behind the connect
+            if not self._lock.acquire(blocking=pool is None):
+                return next(pool[1])
+            try:
+                if self._pool is None or not self._healthy:
+                    clients = self._connect()
+                    old = self._pool
+                    self._pool = (clients, itertools.cycle(clients))
+                    self._healthy = True
+                    if old is not None:
+                        self._retire(old[0])
+                    self._start_monitor()
+                pool = self._pool
+            finally:
+                self._lock.release()
+        return next(pool[1])
+
+    def _clients(self):
+        pool = self._pool
+        return list(pool[0]) if pool else []
+
+    def report_failure(self, error):
+        """
+        Mark the pool unhealthy so the next client() call reconnects.
+
+        Only transport-level errors count; a missing document or bad payload
+        says nothing about the channel.
+        """
+        from google.api_core import exceptions
+
+        if not isinstance(error, (
+            exceptions.ServiceUnavailable,
+            exceptions.DeadlineExceeded,
+            exceptions.InternalServerError,
+            exceptions.Unknown,
+        )):
+            return
+        print(f"Firestore call failed, reconnecting on next use: {str(error)}")
+        self._healthy = False
+
+    def health_check(self):
+        """
+        Run a cheap read against every pooled client.
+
+        Returns:
+            bool: True if all clients answered within the timeout
+        """
+        self._last_check = time.time()
+        try:
+            for client in self._clients():
+                client.collection('patients').limit(1).get(timeout=HEALTH_CHECK_TIMEOUT)
+            return True
+        except Exception as e:
+            print(f"Firestore health check failed: {str(e)}")
+            self._healthy = False
+            return False
+
+    def _start_monitor(self):
+        if self._monitor is not None or self._health_check_interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(self._health_check_interval)
+                if self._pool is not None:
+                    self.health_check()
+
+        self._monitor = threading.Thread(target=run, name='firestore-health', daemon=True)
+        self._monitor.start()
+
+    def status(self):
+        return {
+            'connected': self._pool is not None,
+            'healthy': self._healthy,
+            'pool_size': self._size,
+            'last_health_check': self._last_check,
+        }
+
+
+firestore_pool = FirestorePool(FIREBASE_CONFIG)
+
+
+def get_db():
+    """
+    Return the shared Firestore client.
+
+    Returns:
+        firestore.Client: A pooled client, or None if Firebase can't be reached
+    """
+    try:
+        return firestore_pool.client()
+    except Exception as e:
+        print(f"Error initializing Firebase: {str(e)}")
+        return None
+
+
+_async_client = None
+
+
+def get_async_db():
+    """
+    Return the shared Firestore AsyncClient used by the ASGI app.
+
+    The async client multiplexes every in-flight call over its own channel,
+    so one per process is enough.
+    """
+    global _async_client
+    if _async_client is None:
+        from google.cloud import firestore
+
+        project_id, google_credentials = _app_credentials(FIREBASE_CONFIG)
+        _async_client = firestore.AsyncClient(project=project_id, credentials=google_credentials)
+    return _async_client
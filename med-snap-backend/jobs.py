@@ -0,0 +1,482 @@
+"""
+Background job queue for work too slow to hold an HTTP request open.
+
+A route submits a job (a kind, JSON arguments and an optional binary
+payload such as the uploaded PDF) and returns its id at once; worker
+threads claim jobs, run the handler registered for the kind and store the
+result, which clients poll with GET /jobs/<id>.
+
+Jobs live in a store so they survive restarts and can be shared by every
+process on a host:
+  sqlite: one SQLite file (the default), claimed with an atomic UPDATE
+  redis:  a Redis list and hashes, for workers spread over several hosts
+          (JOB_REDIS_URL), claimed with a Lua script
+
+A handler that raises is retried with exponential backoff up to
+JOB_MAX_ATTEMPTS times; raising JobFailed fails the job at once. Submitting
+while JOB_MAX_QUEUED jobs are waiting raises QueueFull so routes can answer
+503 instead of queueing work they will never reach.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from condition_index import CACHE_DIR
+
+
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'sqlite')
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join(CACHE_DIR, 'jobs.sqlite3'))
+JOB_REDIS_URL = os.environ.get('JOB_REDIS_URL', 'redis://localhost:6379/0')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', '200'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BACKOFF_SECONDS = float(os.environ.get('JOB_RETRY_BACKOFF_SECONDS', '5'))
+# Finished jobs are kept this long for clients to poll, then deleted
+JOB_RETENTION_SECONDS = float(os.environ.get('JOB_RETENTION_SECONDS', str(24 * 3600)))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '1'))
+# Workers touch a running job's updated_at this often. One not touched for
+# JOB_STALE_SECONDS is assumed to belong to a dead worker and is requeued;
+# live workers' jobs, however long they run, are left be
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', '30'))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', '900'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the backlog is at JOB_MAX_QUEUED."""
+
+
+class JobFailed(Exception):
+    """Raised by a handler for errors that retrying cannot fix."""
+
+
+def _public(job):
+    """The fields of a job a client may see (no payload, no internals)."""
+    view = {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'stage': job.get('stage'),
+        'attempts': job.get('attempts', 0),
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+    }
+    if job['status'] == DONE:
+        view['result'] = job.get('result')
+    if job.get('error'):
+        view['error'] = job['error']
+    return view
+
+
+class SqliteJobStore:
+    """Jobs in one SQLite file; any process on the host can claim them."""
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                ' id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, stage TEXT,'
+                ' args TEXT, payload BLOB, result TEXT, error TEXT,'
+                ' attempts INTEGER NOT NULL DEFAULT 0, run_after REAL NOT NULL DEFAULT 0,'
+                ' created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_after, created_at)')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _row(self, row):
+        job = dict(zip(('id', 'kind', 'status', 'stage', 'args', 'payload', 'result', 'error',
+                        'attempts', 'run_after', 'created_at', 'updated_at'), row))
+        job['args'] = json.loads(job['args']) if job['args'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def create(self, job_id, kind, args, payload):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, args, payload, created_at, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, QUEUED, json.dumps(args), payload, now, now),
+            )
+            conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def claim(self, timeout):
+        """Mark the oldest runnable queued job running and return it, or None."""
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    'SELECT id FROM jobs WHERE status = ? AND run_after <= ? ORDER BY created_at LIMIT 1',
+                    (QUEUED, now),
+                ).fetchone()
+                if row:
+                    # The status check makes the claim atomic: if another
+                    # process got there first no row is updated
+                    cursor = conn.execute(
+                        'UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?'
+                        ' WHERE id = ? AND status = ?',
+                        (RUNNING, now, row[0], QUEUED),
+                    )
+                    conn.commit()
+                    if cursor.rowcount == 1:
+                        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (row[0],)).fetchone()
+                    else:
+                        row = None
+            if row:
+                return self._row(row)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(JOB_POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+            conn.commit()
+
+    def touch(self, job_id):
+        """Heartbeat: bump a running job's updated_at."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute('UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?',
+                         (time.time(), job_id, RUNNING))
+            conn.commit()
+
+    def count(self, status):
+        with self._lock:
+            return self._connection().execute(
+                'SELECT COUNT(*) FROM jobs WHERE status = ?', (status,)).fetchone()[0]
+
+    def requeue_running(self, stale_after=JOB_STALE_SECONDS):
+        """Put jobs left running by a crashed process back in the queue."""
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ? WHERE status = ? AND updated_at < ?',
+                (QUEUED, RUNNING, time.time() - stale_after))
+            conn.commit()
+        return cursor.rowcount
+
+    def purge(self, older_than):
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?', (DONE, FAILED, older_than))
+            conn.commit()
+        return cursor.rowcount
+
+
+# KEYS: queue, delayed, running; ARGV: now, key prefix. Promotes delayed
+# retries that are due, then pops the next job and marks it running, all in
+# one step so a worker dying mid-claim can't strand a job
+_REDIS_CLAIM = """
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], 0, ARGV[1])) do
+    redis.call('ZREM', KEYS[2], job_id)
+    redis.call('RPUSH', KEYS[1], job_id)
+end
+local job_id = redis.call('LPOP', KEYS[1])
+if not job_id then
+    return false
+end
+local key = ARGV[2] .. ':' .. job_id
+redis.call('HINCRBY', key, 'attempts', 1)
+redis.call('HSET', key, 'status', 'running', 'updated_at', ARGV[1])
+redis.call('ZADD', KEYS[3], ARGV[1], job_id)
+return job_id
+"""
+
+# KEYS: queue, running; ARGV: cutoff, key prefix. Requeues running jobs
+# whose last heartbeat is older than the cutoff
+_REDIS_REQUEUE = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], 0, ARGV[1])
+for _, job_id in ipairs(stale) do
+    redis.call('ZREM', KEYS[2], job_id)
+    redis.call('HSET', ARGV[2] .. ':' .. job_id, 'status', 'queued')
+    redis.call('RPUSH', KEYS[1], job_id)
+end
+return #stale
+"""
+
+
+class RedisJobStore:
+    """
+    Jobs in Redis: a hash per job, a list of runnable ids, a sorted set of
+    ids waiting out a retry backoff and a sorted set of running ids scored
+    by their last heartbeat. Needs the redis package.
+    """
+
+    def __init__(self, url=JOB_REDIS_URL, prefix='medsnap:jobs'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._claim = self._redis.register_script(_REDIS_CLAIM)
+        self._requeue = self._redis.register_script(_REDIS_REQUEUE)
+
+    def _key(self, job_id):
+        return f'{self._prefix}:{job_id}'
+
+    def _job(self, data):
+        if not data:
+            return None
+        job = {key.decode(): value for key, value in data.items()}
+        for name in ('id', 'kind', 'status', 'stage', 'error'):
+            if job.get(name) is not None:
+                job[name] = job[name].decode()
+        job['args'] = json.loads(job['args']) if job.get('args') else {}
+        job['result'] = json.loads(job['result']) if job.get('result') else None
+        for name in ('attempts',):
+            job[name] = int(job.get(name, 0))
+        for name in ('created_at', 'updated_at'):
+            job[name] = float(job[name])
+        return job
+
+    def create(self, job_id, kind, args, payload):
+        now = time.time()
+        pipe = self._redis.pipeline()
+        pipe.hset(self._key(job_id), mapping={
+            'id': job_id, 'kind': kind, 'status': QUEUED, 'args': json.dumps(args),
+            'payload': payload or b'', 'attempts': 0, 'created_at': now, 'updated_at': now,
+        })
+        pipe.rpush(f'{self._prefix}:queue', job_id)
+        pipe.execute()
+
+    def get(self, job_id):
+        return self._job(self._redis.hgetall(self._key(job_id)))
+
+    def claim(self, timeout):
+        """Mark the oldest runnable queued job running and return it, or None."""
+        keys = [f'{self._prefix}:queue', f'{self._prefix}:delayed', f'{self._prefix}:running']
+        deadline = time.monotonic() + timeout
+        while True:
+            job_id = self._claim(keys=keys, args=[time.time(), self._prefix])
+            if job_id:
+                return self.get(job_id.decode())
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(JOB_POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+
+    def update(self, job_id, **fields):
+        run_after = fields.pop('run_after', None)
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        if fields.get('payload') is None and 'payload' in fields:
+            fields['payload'] = b''
+        fields['updated_at'] = time.time()
+        fields = {name: value if value is not None else '' for name, value in fields.items()}
+        self._redis.hset(self._key(job_id), mapping=fields)
+        if fields.get('status') in (QUEUED, DONE, FAILED):
+            self._redis.zrem(f'{self._prefix}:running', job_id)
+        if fields.get('status') == QUEUED:
+            self._redis.zadd(f'{self._prefix}:delayed', {job_id: run_after or 0})
+        elif fields.get('status') in (DONE, FAILED):
+            self._redis.expire(self._key(job_id), int(JOB_RETENTION_SECONDS))
+
+    def touch(self, job_id):
+        """Heartbeat: bump a running job's score and updated_at."""
+        now = time.time()
+        if self._redis.zadd(f'{self._prefix}:running', {job_id: now}, xx=True, ch=True):
+            self._redis.hset(self._key(job_id), 'updated_at', now)
+
+    def count(self, status):
+        if status != QUEUED:
+            raise ValueError("RedisJobStore only counts queued jobs")
+        return self._redis.llen(f'{self._prefix}:queue') + self._redis.zcard(f'{self._prefix}:delayed')
+
+    def requeue_running(self, stale_after=JOB_STALE_SECONDS):
+        """Put jobs whose worker stopped heartbeating back in the queue."""
+        keys = [f'{self._prefix}:queue', f'{self._prefix}:running']
+        return self._requeue(keys=keys, args=[time.time() - stale_after, self._prefix])
+
+    def purge(self, older_than):
+        # Finished jobs expire on their own
+        return 0
+
+
+JOB_BACKENDS = {
+    'sqlite': SqliteJobStore,
+    'redis': RedisJobStore,
+}
+
+
+class JobQueue:
+    """
+    Runs registered handlers for submitted jobs on a bounded worker pool.
+
+    handler(args, payload, set_stage) returns a JSON-serializable result;
+    set_stage(name) records progress that /jobs/<id> reports.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED,
+                 max_attempts=JOB_MAX_ATTEMPTS, retry_backoff=JOB_RETRY_BACKOFF_SECONDS):
+        self.store = store
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._handlers = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def submit(self, kind, args=None, payload=None):
+        """
+        Queue a job and return its id.
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting
+        """
+        if kind not in self._handlers:
+            raise KeyError(f"No job handler registered as '{kind}'")
+        if self.max_queued and self.store.count(QUEUED) >= self.max_queued:
+            raise QueueFull(f"{self.max_queued} jobs already queued")
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, kind, args or {}, payload)
+        return job_id
+
+    def status(self, job_id):
+        """Client view of a job, or None if it is unknown or was purged."""
+        job = self.store.get(job_id)
+        return _public(job) if job else None
+
+    def start(self, workers=None):
+        """Start the worker threads (once); jobs a crash left running are requeued."""
+        workers = self.workers if workers is None else workers
+        with self._lock:
+            if self._threads or workers <= 0:
+                return
+            requeued = self.store.requeue_running()
+            if requeued:
+                print(f"Requeued {requeued} interrupted jobs")
+            for index in range(workers):
+                thread = threading.Thread(target=self._run, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        last_purge = 0.0
+        while True:
+            try:
+                if time.time() - last_purge > 600:
+                    last_purge = time.time()
+                    self.store.purge(time.time() - JOB_RETENTION_SECONDS)
+                    self.store.requeue_running()
+                job = self.store.claim(timeout=JOB_POLL_SECONDS * 5)
+            except Exception as e:
+                print(f"Job store unavailable: {str(e)}")
+                time.sleep(JOB_POLL_SECONDS)
+                continue
+            if job is None:
+                continue
+            try:
+                self._execute(job)
+            except Exception as e:
+                # A store write failed (locked database, Redis error); the job
+                # stays running until requeue_running, but this worker lives on
+                print(f"Job {job['id']} could not be recorded: {str(e)}")
+                time.sleep(JOB_POLL_SECONDS)
+
+    def _execute(self, job):
+        job_id = job['id']
+        handler = self._handlers.get(job['kind'])
+
+        def set_stage(stage):
+            self.store.update(job_id, stage=stage)
+
+        # Keep updated_at fresh while the handler runs, so requeue_running
+        # only picks up jobs whose worker has died. touch() only affects a
+        # job still marked running, so a late beat after the final update
+        # changes nothing
+        finished = threading.Event()
+
+        def heartbeat():
+            while not finished.wait(JOB_HEARTBEAT_SECONDS):
+                try:
+                    self.store.touch(job_id)
+                except Exception as e:
+                    print(f"Job {job_id} heartbeat failed: {str(e)}")
+
+        beat = threading.Thread(target=heartbeat, name=f'job-heartbeat-{job_id[:8]}', daemon=True)
+        beat.start()
+        try:
+            try:
+                if handler is None:
+                    raise JobFailed(f"No job handler registered as '{job['kind']}'")
+                result = handler(job['args'], job.get('payload'), set_stage)
+            except Exception as e:
+                retry = not isinstance(e, JobFailed) and job['attempts'] < self.max_attempts
+                if retry:
+                    delay = self.retry_backoff * (2 ** (job['attempts'] - 1))
+                    print(f"Job {job_id} failed (attempt {job['attempts']}), retrying in {delay:.1f}s: {str(e)}")
+                    self.store.update(job_id, status=QUEUED, error=str(e), run_after=time.time() + delay)
+                    self.retried += 1
+                else:
+                    print(f"Job {job_id} failed: {str(e)}")
+                    self.store.update(job_id, status=FAILED, error=str(e), payload=None)
+                    self.failed += 1
+                return
+
+            try:
+                self.store.update(job_id, status=DONE, stage=None, result=result, error=None, payload=None)
+            except (TypeError, ValueError) as e:
+                # json.dumps rejected the result; retrying would produce it again
+                print(f"Job {job_id} failed: result is not JSON-serializable: {str(e)}")
+                self.store.update(job_id, status=FAILED, error=f"Result is not JSON-serializable: {str(e)}",
+                                  payload=None)
+                self.failed += 1
+                return
+            self.completed += 1
+        finally:
+            finished.set()
+
+    def stats(self):
+        stats = {
+            'backend': type(self.store).__name__,
+            'workers': len(self._threads),
+            'completed': self.completed,
+            'failed': self.failed,
+            'retried': self.retried,
+        }
+        try:
+            stats['queued'] = self.store.count(QUEUED)
+        except Exception as e:
+            stats['queued_error'] = str(e)
+        return stats
+
+
+job_queue = JobQueue(JOB_BACKENDS[JOB_BACKEND]())
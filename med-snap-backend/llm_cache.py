@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from condition_index import CACHE_DIR
+
+
+CACHE_PATH = os.environ.get('LLM_CACHE_PATH', os.path.join(CACHE_DIR, 'llm_cache.sqlite3'))
+MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '50000'))
+TTL_SECONDS = float(os.environ.get('LLM_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+
+
+def normalize_text(text):
+    """Collapse whitespace so re-extracted copies of a document hash the same."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(namespace, text, prompt_version, model):
+    """
+    Content address for an LLM result.
+
+    Args:
+        namespace (str): Which extraction this is, e.g. "summary"
+        text (str): The document text sent to the model
+        prompt_version (int): Bumped whenever the prompt template changes
+        model (str): Model name the result came from
+    """
+    digest = hashlib.sha256()
+    for part in (namespace, str(prompt_version), model, normalize_text(text)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite-backed cache of LLM results with LRU and TTL eviction.
+
+    Values are stored as JSON. The database runs in WAL mode so every worker
+    process on a host can share one cache file.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _connection(self):
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS llm_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)')
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or expiry."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute('SELECT value, created FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created = row
+            if self.ttl_seconds and now - created > self.ttl_seconds:
+                conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                conn.commit()
+                self.expirations += 1
+                self.misses += 1
+                return None
+            conn.execute('UPDATE llm_cache SET accessed = ? WHERE key = ?', (now, key))
+            conn.commit()
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now, now),
+            )
+            count = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+            if count > self.max_entries:
+                # Drop the least recently used entries beyond the cap
+                overflow = count - self.max_entries
+                conn.execute(
+                    'DELETE FROM llm_cache WHERE key IN '
+                    '(SELECT key FROM llm_cache ORDER BY accessed ASC LIMIT ?)',
+                    (overflow,),
+                )
+                self.evictions += overflow
+            conn.commit()
+
+    def get_or_compute(self, namespace, text, prompt_version, model, compute):
+        """
+        Return the cached result for this document and prompt, calling
+        compute() and storing its result on a miss.
+
+        Cache errors never fail the request; they just fall through to the LLM.
+        """
+        key = cache_key(namespace, text, prompt_version, model)
+        try:
+            cached = self.get(key)
+        except Exception as e:
+            print(f"Error reading LLM cache: {str(e)}")
+            cached = None
+        if cached is not None:
+            return cached
+
+        value = compute()
+        try:
+            self.set(key, value)
+        except Exception as e:
+            print(f"Error writing LLM cache: {str(e)}")
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+llm_cache = LLMCache()
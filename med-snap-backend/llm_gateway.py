@@ -0,0 +1,374 @@
+"""
+Long-lived gateway for every Groq call the backend makes.
+
+Holds one pooled Groq client (and one async client for the ASGI app), the
+prompt builders and the few-shot timeline prefix rendered once at import,
+so a request only pays for the network call. Results go through the
+content-addressed LLM cache; cache misses wait for a slot from the
+llm_scheduler, which keeps each model within its Groq rate limits and
+serves interactive calls first.
+"""
+import asyncio
+import re
+import threading
+
+from llm_cache import cache_key, llm_cache
+from llm_scheduler import (BACKGROUND, INTERACTIVE, acreate_with_headers, create_with_headers,
+                           llm_scheduler)
+from metrics import span
+
+
+GROQ_API_KEY = "GROQ API KEY"
+GROQ_TEXT_MODEL = "llama-3.2-11b-text-preview"
+GROQ_TIMELINE_MODEL = "llama-3.1-70b-versatile"
+
+# Bump these whenever the matching prompt changes so cached results from the
+# old prompt stop being served
+SUMMARY_PROMPT_VERSION = 1
+TIMELINE_PROMPT_VERSION = 1
+PRESCRIPTION_PROMPT_VERSION = 1
+
+
+examples = [
+    {
+    "report":"""General Hospital
+
+Discharge Summary
+
+Patient Information
+Name: Jane Smith
+Age: 64 years
+Gender: Female
+Medical Record Number (MRN): 123456789
+Date of Admission: 10th July 2024
+Date of Discharge: 15th July 2024
+
+Admission Diagnosis
+Acute Myocardial Infarction
+
+Discharge Diagnosis
+Myocardial Infarction, Resolved
+
+Attending Physician
+Dr. Michael Roberts, MD, Cardiologist
+
+Reason for Admission
+The patient presented with severe chest pain radiating to her left arm, associated with sweating and nausea. Initial ECG showed ST-elevation, and she was diagnosed with an acute myocardial infarction. She was immediately taken to the cath lab for emergency percutaneous coronary intervention (PCI).
+
+Hospital Course and Management
+The patient underwent PCI with stent placement to the left anterior descending artery. Post-procedure, she was monitored in the Coronary Care Unit (CCU) for 48 hours. Blood pressure, cardiac enzymes, and ECGs were closely monitored. After stabilization, she was started on a combination of medications including aspirin, clopidogrel, atorvastatin, and metoprolol.
+
+Diagnostic Tests and Procedures
+
+ECG: ST-elevation myocardial infarction (STEMI) involving the anterior wall.
+
+Cardiac Enzymes: Elevated troponin, trended down post-intervention.
+
+Echocardiogram: Showed mild left ventricular dysfunction with an ejection fraction of 50%.
+
+Discharge Medications
+
+Aspirin 81 mg PO daily
+
+Clopidogrel 75 mg PO daily
+
+Atorvastatin 40 mg PO daily
+
+Metoprolol 25 mg PO twice daily
+
+Follow-Up Care
+
+Primary Care: Follow-up with primary care physician in 1 week.
+
+Cardiology: Follow-up in 4 weeks for repeat echocardiogram and medication adjustments.
+
+Lifestyle Modifications: The patient was advised to quit smoking, adopt a heart-healthy diet, and engage in light physical activity.
+
+Monitoring: Daily home monitoring of heart rate and blood pressure.
+
+Patient Education
+The patient was educated on the importance of medication compliance and lifestyle changes to prevent further cardiac events. She demonstrated understanding of discharge instructions and the need for cardiac rehabilitation.
+
+Prognosis
+The patient’s prognosis is good with adherence to prescribed therapy and lifestyle changes.
+
+Discharging Physician
+Dr. Michael Roberts, MD
+General Hospital
+
+Physician Signature
+
+Dr. Michael Roberts, MD
+Date: 15th July 2024""",
+
+    "result": "Date: 15-07-2024, Issue: Acute Myocardial Infarction, Treatment: PCI, Stent placement, Aspirin, Clopidogrel, Atorvastatin, Metoprolol, smoking cessation, heart-healthy diet, light physical activity."
+},
+
+{
+    "report":"""City Hospital
+
+Discharge Summary
+
+Patient Information
+Name: Alex Johnson
+Age: 40 years
+Gender: Male
+Medical Record Number (MRN): 234567890
+Date of Admission: 5th September 2024
+Date of Discharge: 12th September 2024
+
+Admission Diagnosis
+Severe Pneumonia with Respiratory Failure
+
+Discharge Diagnosis
+Pneumonia, Resolved
+
+Attending Physician
+Dr. Lisa Martin, MD, Pulmonologist
+
+Reason for Admission
+The patient was admitted with high fever, productive cough, and shortness of breath. Chest X-ray revealed extensive consolidation in both lungs. The patient required intubation and mechanical ventilation due to respiratory failure.
+
+Hospital Course and Management
+The patient was treated in the ICU with broad-spectrum IV antibiotics (piperacillin/tazobactam), corticosteroids, and mechanical ventilation. Blood cultures and sputum cultures were taken, which grew Streptococcus pneumoniae. Antibiotics were de-escalated to ceftriaxone once sensitivities were confirmed. After 5 days of mechanical ventilation, the patient was extubated and gradually weaned off oxygen support.
+
+Diagnostic Tests and Procedures
+
+Chest X-ray: Bilateral consolidation.
+
+Blood Cultures: Positive for Streptococcus pneumoniae.
+
+Sputum Cultures: Confirmed Streptococcus pneumoniae.
+
+Discharge Medications
+
+Ceftriaxone 1 g IV daily
+
+Prednisone 40 mg PO daily (tapering over 2 weeks)
+
+Albuterol Inhaler PRN
+
+Follow-Up Care
+
+Primary Care: Follow-up with primary care physician in 1 week for a chest X-ray.
+
+Pulmonology: Follow-up in 4 weeks for lung function testing.
+
+Lifestyle Modifications: Avoid exposure to respiratory irritants and secondhand smoke.
+
+Monitoring: Monitor for signs of recurrence such as fever, worsening cough, or shortness of breath.
+
+Patient Education
+The patient was instructed on the importance of completing the antibiotic course and using the inhaler as needed. Educational materials were provided on pneumonia prevention, including vaccination.
+
+Prognosis
+With adherence to the treatment plan, the patient’s prognosis is good, and the risk of recurrence is low.
+
+Discharging Physician
+Dr. Lisa Martin, MD
+City Hospital
+
+Physician Signature
+
+Dr. Lisa Martin, MD
+Date: 12th September 2024""",
+
+    "result": "Date: 12-09-2024, Issue: Severe Pneumonia with Respiratory Failure, Treatment: IV antibiotics, corticosteroids, mechanical ventilation, oxygen therapy, tapering prednisone, and inhaler use."
+
+
+}
+
+]
+
+
+TIMELINE_PREFIX = "Given a medical report, extract the key information in the format of 'date', 'issue', and 'treatment'. Here are some examples:"
+TIMELINE_EXAMPLE_TEMPLATE = """
+        Report: {report}
+        Extracted Result: {result}
+        """
+TIMELINE_SUFFIX = "Report: {report}\nExtracted Result:"
+
+# Same text LangChain's FewShotPromptTemplate produced (prefix, examples and
+# suffix joined by blank lines), but the two long example reports are
+# rendered once here instead of on every request
+TIMELINE_FEW_SHOT_PREFIX = "\n\n".join(
+    [TIMELINE_PREFIX] + [TIMELINE_EXAMPLE_TEMPLATE.format(**example) for example in examples]
+)
+
+
+def timeline_prompt(report_text):
+    return f"{TIMELINE_FEW_SHOT_PREFIX}\n\n{TIMELINE_SUFFIX.format(report=report_text)}"
+
+
+def summary_messages(report_text):
+    return [
+        {
+            "role": "system",
+            "content": f"you are summarizer"
+        },
+        {
+            "role": "user",
+                "content": f"Create a very very brief summary of report {report_text} like just what happend for exapmle if it something related to leg facture and a rod was inserted  just give respond as Fractured Rod Inserted   you can take example from this  Fractured Rod Inserted,   Mild Gastritis,   Mild Arrhythmia, Kidney Stone 4mm, Mild Degeneration,   Muscle Strain Grade 2   just as small as that and nothing else  give one one point not more then that"
+        }
+    ]
+
+
+def prescription_messages(extracted_text):
+    return [
+        {
+            "role": "user",
+            "content": f"This is a text extracted from medical prescription {extracted_text} just show only show up medicine names and in this format **medicine name** only medicine names nothing else"
+        }
+    ]
+
+
+def extract_timeline_info(text):
+    date_match = re.search(r"Date:\s*(\d{1,2}-\d{1,2}-\d{4})", text)
+    issue_match = re.search(r"Issue:\s*(.+?)(?=(?:Treatment:|$))", text, re.DOTALL)
+    treatment_match = re.search(r"Treatment:\s*(.+)", text, re.DOTALL)
+
+    date = date_match.group(1) if date_match else "Date not found"
+    issue = issue_match.group(1).strip() if issue_match else "Issue not found"
+    treatment = treatment_match.group(1).strip() if treatment_match else "Treatment not found"
+
+    return {"date": date, "issue": issue, "treatment": treatment}
+
+
+class LLMGateway:
+    """
+    Typed entry points for the three LLM extractions.
+
+    summarize_organ(report) -> str: few-word summary, e.g. "Mild Gastritis"
+    extract_timeline(report) -> dict: {"date", "issue", "treatment"}
+    extract_medications(prescription) -> str: "**name**" list of medicines
+
+    Each has an async twin prefixed with "a" for the ASGI app. priority is
+    the llm_scheduler priority of the Groq call on a cache miss; report
+    extraction defaults to BACKGROUND and medications (/prescribe, where a
+    user is waiting) to INTERACTIVE.
+    """
+
+    def __init__(self, api_key=GROQ_API_KEY, cache=llm_cache, scheduler=llm_scheduler):
+        self._api_key = api_key
+        self._cache = cache
+        self.scheduler = scheduler
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # One client per process; its httpx pool keeps connections to Groq
+        # open across requests
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from groq import Groq
+
+                    # Retries go back through the scheduler instead of
+                    # firing straight away
+                    self._client = Groq(api_key=self._api_key, max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from groq import AsyncGroq
+
+            self._async_client = AsyncGroq(api_key=self._api_key, max_retries=0)
+        return self._async_client
+
+    def complete(self, model, messages, priority=BACKGROUND, **params):
+        def call():
+            # Only cache misses reach here, so this span is the time spent at
+            # Groq (the scheduler queue wait is measured separately)
+            with span('groq_completion'):
+                return create_with_headers(
+                    self.client.chat.completions, model=model, messages=messages, temperature=1, **params
+                )
+
+        completion = self.scheduler.run(model, messages, call, priority, params.get('max_tokens'))
+        return completion.choices[0].message.content
+
+    async def acomplete(self, model, messages, priority=BACKGROUND, **params):
+        async def call():
+            with span('groq_completion'):
+                return await acreate_with_headers(
+                    self.async_client.chat.completions, model=model, messages=messages, temperature=1, **params
+                )
+
+        completion = await self.scheduler.arun(model, messages, call, priority, params.get('max_tokens'))
+        return completion.choices[0].message.content
+
+    def _cached(self, namespace, text, prompt_version, model, compute):
+        return self._cache.get_or_compute(namespace, text, prompt_version, model, compute)
+
+    async def _acached(self, namespace, text, prompt_version, model, compute):
+        key = cache_key(namespace, text, prompt_version, model)
+        # The cache is SQLite with a busy timeout; keep it off the event loop
+        try:
+            value = await asyncio.to_thread(self._cache.get, key)
+        except Exception as e:
+            print(f"Error reading LLM cache: {str(e)}")
+            value = None
+        if value is not None:
+            return value
+
+        value = await compute()
+        try:
+            await asyncio.to_thread(self._cache.set, key, value)
+        except Exception as e:
+            print(f"Error writing LLM cache: {str(e)}")
+        return value
+
+    def summarize_organ(self, report_text, priority=BACKGROUND) -> str:
+        return self._cached(
+            'summary', report_text, SUMMARY_PROMPT_VERSION, GROQ_TEXT_MODEL,
+            lambda: self.complete(GROQ_TEXT_MODEL, summary_messages(report_text), priority),
+        )
+
+    def extract_timeline(self, report_text, priority=BACKGROUND) -> dict:
+        def extract():
+            messages = [{"role": "user", "content": timeline_prompt(report_text)}]
+            return extract_timeline_info(self.complete(GROQ_TIMELINE_MODEL, messages, priority))
+
+        return self._cached('timeline', report_text, TIMELINE_PROMPT_VERSION, GROQ_TIMELINE_MODEL, extract)
+
+    def extract_medications(self, prescription_text, priority=INTERACTIVE) -> str:
+        return self._cached(
+            'medications', prescription_text, PRESCRIPTION_PROMPT_VERSION, GROQ_TEXT_MODEL,
+            lambda: self.complete(
+                GROQ_TEXT_MODEL, prescription_messages(prescription_text), priority,
+                max_tokens=1024, top_p=1, stream=False, stop=None,
+            ),
+        )
+
+    async def asummarize_organ(self, report_text, priority=BACKGROUND) -> str:
+        return await self._acached(
+            'summary', report_text, SUMMARY_PROMPT_VERSION, GROQ_TEXT_MODEL,
+            lambda: self.acomplete(GROQ_TEXT_MODEL, summary_messages(report_text), priority),
+        )
+
+    async def aextract_timeline(self, report_text, priority=BACKGROUND) -> dict:
+        async def extract():
+            messages = [{"role": "user", "content": timeline_prompt(report_text)}]
+            return extract_timeline_info(await self.acomplete(GROQ_TIMELINE_MODEL, messages, priority))
+
+        return await self._acached('timeline', report_text, TIMELINE_PROMPT_VERSION, GROQ_TIMELINE_MODEL, extract)
+
+    async def aextract_medications(self, prescription_text, priority=INTERACTIVE) -> str:
+        return await self._acached(
+            'medications', prescription_text, PRESCRIPTION_PROMPT_VERSION, GROQ_TEXT_MODEL,
+            lambda: self.acomplete(
+                GROQ_TEXT_MODEL, prescription_messages(prescription_text), priority,
+                max_tokens=1024, top_p=1, stream=False, stop=None,
+            ),
+        )
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+
+gateway = LLMGateway()
@@ -0,0 +1,515 @@
+"""
+Rate-limit-aware scheduler for Groq requests.
+
+Every request the gateway sends (cache misses only) first takes a slot
+here. Per model, the scheduler holds:
+
+  - request and token budgets: buckets refilled continuously at
+    GROQ_RPM / GROQ_TPM per minute (times GROQ_BUDGET_HEADROOM), charged
+    with an estimate of the prompt plus completion tokens before the call
+    and corrected with the reported usage after it
+  - a concurrency limit adapted AIMD-style: +1 per limit successful calls,
+    halved on a 429
+  - a priority queue: INTERACTIVE requests (/prescribe) are admitted before
+    BACKGROUND ones (report ingestion, backfills), FIFO within a priority
+
+Groq's x-ratelimit-* response headers pull the token bucket down to what
+the provider says is left, and a 429 pauses the model until its
+retry-after. Rate-limited, 5xx and connection failures are retried from
+the queue, so a retry waits for budget instead of adding to the burst; 5xx
+and connection failures first back off for a jittered, exponentially
+growing delay, since a struggling upstream needs a moment, not a budget.
+
+Queue waits are recorded in medsnap_llm_queue_wait_seconds and summarized
+in stats(). Budgets are per process; divide the provider's limits across
+workers with GROQ_RPM/GROQ_TPM or GROQ_MODEL_LIMITS
+("model=rpm:tpm,model=rpm:tpm"). A limit of 0 disables that budget.
+"""
+import asyncio
+import heapq
+import inspect
+import itertools
+import os
+import random
+import re
+import threading
+import time
+
+from metrics import metrics
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+GROQ_RPM = float(os.environ.get('GROQ_RPM', '30'))
+GROQ_TPM = float(os.environ.get('GROQ_TPM', '30000'))
+GROQ_MODEL_LIMITS = os.environ.get('GROQ_MODEL_LIMITS', '')
+# Aim a little below the provider's limit so clock skew and estimation
+# error don't tip us into 429s
+GROQ_BUDGET_HEADROOM = float(os.environ.get('GROQ_BUDGET_HEADROOM', '0.95'))
+GROQ_MAX_CONCURRENCY = int(os.environ.get('GROQ_MAX_CONCURRENCY', '16'))
+GROQ_MAX_RETRIES = int(os.environ.get('GROQ_MAX_RETRIES', '2'))
+# Retry n of a 5xx or connection error waits a random time up to
+# base * 2^(n-1), capped; 429s wait out the model's pause instead
+GROQ_RETRY_BACKOFF_SECONDS = float(os.environ.get('GROQ_RETRY_BACKOFF_SECONDS', '0.5'))
+GROQ_RETRY_BACKOFF_MAX_SECONDS = float(os.environ.get('GROQ_RETRY_BACKOFF_MAX_SECONDS', '8'))
+# Charged for the completion when the call doesn't set max_tokens; the
+# summary and timeline answers are a line or two
+GROQ_COMPLETION_TOKEN_ESTIMATE = int(os.environ.get('GROQ_COMPLETION_TOKEN_ESTIMATE', '256'))
+CHARS_PER_TOKEN = 4
+# Async waiters poll at this interval, since they can't wait on the condition
+ASYNC_POLL_SECONDS = 0.05
+
+queue_wait_seconds = metrics.histogram(
+    'medsnap_llm_queue_wait_seconds', 'Time Groq requests waited in the scheduler.', ['model', 'priority'])
+queued_requests = metrics.gauge(
+    'medsnap_llm_queued_requests', 'Groq requests waiting in the scheduler.', ['model'])
+concurrency_limit = metrics.gauge(
+    'medsnap_llm_concurrency_limit', 'Adaptive Groq concurrency limit.', ['model'])
+rate_limited_total = metrics.counter(
+    'medsnap_llm_rate_limited_total', 'Groq responses with status 429.', ['model'])
+
+
+def parse_model_limits(spec):
+    """
+    Parse "model=rpm:tpm,..." into {model: (rpm, tpm)}.
+    """
+    limits = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        model, values = item.split('=', 1)
+        rpm, _, tpm = values.partition(':')
+        limits[model.strip()] = (float(rpm or GROQ_RPM), float(tpm or GROQ_TPM))
+    return limits
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Rough prompt plus completion token count for a chat request."""
+    prompt = sum(len(message.get('content') or '') for message in messages) // CHARS_PER_TOKEN
+    return prompt + 4 * len(messages) + (max_tokens or GROQ_COMPLETION_TOKEN_ESTIMATE)
+
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+
+def parse_duration(value):
+    """
+    Seconds in a rate-limit header value: "2", "7.66s", "2m59.56s", "120ms".
+
+    Returns:
+        float: Seconds, or None if the value can't be read
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    scale = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def _header(headers, name):
+    if not headers:
+        return None
+    return headers.get(name)
+
+
+def _header_number(headers, name):
+    try:
+        value = _header(headers, name)
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def status_code(error):
+    code = getattr(error, 'status_code', None)
+    if code is None:
+        code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return code
+
+
+def error_headers(error):
+    return getattr(getattr(error, 'response', None), 'headers', None)
+
+
+def is_retryable(error):
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or code >= 500
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+
+def retry_delay(attempt, base=GROQ_RETRY_BACKOFF_SECONDS, cap=GROQ_RETRY_BACKOFF_MAX_SECONDS):
+    """Full-jitter exponential backoff before retry number attempt (from 1)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def usage_tokens(completion):
+    return getattr(getattr(completion, 'usage', None), 'total_tokens', None)
+
+
+class TokenBucket:
+    """Budget of per_minute units, refilled continuously; 0 means unlimited."""
+
+    def __init__(self, per_minute, clock):
+        self._clock = clock
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = clock()
+
+    def _refill(self, now):
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available (a request bigger than the bucket waits for a full one)."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) * 60.0 / self.capacity
+
+    def adjust(self, amount, now):
+        """Charge (negative) or refund (positive) amount; may go into debt."""
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def cap(self, remaining, now):
+        self._refill(now)
+        self.level = min(self.level, remaining)
+
+    def resize(self, per_minute, now):
+        self._refill(now)
+        self.capacity = per_minute
+        self.level = min(self.level, per_minute) if per_minute > 0 else 0
+
+
+class _Lane:
+    """Scheduling state for one model."""
+
+    def __init__(self, rpm, tpm, max_concurrency, clock):
+        self.configured = (rpm, tpm)
+        self.requests = TokenBucket(rpm, clock)
+        self.tokens = TokenBucket(tpm, clock)
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.waiters = []
+        self.paused_until = 0.0
+        self.rate_limited = 0
+        self.waited = {priority: [0, 0.0] for priority in PRIORITY_NAMES}
+
+
+class _Ticket:
+    def __init__(self, model, lane, tokens, priority, seq, enqueued):
+        self.model = model
+        self.lane = lane
+        self.tokens = tokens
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = enqueued
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    """
+    Admits Groq requests per model within request, token and concurrency
+    budgets, highest priority first.
+
+    run(model, messages, call) and arun(...) wrap a call that returns
+    (completion, response headers); acquire/release are the lower-level
+    halves for callers that need them.
+    """
+
+    def __init__(self, rpm=GROQ_RPM, tpm=GROQ_TPM, model_limits=None, headroom=GROQ_BUDGET_HEADROOM,
+                 max_concurrency=GROQ_MAX_CONCURRENCY, retries=GROQ_MAX_RETRIES,
+                 retry_backoff=GROQ_RETRY_BACKOFF_SECONDS, clock=time.monotonic):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.model_limits = dict(parse_model_limits(GROQ_MODEL_LIMITS) if model_limits is None else model_limits)
+        self.headroom = headroom
+        self.max_concurrency = max(1, max_concurrency)
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._clock = clock
+        self._lanes = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _lane(self, model):
+        lane = self._lanes.get(model)
+        if lane is None:
+            rpm, tpm = self.model_limits.get(model, (self.rpm, self.tpm))
+            lane = self._lanes[model] = _Lane(
+                rpm * self.headroom, tpm * self.headroom, self.max_concurrency, self._clock)
+            concurrency_limit.set(lane.limit, model=model)
+        return lane
+
+    def set_limits(self, model=None, rpm=None, tpm=None):
+        """Change the budgets of one model, or of every model if none is given."""
+        with self._cond:
+            if model is None:
+                self.rpm = self.rpm if rpm is None else rpm
+                self.tpm = self.tpm if tpm is None else tpm
+                models = set(self._lanes) | set(self.model_limits)
+            else:
+                models = {model}
+            for name in models:
+                old_rpm, old_tpm = self.model_limits.get(name, (self.rpm, self.tpm))
+                self.model_limits[name] = (old_rpm if rpm is None else rpm, old_tpm if tpm is None else tpm)
+                lane = self._lanes.get(name)
+                if lane is not None:
+                    now = self._clock()
+                    new_rpm, new_tpm = self.model_limits[name]
+                    lane.configured = (new_rpm * self.headroom, new_tpm * self.headroom)
+                    lane.requests.resize(lane.configured[0], now)
+                    lane.tokens.resize(lane.configured[1], now)
+            self._cond.notify_all()
+
+    def _enqueue(self, model, tokens, priority, seq=None):
+        lane = self._lane(model)
+        ticket = _Ticket(model, lane, tokens, priority, next(self._seq) if seq is None else seq, self._clock())
+        heapq.heappush(lane.waiters, ticket)
+        queued_requests.set(len(lane.waiters), model=model)
+        return ticket
+
+    def _dequeue(self, ticket):
+        lane = ticket.lane
+        if ticket in lane.waiters:
+            lane.waiters.remove(ticket)
+            heapq.heapify(lane.waiters)
+            queued_requests.set(len(lane.waiters), model=ticket.model)
+            self._cond.notify_all()
+
+    def _try_admit(self, ticket):
+        """
+        Admit ticket if it's first in line and every budget allows it.
+        Call with the lock held.
+
+        Returns:
+            float: 0 if admitted, else seconds to wait (None: until notified)
+        """
+        lane = ticket.lane
+        if lane.waiters[0] is not ticket:
+            return None
+        now = self._clock()
+        if now < lane.paused_until:
+            return lane.paused_until - now
+        if lane.in_flight >= int(lane.limit):
+            return None
+        wait = max(lane.requests.wait_time(1, now), lane.tokens.wait_time(ticket.tokens, now))
+        if wait > 0:
+            return wait
+
+        heapq.heappop(lane.waiters)
+        lane.requests.adjust(-1, now)
+        lane.tokens.adjust(-ticket.tokens, now)
+        lane.in_flight += 1
+        waited = now - ticket.enqueued
+        lane.waited[ticket.priority][0] += 1
+        lane.waited[ticket.priority][1] += waited
+        queue_wait_seconds.observe(waited, model=ticket.model, priority=PRIORITY_NAMES[ticket.priority])
+        queued_requests.set(len(lane.waiters), model=ticket.model)
+        # The next waiter may be admissible right away
+        self._cond.notify_all()
+        return 0.0
+
+    def acquire(self, model, tokens, priority=BACKGROUND, seq=None):
+        """Block until a request of about tokens tokens may be sent to model."""
+        with self._cond:
+            ticket = self._enqueue(model, tokens, priority, seq)
+            try:
+                while True:
+                    wait = self._try_admit(ticket)
+                    if wait == 0:
+                        return ticket
+                    self._cond.wait(wait if wait is not None else 1.0)
+            except BaseException:
+                self._dequeue(ticket)
+                raise
+
+    async def aacquire(self, model, tokens, priority=BACKGROUND, seq=None):
+        with self._cond:
+            ticket = self._enqueue(model, tokens, priority, seq)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(ticket)
+                if wait == 0:
+                    return ticket
+                await asyncio.sleep(min(wait or ASYNC_POLL_SECONDS, ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self._cond:
+                self._dequeue(ticket)
+            raise
+
+    def _apply_headers(self, lane, headers, now):
+        # Groq reports its per-minute token budget and the per-day request
+        # budget; follow the first and stop at the second
+        limit_tokens = _header_number(headers, 'x-ratelimit-limit-tokens')
+        if limit_tokens:
+            tpm = limit_tokens * self.headroom
+            if lane.configured[1] > 0:
+                tpm = min(tpm, lane.configured[1])
+            if tpm != lane.tokens.capacity:
+                lane.tokens.resize(tpm, now)
+        remaining_tokens = _header_number(headers, 'x-ratelimit-remaining-tokens')
+        if remaining_tokens is not None and lane.tokens.capacity > 0:
+            lane.tokens.cap(remaining_tokens, now)
+        if _header_number(headers, 'x-ratelimit-remaining-requests') == 0:
+            reset = parse_duration(_header(headers, 'x-ratelimit-reset-requests'))
+            if reset:
+                lane.paused_until = max(lane.paused_until, now + reset)
+
+    def release(self, ticket, used_tokens=None, headers=None, rate_limited=False, failed=False):
+        """
+        Return ticket's concurrency slot and settle its token charge.
+
+        Args:
+            ticket: What acquire returned
+            used_tokens (int): Tokens the call actually used, if known
+            headers: Response headers carrying x-ratelimit-* values
+            rate_limited (bool): Whether the call got a 429
+            failed (bool): Whether the call raised
+        """
+        with self._cond:
+            lane = ticket.lane
+            now = self._clock()
+            lane.in_flight -= 1
+            if used_tokens is not None:
+                lane.tokens.adjust(ticket.tokens - used_tokens, now)
+            if headers:
+                self._apply_headers(lane, headers, now)
+
+            if rate_limited:
+                lane.rate_limited += 1
+                rate_limited_total.inc(model=ticket.model)
+                lane.limit = max(1.0, lane.limit / 2)
+                retry_after = (parse_duration(_header(headers, 'retry-after'))
+                               or parse_duration(_header(headers, 'x-ratelimit-reset-tokens')) or 1.0)
+                lane.paused_until = max(lane.paused_until, now + retry_after)
+                lane.tokens.cap(0, now)
+            elif not failed:
+                lane.limit = min(float(self.max_concurrency), lane.limit + 1.0 / lane.limit)
+            concurrency_limit.set(int(lane.limit), model=ticket.model)
+            self._cond.notify_all()
+
+    def run(self, model, messages, call, priority=BACKGROUND, max_tokens=None):
+        """
+        Send call() when model's budgets allow, retrying 429s, 5xx and
+        connection errors from the queue; the latter two after a jittered
+        backoff.
+
+        Args:
+            model (str): Groq model the call goes to
+            messages (list): Chat messages, for the token estimate
+            call (callable): Makes the request, returns (completion, headers)
+            priority (int): INTERACTIVE or BACKGROUND
+            max_tokens (int): Completion limit, if the call sets one
+
+        Returns:
+            The completion
+        """
+        tokens = estimate_tokens(messages, max_tokens)
+        seq = next(self._seq)
+        for attempt in range(self.retries + 1):
+            ticket = self.acquire(model, tokens, priority, seq)
+            try:
+                completion, headers = call()
+            except BaseException as e:
+                # Cancellation too must give the slot back
+                self.release(ticket, headers=error_headers(e), rate_limited=status_code(e) == 429, failed=True)
+                if isinstance(e, Exception) and attempt < self.retries and is_retryable(e):
+                    if status_code(e) != 429:
+                        time.sleep(retry_delay(attempt + 1, self.retry_backoff))
+                    continue
+                raise
+            self.release(ticket, usage_tokens(completion), headers)
+            return completion
+
+    async def arun(self, model, messages, call, priority=BACKGROUND, max_tokens=None):
+        """run() for a coroutine function call."""
+        tokens = estimate_tokens(messages, max_tokens)
+        seq = next(self._seq)
+        for attempt in range(self.retries + 1):
+            ticket = await self.aacquire(model, tokens, priority, seq)
+            try:
+                completion, headers = await call()
+            except BaseException as e:
+                # Cancellation too must give the slot back
+                self.release(ticket, headers=error_headers(e), rate_limited=status_code(e) == 429, failed=True)
+                if isinstance(e, Exception) and attempt < self.retries and is_retryable(e):
+                    if status_code(e) != 429:
+                        await asyncio.sleep(retry_delay(attempt + 1, self.retry_backoff))
+                    continue
+                raise
+            self.release(ticket, usage_tokens(completion), headers)
+            return completion
+
+    def stats(self):
+        with self._cond:
+            now = self._clock()
+            models = {}
+            for model, lane in self._lanes.items():
+                lane.requests._refill(now)
+                lane.tokens._refill(now)
+                queued = {name: 0 for name in PRIORITY_NAMES.values()}
+                for ticket in lane.waiters:
+                    queued[PRIORITY_NAMES[ticket.priority]] += 1
+                models[model] = {
+                    'rpm': round(lane.requests.capacity, 1),
+                    'tpm': round(lane.tokens.capacity, 1),
+                    'requests_available': round(lane.requests.level, 1),
+                    'tokens_available': round(lane.tokens.level, 1),
+                    'concurrency_limit': int(lane.limit),
+                    'in_flight': lane.in_flight,
+                    'queued': queued,
+                    'paused_seconds': round(max(0.0, lane.paused_until - now), 2),
+                    'rate_limited': lane.rate_limited,
+                    'avg_queue_wait_ms': {
+                        PRIORITY_NAMES[priority]: round(total / count * 1000, 1) if count else 0.0
+                        for priority, (count, total) in lane.waited.items()
+                    },
+                }
+            return models
+
+
+def create_with_headers(completions, **params):
+    """
+    completions.create(**params), also returning the response headers when
+    the client exposes them (with_raw_response).
+
+    Returns:
+        tuple: (completion, headers or None)
+    """
+    raw_api = getattr(completions, 'with_raw_response', None)
+    if raw_api is None:
+        return completions.create(**params), None
+    raw = raw_api.create(**params)
+    return raw.parse(), raw.headers
+
+
+async def acreate_with_headers(completions, **params):
+    raw_api = getattr(completions, 'with_raw_response', None)
+    if raw_api is None:
+        return await completions.create(**params), None
+    raw = await raw_api.create(**params)
+    completion = raw.parse()
+    if inspect.isawaitable(completion):
+        completion = await completion
+    return completion, raw.headers
+
+
+llm_scheduler = LLMScheduler()
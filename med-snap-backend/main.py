@@ -1,28 +1,63 @@
-from groq import Groq
+import time
+_startup_start = time.perf_counter()
 
+# Seconds spent in each import/initialization stage of this module, reported
+# by /warmup so we can see where a worker's cold start goes
+startup_timings = {}
 
-from flask import Flask, request, jsonify
+def _record_startup(stage, since):
+    startup_timings[stage] = round(time.perf_counter() - since, 3)
+    return time.perf_counter()
+
+_t = time.perf_counter()
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import PyPDF2
 import io
 import os
-from google.cloud import vision
+import re
 import tempfile
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'vision-key.json'
+_t = _record_startup('import_flask', _t)
 
-import cv2
-import numpy as np
-from deepface import DeepFace
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import Distance, VectorParams
 
+from model_registry import registry
+from firestore_db import get_db, firestore_pool
+from llm_cache import llm_cache
+from llm_gateway import gateway
+from report_analysis import (
+    ENCODE_BATCH_SIZE,
+    discharge_summary_to_json,
+    match_organs,
+    match_organs_batch,
+    patient_update_fields,
+    summarize_report,
+)
+from pdf_extract import PdfTooLarge, extract_pdf, read_pdf_bytes
+from ocr import ocr_service
+from face_service import face_service
+from face_preprocess import decode_image
+from face_search import face_point
+from face_store import QDRANT_API_KEY, QDRANT_URL, FaceStore
+from jobs import JobFailed, QueueFull, job_queue
+from metrics import CONTENT_TYPE, metrics, observe_request, requests_in_flight, span, traced
+_t = _record_startup('import_qdrant', _t)
+
 
 
 # Initialize Qdrant client
 qdrant_client = QdrantClient(
-    url="QDRANT URL",
-    api_key="QDRANT API KEY",
+    url=QDRANT_URL,
+    api_key=QDRANT_API_KEY,
 )
+# Routes go through face_store, which can answer from an embedded mirror
+# when FACE_STORE_MODE asks for one. It is started by the server (see
+# start_face_store), not here, so importing main makes no Qdrant round trip
+face_store = FaceStore(qdrant_client)
+_t = _record_startup('init_qdrant_client', _t)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'jpg', 'jpeg', 'png'}
@@ -30,421 +65,122 @@ def allowed_file(filename):
 
 app = Flask(__name__)
 CORS(app)
-examples = [
-    {
-    "report":"""General Hospital
-
-Discharge Summary
-
-Patient Information
-Name: Jane Smith
-Age: 64 years
-Gender: Female
-Medical Record Number (MRN): 123456789
-Date of Admission: 10th July 2024
-Date of Discharge: 15th July 2024
-
-Admission Diagnosis
-Acute Myocardial Infarction
-
-Discharge Diagnosis
-Myocardial Infarction, Resolved
-
-Attending Physician
-Dr. Michael Roberts, MD, Cardiologist
-
-Reason for Admission
-The patient presented with severe chest pain radiating to her left arm, associated with sweating and nausea. Initial ECG showed ST-elevation, and she was diagnosed with an acute myocardial infarction. She was immediately taken to the cath lab for emergency percutaneous coronary intervention (PCI).
-
-Hospital Course and Management
-The patient underwent PCI with stent placement to the left anterior descending artery. Post-procedure, she was monitored in the Coronary Care Unit (CCU) for 48 hours. Blood pressure, cardiac enzymes, and ECGs were closely monitored. After stabilization, she was started on a combination of medications including aspirin, clopidogrel, atorvastatin, and metoprolol.
-
-Diagnostic Tests and Procedures
-
-ECG: ST-elevation myocardial infarction (STEMI) involving the anterior wall.
-
-Cardiac Enzymes: Elevated troponin, trended down post-intervention.
-
-Echocardiogram: Showed mild left ventricular dysfunction with an ejection fraction of 50%.
-
-Discharge Medications
-
-Aspirin 81 mg PO daily
-
-Clopidogrel 75 mg PO daily
-
-Atorvastatin 40 mg PO daily
-
-Metoprolol 25 mg PO twice daily
-
-Follow-Up Care
-
-Primary Care: Follow-up with primary care physician in 1 week.
-
-Cardiology: Follow-up in 4 weeks for repeat echocardiogram and medication adjustments.
-
-Lifestyle Modifications: The patient was advised to quit smoking, adopt a heart-healthy diet, and engage in light physical activity.
-
-Monitoring: Daily home monitoring of heart rate and blood pressure.
-
-Patient Education
-The patient was educated on the importance of medication compliance and lifestyle changes to prevent further cardiac events. She demonstrated understanding of discharge instructions and the need for cardiac rehabilitation.
-
-Prognosis
-The patient’s prognosis is good with adherence to prescribed therapy and lifestyle changes.
-
-Discharging Physician
-Dr. Michael Roberts, MD
-General Hospital
-
-Physician Signature
-
-Dr. Michael Roberts, MD
-Date: 15th July 2024""",
-
-    "result": "Date: 15-07-2024, Issue: Acute Myocardial Infarction, Treatment: PCI, Stent placement, Aspirin, Clopidogrel, Atorvastatin, Metoprolol, smoking cessation, heart-healthy diet, light physical activity."
-},
-
-{
-    "report":"""City Hospital
 
-Discharge Summary
-
-Patient Information
-Name: Alex Johnson
-Age: 40 years
-Gender: Male
-Medical Record Number (MRN): 234567890
-Date of Admission: 5th September 2024
-Date of Discharge: 12th September 2024
-
-Admission Diagnosis
-Severe Pneumonia with Respiratory Failure
-
-Discharge Diagnosis
-Pneumonia, Resolved
-
-Attending Physician
-Dr. Lisa Martin, MD, Pulmonologist
-
-Reason for Admission
-The patient was admitted with high fever, productive cough, and shortness of breath. Chest X-ray revealed extensive consolidation in both lungs. The patient required intubation and mechanical ventilation due to respiratory failure.
-
-Hospital Course and Management
-The patient was treated in the ICU with broad-spectrum IV antibiotics (piperacillin/tazobactam), corticosteroids, and mechanical ventilation. Blood cultures and sputum cultures were taken, which grew Streptococcus pneumoniae. Antibiotics were de-escalated to ceftriaxone once sensitivities were confirmed. After 5 days of mechanical ventilation, the patient was extubated and gradually weaned off oxygen support.
-
-Diagnostic Tests and Procedures
 
-Chest X-ray: Bilateral consolidation.
-
-Blood Cultures: Positive for Streptococcus pneumoniae.
-
-Sputum Cultures: Confirmed Streptococcus pneumoniae.
-
-Discharge Medications
-
-Ceftriaxone 1 g IV daily
-
-Prednisone 40 mg PO daily (tapering over 2 weeks)
-
-Albuterol Inhaler PRN
-
-Follow-Up Care
-
-Primary Care: Follow-up with primary care physician in 1 week for a chest X-ray.
-
-Pulmonology: Follow-up in 4 weeks for lung function testing.
-
-Lifestyle Modifications: Avoid exposure to respiratory irritants and secondhand smoke.
-
-Monitoring: Monitor for signs of recurrence such as fever, worsening cough, or shortness of breath.
-
-Patient Education
-The patient was instructed on the importance of completing the antibiotic course and using the inhaler as needed. Educational materials were provided on pneumonia prevention, including vaccination.
+@traced('ocr')
+def detect_text(image_content):
+    """Detects text in the image content."""
+    return ocr_service.detect_text(image_content)
 
-Prognosis
-With adherence to the treatment plan, the patient’s prognosis is good, and the risk of recurrence is low.
 
-Discharging Physician
-Dr. Lisa Martin, MD
-City Hospital
+@traced('ocr_batch')
+def detect_text_batch(images):
+    """OCR several images, returning their texts in the same order."""
+    return ocr_service.detect_texts(images)
 
-Physician Signature
 
-Dr. Lisa Martin, MD
-Date: 12th September 2024""",
 
-    "result": "Date: 12-09-2024, Issue: Severe Pneumonia with Respiratory Failure, Treatment: IV antibiotics, corticosteroids, mechanical ventilation, oxygen therapy, tapering prednisone, and inhaler use."
 
 
-}
 
-]
+# Scanned discharge summaries have no text layer; with OCR fallback on,
+# only those pages are rendered and sent to Vision
+PDF_OCR_FALLBACK = os.environ.get('PDF_OCR_FALLBACK', '1') == '1'
 
-import firebase_admin
-from firebase_admin import credentials, firestore
 
-def initialize_firebase():
+def extract_pdf_pages(pdf_file):
     """
-    Initialize Firebase with credentials
+    Extract a PDF page by page, OCRing pages that have no text layer.
+
     Returns:
-        firestore.Client: Initialized Firestore client
+        PdfExtraction: Text plus per-page failures, or None if the file
+        couldn't be read at all or no page produced any text
     """
-    firebase_config ={
-        #Firebase credentials
-}
-
-
     try:
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(firebase_config)
-            firebase_admin.initialize_app(cred)
-        return firestore.client()
+        with span('pdf_extract'):
+            extraction = extract_pdf(pdf_file, ocr=detect_text_batch if PDF_OCR_FALLBACK else None)
     except Exception as e:
-        print(f"Error initializing Firebase: {str(e)}")
+        print(f"Error extracting text: {str(e)}")
         return None
 
+    if extraction.failed_pages:
+        print(f"Failed to extract pages: {extraction.failed_pages}")
+    if not extraction.text.strip():
+        return None
+    return extraction
 
-from langchain.prompts import FewShotPromptTemplate, PromptTemplate
-from langchain_groq import ChatGroq
-from langchain.chains import LLMChain
-
-llm = ChatGroq(
-    model="llama-3.1-70b-versatile",
-    temperature=1,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    api_key="GROQ API KEY",
-)
-
-
-
-def discharge_summary_to_json(report_text):
-
-    example_template = """
-    Report: {report}
-    Extracted Result: {result}
-    """
-    example_prompt = PromptTemplate(
-        input_variables=["report", "result"],
-        template="""
-        Report: {report}
-        Extracted Result: {result}
-        """
-    )
-
-    few_shot_prompt = FewShotPromptTemplate(
-        examples=examples,
-        example_prompt=example_prompt,
-        input_variables=["report"],  # This is the variable for input prompts
-        prefix="Given a medical report, extract the key information in the format of 'date', 'issue', and 'treatment'. Here are some examples:",
-        suffix="Report: {report}\nExtracted Result:",  # End of the prompt where the new input is placed
-    )
-
-    chain = LLMChain(llm=llm, prompt=few_shot_prompt)
-    result = chain.invoke({"report": report_text})
-
-    extracted_data = extract_timeline_info(result['text'])
-    #timelineinfo = extract_timeline_info(extracted_data)
-
-    return extracted_data
-
-import re
 
-def extract_timeline_info(text):
-    date_match = re.search(r"Date:\s*(\d{1,2}-\d{1,2}-\d{4})", text)
-    issue_match = re.search(r"Issue:\s*(.+?)(?=(?:Treatment:|$))", text, re.DOTALL)
-    treatment_match = re.search(r"Treatment:\s*(.+)", text, re.DOTALL)
+def extract_text_from_pdf_file(pdf_file):
+    extraction = extract_pdf_pages(pdf_file)
+    return extraction.text if extraction else None
+    
 
-    date = date_match.group(1) if date_match else "Date not found"
-    issue = issue_match.group(1).strip() if issue_match else "Issue not found"
-    treatment = treatment_match.group(1).strip() if treatment_match else "Treatment not found"
+@traced('find_organ_details')
+def find_organ_details(report_text):
+    summary = summarize_report(report_text)
+    return {organ: summary for organ in match_organs(report_text)}
 
-    return {"date": date, "issue": issue, "treatment": treatment}
 
-
-def detect_text(image_content):
-    """Detects text in the image content."""
-    client = vision.ImageAnnotatorClient()
-    image = vision.Image(content=image_content)
-    
-    # for dense text
-    response = client.document_text_detection(image=image)
-    texts = response.text_annotations
-    
-    if not texts:
-        return ""
-        
-    # Return first text annotation which contains the full text
-    return texts[0]
-
-
-
-
-
-
-condition_mapping = {
-    # Brain conditions
-    "brain migraine": "brain",
-    "brain concussion": "brain",
-    "brain stroke": "brain",
-    "brain tumor": "brain",
-    "brain seizure": "brain",
-
-    # Heart conditions
-    "heart attack": "heart",
-    "heart failure": "heart",
-    "heart arrhythmia": "heart",
-    "heart murmur": "heart",
-    "heart angina": "heart",
-
-    # Chest conditions
-    "chest pain": "chest",
-    "chest pneumonia": "chest",
-    "chest bronchitis": "chest",
-    "chest asthma": "chest",
-
-    # Arm conditions
-    "left arm fracture": "left arm",
-    "right arm fracture": "right arm",
-    "left arm strain": "left arm",
-    "right arm strain": "right arm",
-
-    # Leg conditions
-    "left leg fracture": "left leg",
-    "right leg fracture": "right leg",
-    "left leg sprain": "left leg",
-    "right leg sprain": "right leg",
-
-    # Stomach conditions
-    "stomach ulcer": "stomach",
-    "stomach gastritis": "stomach",
-    "stomach pain": "stomach",
-    "stomach infection": "stomach",
-
-    # Liver conditions
-    "liver cirrhosis": "liver",
-    "liver hepatitis": "liver",
-    "liver failure": "liver",
-    "liver disease": "liver",
-
-    # Kidney conditions
-    "left kidney stone": "left kidney",
-    "right kidney stone": "right kidney",
-    "left kidney infection": "left kidney",
-    "right kidney infection": "right kidney",
-
-    # Spine conditions
-    "cervical spine pain": "cervical spine",
-    "cervical spine herniation": "cervical spine",
-    "thoracic spine scoliosis": "thoracic spine",
-    "lumbar spine strain": "lumbar spine",
-
-    # Shoulder conditions
-    "shoulder blades pain": "shoulder blades",
-    "shoulder blades strain": "shoulder blades",
-
-    # Hip conditions
-    "left hip arthritis": "left hip",
-    "right hip arthritis": "right hip",
-    "left hip pain": "left hip",
-    "right hip pain": "right hip",
-
-    # Gluteus conditions
-    "left gluteus strain": "left gluteus",
-    "right gluteus strain": "right gluteus",
-    "left gluteus pain": "left gluteus",
-    "right gluteus pain": "right gluteus",
-
-    # Hamstring conditions
-    "left hamstring strain": "left hamstring",
-    "right hamstring strain": "right hamstring",
-    "left hamstring tear": "left hamstring",
-    "right hamstring tear": "right hamstring",
-
-    # Calf conditions
-    "left calf strain": "left calf",
-    "right calf strain": "right calf",
-    "left calf cramp": "left calf",
-    "right calf cramp": "right calf"
-}
+# Shared pool for the independent stages of report processing; bounded so a
+# burst of uploads can't open unlimited concurrent Groq calls
+PIPELINE_WORKERS = int(os.environ.get('MEDSNAP_PIPELINE_WORKERS', '16'))
+pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='pipeline')
 
 
-def extract_text_from_pdf_file(pdf_file):
-    try:
-        # Create a PDF reader object directly from the file stream
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        # Get the number of pages
-        num_pages = len(pdf_reader.pages)
-        
-        # Initialize text variable
-        text = ""
-        
-        # Extract text from each page
-        for page_num in range(num_pages):
-            # Get the page object
-            page = pdf_reader.pages[page_num]
-            # Extract text from page
-            text += page.extract_text() + "\n"
-            
-        return text
-    except Exception as e:
-        print(f"Error extracting text: {str(e)}")
-        return None
-    
+def find_organ_details_batch(reports, batch_size=ENCODE_BATCH_SIZE):
+    """
+    find_organ_details for many reports at once, e.g. when backfilling a
+    hospital's historical discharge summaries.
 
-conditions_list = list(condition_mapping.keys())
+    Embedding runs as batched forward passes while the Groq summaries are
+    fetched concurrently on the pipeline pool.
 
-from sentence_transformers import SentenceTransformer, util
-import faiss
+    Args:
+        reports (list): Report texts
+        batch_size (int): Number of reports per mpnet forward pass
 
+    Returns:
+        list: One {organ: summary} dict per report, in input order
+    """
+    summary_futures = [pipeline_executor.submit(summarize_report, report) for report in reports]
+    organs = match_organs_batch(reports, batch_size)
+    results = []
+    for report_organs, future in zip(organs, summary_futures):
+        summary = future.result()
+        results.append({organ: summary for organ in report_organs})
+    return results
 
-similar_injuries = conditions_list
 
-# Initialize the sentence transformer model
-model = SentenceTransformer('all-mpnet-base-v2')
+def analyze_report(report_text):
+    """
+    Run the organ matching, the Groq summary and the timeline extraction for a
+    report concurrently.
 
-# Create embeddings for the similar injuries
-injury_embeddings = model.encode(similar_injuries)
+    The three stages only depend on the report text, so latency is roughly
+    that of the slowest LLM call.
 
-d = injury_embeddings.shape[1]  # Dimensionality of embeddings
-index = faiss.IndexFlatL2(d)  # Use L2 distance for similarity
-index.add(injury_embeddings)
+    Returns:
+        tuple: (organ_data, history_data)
+    """
+    organs_future = pipeline_executor.submit(match_organs, report_text)
+    summary_future = pipeline_executor.submit(summarize_report, report_text)
+    timeline_future = pipeline_executor.submit(discharge_summary_to_json, report_text)
 
+    summary = summary_future.result()
+    organ_data = {organ: summary for organ in organs_future.result()}
+    return organ_data, timeline_future.result()
 
 
-def find_organ_details(report_text):
-    report_embedding = model.encode(report_text)
-
-    # Search the index for the most similar injury
-    D, I = index.search(report_embedding.reshape(1, -1), k=1)  # Search for the top 1 match
-
-    # Get the most similar injury from the list
-    most_similar_injury = similar_injuries[I[0][0]]
-
-
-    client = Groq(api_key="GROQ API KEY")
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": f"you are summarizer"
-            },
-            {
-                "role": "user",
-                    "content": f"Create a very very brief summary of report {report_text} like just what happend for exapmle if it something related to leg facture and a rod was inserted  just give respond as Fractured Rod Inserted   you can take example from this  Fractured Rod Inserted,   Mild Gastritis,   Mild Arrhythmia, Kidney Stone 4mm, Mild Degeneration,   Muscle Strain Grade 2   just as small as that and nothing else  give one one point not more then that"
-            }
-        ],
-
-        model="llama-3.2-11b-text-preview",
-        temperature=1,
-        )
-    summary = chat_completion.choices[0].message.content
-    
+def process_report(patient_id, report_text):
+    """
+    analyze_report, then write all results in one Firestore update.
 
-    return {condition_mapping[most_similar_injury]:summary}
+    Returns:
+        tuple: (organ_data, history_data, success)
+    """
+    organ_data, history_data = analyze_report(report_text)
+    success = update_patient_record(patient_id, organ_data, history_data)
+    return organ_data, history_data, success
 
 
 REPORT = """Sunrise Medical Center
@@ -505,118 +241,237 @@ Dr. James Walker, MD
 Date: 17th August 2024
 
 """
-def update_organs(patient_id, organ_updates):
+def write_patient_record(patient_id, organ_updates=None, history_entry=None, db=None):
     """
-    Update specific organ values while preserving other organ data.
+    Merge organ updates and append a medical history entry in one atomic write.
+
+    Raises:
+        google.api_core.exceptions.NotFound: If the patient isn't registered
+        Exception: If Firestore is unavailable or the write fails
+    """
+    db = db or get_db()
+    if not db:
+        raise Exception("Failed to initialize Firebase")
+
+    fields = patient_update_fields(organ_updates, history_entry)
+    if not fields:
+        return
+
+    # update() fails if the document doesn't exist, so this is a single
+    # round trip that also checks the patient is registered
+    with span('firestore_update'):
+        db.collection('patients').document(patient_id).update(fields)
+
+    print(f"Successfully updated patient record ({len(fields)} fields)")
+
+
+def update_patient_record(patient_id, organ_updates=None, history_entry=None, db=None):
+    """
+    Merge organ updates and append a medical history entry in one atomic write.
     
     Args:
         patient_id (str): The patient's ID in Firebase
         organ_updates (dict): Dictionary containing organ updates
+        history_entry (dict): Dictionary containing date, issue, and treatment
+        db (firestore.Client): Client to use, defaults to the shared pool
     
     Returns:
         bool: True if successful, False otherwise
     """
-    try:
-        # Initialize Firebase and get Firestore client
-        db = initialize_firebase()
-        if not db:
-            raise Exception("Failed to initialize Firebase")
+    from google.api_core.exceptions import NotFound
 
-        # Reference to the patient's document
-        patient_ref = db.collection('patients').document(patient_id)
-        
-        # Get current document
-        doc = patient_ref.get()
-        if not doc.exists:
-            print(f"Patient with ID {patient_id} not found")
-            return False
-            
-        # Get current data
-        current_data = doc.to_dict()
-        
-        # Get current organs data (if exists)
-        medical_details = current_data.get('medicalDetails', {})
-        current_organs = medical_details.get('organs', {})
-        
-        # Create updated organs dict by merging current data with updates
-        updated_organs = dict(current_organs)
-        for organ, value in organ_updates.items():
-            updated_organs[organ] = value
-        
-        # Update the organs object while preserving other data
-        patient_ref.set({
-            'medicalDetails': {
-                'organs': updated_organs
-            }
-        }, merge=True)  # merge=True ensures other fields aren't deleted
-        
-        print(f"Successfully updated organs data")
+    try:
+        write_patient_record(patient_id, organ_updates, history_entry, db)
         return True
-        
+
+    except NotFound:
+        print(f"Patient with ID {patient_id} not found")
+        return False
     except Exception as e:
-        print(f"Error updating organs: {str(e)}")
+        print(f"Error updating patient record: {str(e)}")
+        firestore_pool.report_failure(e)
         return False
+
+
+def update_organs(patient_id, organ_updates, db=None):
+    """
+    Update specific organ values while preserving other organ data.
+    
+    Args:
+        patient_id (str): The patient's ID in Firebase
+        organ_updates (dict): Dictionary containing organ updates
+        db (firestore.Client): Client to use, defaults to the shared pool
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    return update_patient_record(patient_id, organ_updates=organ_updates, db=db)
     
 
-def add_to_medical_history(patient_id, medical_data):
+def add_to_medical_history(patient_id, medical_data, db=None):
     """
-    Insert a new record to the medicalHistory array with a new index.
+    Insert a new record into the medicalHistory map under a timestamped key.
     
     Args:
         patient_id (str): The patient's ID in Firebase
         medical_data (dict): Dictionary containing date, issue, and treatment
+        db (firestore.Client): Client to use, defaults to the shared pool
     
     Returns:
         bool: True if successful, False otherwise
     """
-    try:
-        # Initialize Firebase and get Firestore client
-        db = initialize_firebase()
-        if not db:
-            raise Exception("Failed to initialize Firebase")
+    return update_patient_record(patient_id, history_entry=medical_data, db=db)
 
-        # Reference to the patient's document
-        patient_ref = db.collection('patients').document(patient_id)
-        
-        # Get current document
-        doc = patient_ref.get()
-        if not doc.exists:
-            print(f"Patient with ID {patient_id} not found")
-            return False
-            
-        # Get the current data
-        current_data = doc.to_dict()
-        
-        # Get medical details and history
-        medical_details = current_data.get('medicalDetails', {})
-        medical_history = medical_details.get('medicalHistory', {})
-        
-        # Find the highest existing index
-        existing_indices = [int(idx) for idx in medical_history.keys() if idx.isdigit()]
-        next_index = str(max(existing_indices + [-1]) + 1)  # If no indices exist, start at 0
-        
-        # Create new record at the new index
-        new_record = {
-            f'medicalDetails.medicalHistory.{next_index}': {
-                'date': medical_data['date'],
-                'issue': medical_data['issue'],
-                'treatment': medical_data['treatment']
-            }
-        }
-        
-        # Update only the new record
-        patient_ref.update(new_record)
-        
-        print(f"Successfully added new medical history record at index {next_index}")
-        return True
-        
+
+
+def ingest_report(args, pdf_bytes, set_stage):
+    """
+    Job handler for an uploaded discharge summary: extract, analyze, save.
+
+    An unreadable PDF, a bad Aadhaar number or an unregistered patient fails
+    the job at once; LLM or Firestore errors are retried by the job queue
+    (LLM results that succeeded are cached, so a retry only repeats the
+    calls that failed).
+
+    Returns:
+        dict: What /message used to return, plus the organ and history data
+    """
+    from google.api_core.exceptions import NotFound
+
+    aadhar_number = args.get('aadhar_number')
+    if not aadhar_number or not re.match(r'^\d{12}$', aadhar_number):
+        raise JobFailed("Invalid Aadhar number format")
+
+    set_stage('parsing')
+    extraction = extract_pdf_pages(io.BytesIO(pdf_bytes))
+    if not extraction:
+        raise JobFailed("Failed to extract text from PDF")
+
+    set_stage('analyzing')
+    organ_data, history_data = analyze_report(extraction.text)
+
+    set_stage('saving')
+    try:
+        write_patient_record(aadhar_number, organ_data, history_data)
+    except NotFound:
+        raise JobFailed(f"Patient with ID {aadhar_number} not found")
     except Exception as e:
-        print(f"Error adding medical history: {str(e)}")
-        return False
+        firestore_pool.report_failure(e)
+        raise Exception(f"Failed to update patient record: {str(e)}")
+
+    return {
+        "status": "success",
+        "message": "PDF text extracted successfully",
+        "text": extraction.text,
+        "failed_pages": sorted(extraction.failed_pages),
+        "ocr_pages": list(extraction.ocr_pages),
+        "truncated": extraction.truncated,
+        "organs": organ_data,
+        "history": history_data,
+    }
 
 
+job_queue.register('ingest_report', ingest_report)
+job_queue.start()
+
+
+# Comma-separated model names (or "all") to load before serving, so each
+# worker pool only pre-warms the models its routes actually use
+PRELOAD_MODELS = os.environ.get('MEDSNAP_PRELOAD_MODELS', '')
+
+if PRELOAD_MODELS:
+    _t = time.perf_counter()
+    if PRELOAD_MODELS.strip() == 'all':
+        registry.warmup()
+    else:
+        registry.warmup([name.strip() for name in PRELOAD_MODELS.split(',') if name.strip()])
+    _t = _record_startup('preload_models', _t)
+
+startup_timings['total'] = round(time.perf_counter() - _startup_start, 3)
+print(f"ready to work!!!! (startup took {startup_timings['total']}s)")
+
+
+@app.before_request
+def start_face_store():
+    # Flask has no startup hook under a WSGI server; start() only does work
+    # the first time
+    face_store.start()
+
+
+@app.before_request
+def start_request_metrics():
+    # Label by route pattern, not path, so label cardinality stays bounded
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_start = time.perf_counter()
+    requests_in_flight.inc(route=g.metrics_route)
+
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # Runs after streamed responses finish, so /prescribe-bulk counts in full
+    if 'metrics_start' not in g:
+        return
+    requests_in_flight.dec(route=g.metrics_route)
+    observe_request(g.metrics_route, request.method, g.get('metrics_status', 500),
+                    time.perf_counter() - g.metrics_start)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Stage and request histograms plus in-flight gauges, Prometheus text format."""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'llm_cache': llm_cache.stats(),
+        'ocr': ocr_service.stats(),
+        'face_embedding': face_service.stats(),
+        'face_store': face_store.status(),
+        'jobs': job_queue.stats(),
+        'llm_scheduler': gateway.scheduler.stats(),
+    })
+
+
+@app.route('/warmup', methods=['GET', 'POST'])
+def warmup():
+    """
+    GET reports which models are resident and the startup breakdown.
+    POST loads the models listed in the JSON body ({"models": [...]}), or
+    every registered model if none are given.
+    """
+    if request.method == 'GET':
+        return jsonify({
+            'models': registry.status(),
+            'startup': startup_timings,
+            'firestore': firestore_pool.status(),
+        })
+
+    payload = request.get_json(silent=True) or {}
+    names = payload.get('models') or None
+
+    unknown = [name for name in (names or []) if name not in registry.names()]
+    if unknown:
+        return jsonify({'error': f"Unknown models: {', '.join(unknown)}"}), 400
+
+    try:
+        timings = registry.warmup(names)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'status': 'success',
+        'loaded': timings,
+        'models': registry.status(),
+    })
 
-print("ready to work!!!!")
 
 @app.route('/message', methods=['POST'])
 def receive_message():
@@ -628,34 +483,33 @@ def receive_message():
         aadhar_number = request.form.get('aadhar_number')
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
+
+        # Checked up front so a bad number is a 400, not a job that fails later
+        if not aadhar_number:
+            return jsonify({'error': 'No Aadhar number provided'}), 400
+        if not re.match(r'^\d{12}$', aadhar_number):
+            return jsonify({'error': 'Invalid Aadhar number format'}), 400
             
         if file and file.filename.endswith('.pdf'):
-#             # Extract text directly from the uploaded file
-            extracted_text = extract_text_from_pdf_file(file)
-            
-            if extracted_text:
-                print("Extracted Text from PDF:")
-                print("------------------------")
-                data = find_organ_details(extracted_text)
-                success = update_organs(aadhar_number,data)
-                print(data)
-                data = discharge_summary_to_json(extracted_text)
-                print(data)
-                success = add_to_medical_history(aadhar_number,data)
-                print(data)
-
-                print("------------------------")
-                
-                return jsonify({
-                    "status": "success",
-                    "message": "PDF text extracted successfully",
-                    "text": extracted_text
-                })
-            else:
-                return jsonify({
-                    "status": "error",
-                    "message": "Failed to extract text from PDF"
-                }), 500
+            if request.args.get('wait') == '1':
+                return receive_message_sync(file, aadhar_number)
+
+            # Parsing, the LLM calls and the Firestore write run on the job
+            # workers; the client polls /jobs/<job_id> for the result
+            try:
+                pdf_bytes = read_pdf_bytes(file)
+                job_id = job_queue.submit('ingest_report', {'aadhar_number': aadhar_number}, pdf_bytes)
+            except PdfTooLarge as e:
+                return jsonify({'error': str(e)}), 413
+            except QueueFull:
+                response = jsonify({'error': 'Too many reports are being processed, try again shortly'})
+                return response, 503, {'Retry-After': '30'}
+
+            return jsonify({
+                "status": "queued",
+                "job_id": job_id,
+                "status_url": f"/jobs/{job_id}",
+            }), 202
             
         return jsonify({'error': 'Invalid file type'}), 400
         
@@ -664,6 +518,40 @@ def receive_message():
     
 
 
+def receive_message_sync(file, aadhar_number):
+    """The original blocking /message, for callers that pass ?wait=1."""
+    extraction = extract_pdf_pages(file)
+    if not extraction:
+        return jsonify({
+            "status": "error",
+            "message": "Failed to extract text from PDF"
+        }), 500
+
+    extracted_text = extraction.text
+    organ_data, history_data, success = process_report(aadhar_number, extracted_text)
+    print(organ_data)
+    print(history_data)
+
+    return jsonify({
+        "status": "success",
+        "message": "PDF text extracted successfully",
+        "success": success,
+        "text": extracted_text,
+        "failed_pages": sorted(extraction.failed_pages),
+        "ocr_pages": list(extraction.ocr_pages),
+        "truncated": extraction.truncated
+    })
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status of a queued job: queued, running (with stage), done (with result) or failed."""
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+
 @app.route('/search-face', methods=['POST'])
 def search_face():
     if 'image' not in request.files:
@@ -676,20 +564,29 @@ def search_face():
 
     # Read and process image
     image_bytes = image.read()
-    image_np = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+    with span('face_decode'):
+        img = decode_image(image_bytes)
+    if img is None:
+        return jsonify({"error": "Could not decode image"}), 400
     
     try:
-        girl_em = DeepFace.represent(img, model_name='Facenet')
-        
-        result = qdrant_client.search(
-            collection_name="face_data",
-            query_vector=girl_em[0]['embedding'],
-            limit=1,
-        )
-        
+        with span('face_embed'):
+            embedding = face_service.embed(img)
+        # Optional: restrict the search to faces enrolled by one hospital
+        with span('qdrant_search'):
+            match, ranked = face_store.search(embedding, hospital=request.form.get('hospital'))
+
+        if match is None:
+            return jsonify({
+                "adhaar": None,
+                "match": False,
+                "score": ranked[0][1] if ranked else None,
+            })
+
         return jsonify({
-            "adhaar": result[0].id,
+            "adhaar": match.aadhaar,
+            "match": True,
+            "score": match.score,
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -715,28 +612,20 @@ def upload_face():
 
     # Read and process image
     image_bytes = image.read()
-    image_np = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+    with span('face_decode'):
+        img = decode_image(image_bytes)
+    if img is None:
+        return jsonify({"error": "Could not decode image"}), 400
     
     try:
-        girl_em = DeepFace.represent(img, model_name='Facenet')
-        
-        # Check if collection exists
-        try:
-            qdrant_client.get_collection("face_data")
-        except Exception as e:
-            print("collection not found")
+        with span('face_embed'):
+            embedding = face_service.embed(img)
         
-        # Upsert the face embedding
-        qdrant_client.upsert(
-            collection_name="face_data",
-            points=[
-                {
-                    "id": some_number,
-                    "vector": girl_em[0]['embedding'],
-                }
-            ]
-        )
+        # Upsert the face embedding; each photo is its own point so a
+        # patient can have several enrolled faces to re-rank against
+        with span('qdrant_upsert'):
+            face_store.upsert([face_point(some_number, embedding, image_bytes,
+                                          hospital=request.form.get('hospital'))])
         
         return jsonify({"message": "Face uploaded successfully"}), 200
     except Exception as e:
@@ -777,27 +666,10 @@ def process_prescription():
             return jsonify({'error': 'No text detected in image'}), 400
 
         # Process with Groq
-        client = Groq(api_key="GROQ API KEY")
-        completion = client.chat.completions.create(
-            model="llama-3.2-11b-text-preview",
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"This is a text extracted from medical prescription {extracted_text} just show only show up medicine names and in this format **medicine name** only medicine names nothing else"
-                }
-            ],
-            temperature=1,
-            max_tokens=1024,
-            top_p=1,
-            stream=False,
-            stop=None,
-        )
-
-        # Get the generated text from Groq
-        generated_text = completion.choices[0].message.content
-
-        # Initialize Firebase
-        db = initialize_firebase()
+        with span('llm_medications'):
+            generated_text = gateway.extract_medications(extracted_text)
+
+        db = get_db()
         if not db:
             return jsonify({'error': 'Failed to initialize Firebase'}), 500
 
@@ -806,11 +678,12 @@ def process_prescription():
             patient_ref = db.collection('patients').document(aadhar_number)
             
             # Update the currentMedications field
-            patient_ref.set({
-                'medicalDetails': {
-                    'currentMedications': generated_text
-                }
-            }, merge=True)  # merge=True ensures other fields aren't deleted
+            with span('firestore_set'):
+                patient_ref.set({
+                    'medicalDetails': {
+                        'currentMedications': generated_text
+                    }
+                }, merge=True)  # merge=True ensures other fields aren't deleted
             
             return jsonify({
                 'text': generated_text,
@@ -820,11 +693,119 @@ def process_prescription():
             
         except Exception as e:
             print(f"Firebase update error: {str(e)}")
+            firestore_pool.report_failure(e)
             return jsonify({'error': 'Failed to update medications in database'}), 500
 
     except Exception as e:
         print(f"Error processing prescription for Aadhar {request.form.get('aadhar_number', 'unknown')}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def parse_medicine_names(generated_text):
+    """Pull the **medicine name** entries out of a Groq medicine list."""
+    names = [name.strip() for name in re.findall(r'\*\*(.+?)\*\*', generated_text or '')]
+    return [name for name in names if name]
+
+
+def merge_medicine_names(name_lists):
+    """Merge medicine lists, dropping case/whitespace duplicates, first spelling wins."""
+    merged = {}
+    for names in name_lists:
+        for name in names:
+            merged.setdefault(' '.join(name.lower().split()), name)
+    return list(merged.values())
+
+
+def extract_prescription(image_content):
+    """OCR one prescription image and extract its medicine names."""
+    extracted_text = detect_text(image_content)
+    if not extracted_text:
+        raise ValueError('No text detected in image')
+    with span('llm_medications'):
+        generated_text = gateway.extract_medications(extracted_text)
+    return parse_medicine_names(generated_text)
+
+
+MAX_BULK_PRESCRIPTION_IMAGES = int(os.environ.get('MAX_BULK_PRESCRIPTION_IMAGES', '50'))
+
+
+@app.route('/prescribe-bulk', methods=['POST'])
+def process_prescriptions_bulk():
+    """
+    Process many prescription images for one patient.
+
+    Images (form field "images", repeated) are OCR'd and run through medicine
+    extraction concurrently. The response is streamed as newline-delimited
+    JSON: one line per image as it finishes, then a final line once the
+    de-duplicated medicine list has been stored with a single write.
+    """
+    images = request.files.getlist('images')
+    aadhar_number = request.form.get('aadhar_number', '')
+
+    if not images:
+        return jsonify({'error': 'No image files provided'}), 400
+    if len(images) > MAX_BULK_PRESCRIPTION_IMAGES:
+        return jsonify({'error': f'At most {MAX_BULK_PRESCRIPTION_IMAGES} images per request'}), 400
+    if not re.match(r'^\d{12}$', aadhar_number):
+        return jsonify({'error': 'Invalid Aadhar number format'}), 400
+
+    # Read the uploads now; the request stream is gone once the response
+    # generator starts running
+    uploads = []
+    for image in images:
+        valid = image.filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+        uploads.append((image.filename, image.read() if valid else None))
+
+    def generate():
+        futures = {}
+        for index, (filename, content) in enumerate(uploads):
+            if content is None:
+                yield json.dumps({'index': index, 'filename': filename, 'status': 'error',
+                                  'error': 'Invalid file format'}) + '\n'
+                continue
+            futures[pipeline_executor.submit(extract_prescription, content)] = (index, filename)
+
+        results = {}
+        for future in as_completed(futures):
+            index, filename = futures[future]
+            try:
+                results[index] = future.result()
+                line = {'index': index, 'filename': filename, 'status': 'done',
+                        'medicines': results[index]}
+            except Exception as e:
+                line = {'index': index, 'filename': filename, 'status': 'error', 'error': str(e)}
+            yield json.dumps(line) + '\n'
+
+        # Merge in upload order so the stored list is stable across runs
+        medicines = merge_medicine_names(results[index] for index in sorted(results))
+        stored = False
+        if medicines:
+            db = get_db()
+            try:
+                if not db:
+                    raise Exception('Failed to initialize Firebase')
+                with span('firestore_set'):
+                    db.collection('patients').document(aadhar_number).set({
+                        'medicalDetails': {
+                            'currentMedications': ' '.join(f'**{name}**' for name in medicines)
+                        }
+                    }, merge=True)
+                stored = True
+            except Exception as e:
+                print(f"Firebase update error: {str(e)}")
+                firestore_pool.report_failure(e)
+
+        yield json.dumps({
+            'status': 'complete' if stored or not medicines else 'error',
+            'aadhar_number': aadhar_number,
+            'medicines': medicines,
+            'processed': len(results),
+            'failed': len(uploads) - len(results),
+            'stored': stored,
+        }) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 if __name__ == '__main__':
+    face_store.start()
     app.run(debug=True, port=5000)
\ No newline at end of file
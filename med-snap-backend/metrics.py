@@ -0,0 +1,211 @@
+"""
+Per-stage timing spans and Prometheus metrics.
+
+span("stage") (or @traced("stage")) times a block and records it in the
+medsnap_stage_duration_seconds histogram; the Flask and ASGI apps add
+request duration histograms and in-flight gauges and serve everything on
+/metrics in the Prometheus text format.
+
+Recording a span costs a perf_counter pair, a lock and a bucket bisect, so
+it stays on in production. Each worker process keeps its own registry;
+scrape every worker (or run one per container) rather than expecting one
+process to see another's counts.
+
+With MEDSNAP_OTEL=1 and opentelemetry installed, every span is also emitted
+as an OpenTelemetry span, so traces show the same stage names.
+"""
+import bisect
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Seconds; spans run from sub-millisecond FAISS lookups to multi-second LLM calls
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+OTEL_ENABLED = os.environ.get('MEDSNAP_OTEL', '0') == '1'
+
+
+def _label_string(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_label_string(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            labels = _label_string(self.labelnames + ('le',), key + (le,))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _label_string(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    'medsnap_stage_duration_seconds', 'Time spent in each processing stage.', ['stage'])
+stage_errors = metrics.counter(
+    'medsnap_stage_errors_total', 'Stages that raised an exception.', ['stage'])
+request_seconds = metrics.histogram(
+    'medsnap_request_duration_seconds', 'HTTP request latency.', ['route', 'method', 'status'])
+requests_in_flight = metrics.gauge(
+    'medsnap_requests_in_flight', 'HTTP requests currently being served.', ['route'])
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+_tracer = None
+
+
+def _otel_tracer():
+    global _tracer
+    if _tracer is None:
+        from opentelemetry import trace
+
+        _tracer = trace.get_tracer('medsnap')
+    return _tracer
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as one occurrence of stage."""
+    otel_span = None
+    if OTEL_ENABLED:
+        try:
+            otel_span = _otel_tracer().start_as_current_span(stage)
+            otel_span.__enter__()
+        except ImportError:
+            otel_span = None
+
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
+        if otel_span is not None:
+            otel_span.__exit__(*sys.exc_info())
+
+
+def traced(stage):
+    """Decorator form of span()."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def observe_request(route, method, status, seconds):
+    request_seconds.observe(seconds, route=route, method=method, status=status)
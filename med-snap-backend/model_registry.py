@@ -0,0 +1,88 @@
+import threading
+import time
+
+
+class ModelRegistry:
+    """
+    Holds the heavy models used by the backend and loads each one the first
+    time a route asks for it.
+
+    Loaders are registered by name and run at most once per process; the time
+    each load took is kept so /warmup can report a startup breakdown.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._locks = {}
+        self._load_times = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        """
+        Register a zero-argument loader for a model.
+
+        Args:
+            name (str): Name used by routes to fetch the model
+            loader (callable): Function that builds and returns the model
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        """
+        Return the model registered under name, loading it on first use.
+
+        Raises:
+            KeyError: If no loader is registered under name
+        """
+        if name in self._models:
+            return self._models[name]
+        if name not in self._loaders:
+            raise KeyError(f"No model registered as '{name}'")
+
+        # Per-model lock so concurrent first requests only load once, while
+        # loading one model never blocks requests for another
+        with self._locks[name]:
+            if name not in self._models:
+                start = time.perf_counter()
+                model = self._loaders[name]()
+                self._load_times[name] = time.perf_counter() - start
+                self._models[name] = model
+                print(f"Loaded model '{name}' in {self._load_times[name]:.2f}s")
+        return self._models[name]
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def names(self):
+        return list(self._loaders)
+
+    def warmup(self, names=None):
+        """
+        Load the given models (all registered models if names is None).
+
+        Returns:
+            dict: Load time in seconds per model, 0.0 for models that were
+            already resident
+        """
+        names = self.names() if names is None else names
+        timings = {}
+        for name in names:
+            already_loaded = self.is_loaded(name)
+            self.get(name)
+            timings[name] = 0.0 if already_loaded else self._load_times[name]
+        return timings
+
+    def status(self):
+        return {
+            name: {
+                'loaded': self.is_loaded(name),
+                'load_seconds': self._load_times.get(name),
+            }
+            for name in self._loaders
+        }
+
+
+registry = ModelRegistry()
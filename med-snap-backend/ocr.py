@@ -0,0 +1,158 @@
+import os
+import threading
+
+from batching import MicroBatcher
+
+
+# "vision" for Google Cloud Vision, "local" for the offline Tesseract stand-in
+OCR_BACKEND = os.environ.get('OCR_BACKEND', 'vision')
+# Vision accepts at most 16 images per batch_annotate_images request
+OCR_MAX_BATCH_SIZE = int(os.environ.get('OCR_MAX_BATCH_SIZE', '16'))
+OCR_MAX_WAIT_MS = float(os.environ.get('OCR_MAX_WAIT_MS', '20'))
+OCR_CONCURRENT_BATCHES = int(os.environ.get('OCR_CONCURRENT_BATCHES', '4'))
+# Vision rejects requests over about 10MB, and images travel base64-encoded
+# (4/3 larger), so a backend call carries at most this many raw image bytes
+OCR_MAX_BATCH_BYTES = int(os.environ.get('OCR_MAX_BATCH_BYTES', str(7 * 1024 * 1024)))
+
+
+class VisionOcrBackend:
+    """Google Cloud Vision document text detection with one shared client."""
+
+    max_batch_size = 16
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google.cloud import vision
+
+                    self._client = vision.ImageAnnotatorClient()
+        return self._client
+
+    def annotate(self, images):
+        """
+        OCR up to max_batch_size images in one batch_annotate_images call.
+
+        Returns:
+            list: Text per image, or an Exception for images Vision rejected
+        """
+        from google.cloud import vision
+
+        requests = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=image),
+                features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+            )
+            for image in images
+        ]
+        response = self.client.batch_annotate_images(requests=requests)
+
+        texts = []
+        for image_response in response.responses:
+            if image_response.error.message:
+                texts.append(Exception(image_response.error.message))
+            elif image_response.text_annotations:
+                # First annotation holds the full text of the image
+                texts.append(image_response.text_annotations[0].description)
+            else:
+                texts.append("")
+        return texts
+
+
+class LocalOcrBackend:
+    """
+    Offline stand-in using Tesseract, for tests and development without
+    Vision credentials. Quality is lower than Vision's on handwriting.
+    """
+
+    max_batch_size = 16
+
+    def annotate(self, images):
+        import cv2
+        import numpy as np
+        import pytesseract
+
+        texts = []
+        for image in images:
+            img = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                texts.append(Exception("Could not decode image"))
+                continue
+            texts.append(pytesseract.image_to_string(img))
+        return texts
+
+
+def split_by_bytes(images, max_bytes):
+    """Split images into consecutive runs whose total size stays within max_bytes."""
+    chunks = []
+    chunk = []
+    size = 0
+    for image in images:
+        if chunk and size + len(image) > max_bytes:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        chunk.append(image)
+        size += len(image)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+OCR_BACKENDS = {
+    'vision': VisionOcrBackend,
+    'local': LocalOcrBackend,
+}
+
+
+class OcrService:
+    """
+    OCR entry point shared by /prescribe and the PDF fallback.
+
+    Images from concurrent requests are coalesced by a micro-batcher into
+    backend batch calls bounded by size (OCR_MAX_BATCH_SIZE), bytes
+    (OCR_MAX_BATCH_BYTES) and latency (OCR_MAX_WAIT_MS).
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._batcher = MicroBatcher(
+            self._annotate,
+            max_batch_size=min(OCR_MAX_BATCH_SIZE, backend.max_batch_size),
+            max_wait_ms=OCR_MAX_WAIT_MS,
+            workers=OCR_CONCURRENT_BATCHES,
+            name='ocr',
+        )
+
+    def _annotate(self, images):
+        """
+        OCR a micro-batch, split into backend calls of at most
+        OCR_MAX_BATCH_BYTES each. An image over the cap goes alone, and a
+        failed call fails only the images in it, so one user's oversized
+        upload can't fail images from other requests.
+        """
+        results = []
+        for chunk in split_by_bytes(images, OCR_MAX_BATCH_BYTES):
+            try:
+                texts = self.backend.annotate(chunk)
+            except Exception as e:
+                texts = [e] * len(chunk)
+            results.extend(texts)
+        return results
+
+    def detect_text(self, image_content):
+        return self._batcher.submit(image_content).result()
+
+    def detect_texts(self, images):
+        return self._batcher.map(images)
+
+    def stats(self):
+        return self._batcher.stats()
+
+
+ocr_service = OcrService(OCR_BACKENDS[OCR_BACKEND]())
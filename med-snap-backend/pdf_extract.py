@@ -0,0 +1,399 @@
+import io
+import itertools
+import os
+import queue
+import subprocess
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Connection
+
+import PyPDF2
+
+
+MAX_PDF_BYTES = int(os.environ.get('PDF_MAX_BYTES', str(50 * 1024 * 1024)))
+MAX_PDF_PAGES = int(os.environ.get('PDF_MAX_PAGES', '500'))
+PAGE_TIMEOUT_SECONDS = float(os.environ.get('PDF_PAGE_TIMEOUT_SECONDS', '20'))
+# Pages are parsed in a long-lived pool of PDF_WORKERS worker processes, so a
+# pathological page can be killed after PAGE_TIMEOUT_SECONDS. Documents with
+# at least this many pages are spread over several workers; smaller ones
+# use one, which only has to be sent the file once
+PARALLEL_PAGE_THRESHOLD = int(os.environ.get('PDF_PARALLEL_PAGE_THRESHOLD', '16'))
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', str(min(8, os.cpu_count() or 1))))
+
+# Pages with less extracted text than this (blank, or just a page number)
+# are treated as scanned images and sent to OCR
+OCR_MIN_PAGE_CHARS = int(os.environ.get('PDF_OCR_MIN_PAGE_CHARS', '20'))
+OCR_BATCH_SIZE = int(os.environ.get('PDF_OCR_BATCH_SIZE', '8'))
+OCR_WORKERS = int(os.environ.get('PDF_OCR_WORKERS', '4'))
+# Render at 2x PDF points (~144 dpi), enough for Vision to read body text
+OCR_RENDER_SCALE = float(os.environ.get('PDF_OCR_RENDER_SCALE', '2'))
+
+
+PageText = namedtuple('PageText', ['index', 'text', 'error'])
+
+
+class PdfExtraction(namedtuple(
+        'PdfExtraction',
+        ['text', 'page_count', 'pages', 'failed_pages', 'truncated', 'ocr_pages'],
+        defaults=((),))):
+    """
+    Result of extracting a whole PDF.
+
+    text is the joined text of every page that succeeded, pages holds the
+    per-page text (empty for failed pages), failed_pages maps page index to
+    error message, truncated is True if pages past MAX_PDF_PAGES were
+    skipped, and ocr_pages lists the pages whose text came from OCR.
+    """
+
+
+class PdfTooLarge(ValueError):
+    pass
+
+
+def read_pdf_bytes(pdf_file, max_bytes=MAX_PDF_BYTES):
+    """Read an uploaded file into memory, refusing anything over max_bytes."""
+    data = pdf_file.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise PdfTooLarge(f"PDF is larger than {max_bytes} bytes")
+    return data
+
+
+def _extract_page(reader, index):
+    try:
+        return PageText(index, reader.pages[index].extract_text() or "", None)
+    except Exception as e:
+        return PageText(index, "", str(e))
+
+
+def _iter_pages_inline(reader, page_count):
+    for index in range(page_count):
+        yield _extract_page(reader, index)
+
+
+def _page_worker_main():
+    """
+    Loop of a page worker process: receive (document id, PDF bytes or None,
+    page index), send back (text, error). The bytes come only with the first
+    page of each document the worker sees; it keeps that reader for the rest.
+    """
+    # Replies go over the original stdout; anything else printed goes to stderr
+    replies = Connection(os.dup(1), readable=False)
+    os.dup2(2, 1)
+    requests = Connection(os.dup(0), writable=False)
+    document_id = None
+    reader = None
+    while True:
+        try:
+            message_document, pdf_bytes, index = requests.recv()
+        except EOFError:
+            return
+        try:
+            if pdf_bytes is not None or message_document != document_id:
+                document_id, reader = message_document, PyPDF2.PdfReader(io.BytesIO(pdf_bytes or b""))
+            replies.send((reader.pages[index].extract_text() or "", None))
+        except Exception as e:
+            replies.send(("", str(e)))
+
+
+class _PageWorker:
+    """
+    One page worker process. Started as a fresh interpreter rather than
+    forked, so it inherits none of the server's threads or gRPC channels.
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--page-worker'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        self._requests = Connection(os.dup(self.process.stdin.fileno()), readable=False)
+        self._replies = Connection(os.dup(self.process.stdout.fileno()), writable=False)
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.document_id = None
+
+    def extract(self, document_id, pdf_bytes, index, timeout):
+        """
+        Raises:
+            TimeoutError: If the page took longer than timeout
+            EOFError, OSError: If the worker died
+        """
+        self._requests.send((document_id, pdf_bytes if document_id != self.document_id else None, index))
+        self.document_id = document_id
+        if not self._replies.poll(timeout):
+            raise TimeoutError(f"timed out after {timeout}s")
+        text, error = self._replies.recv()
+        return PageText(index, text, error)
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+        self._requests.close()
+        self._replies.close()
+
+
+class PageWorkerPool:
+    """
+    Process-wide pool of page workers, started on first use and reused
+    across documents. A worker that times out or dies is killed and
+    replaced. Each document's pages are split into lanes; a lane runs on
+    one worker, page by page, on one of this pool's dispatch threads.
+    """
+
+    def __init__(self, size=PDF_WORKERS):
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        self._started = 0
+        self._lock = threading.Lock()
+        self._document_ids = itertools.count()
+        # One dispatch thread per worker, so a thread never waits for a
+        # worker that no thread will give back
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='pdf-pages')
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle.empty() and self._started < self.size:
+                self._started += 1
+                try:
+                    return _PageWorker()
+                except Exception:
+                    self._started -= 1
+                    raise
+        return self._idle.get()
+
+    def _discard(self, worker):
+        worker.kill()
+        with self._lock:
+            self._started -= 1
+
+    def _run_lane(self, document_id, pdf_bytes, indices, futures, page_timeout):
+        worker = None
+        try:
+            for index in indices:
+                future = futures[index]
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    worker = worker or self._checkout()
+                    future.set_result(worker.extract(document_id, pdf_bytes, index, page_timeout))
+                except TimeoutError as e:
+                    # Stuck on a pathological page; nothing short of killing
+                    # the process gets it back
+                    self._discard(worker)
+                    worker = None
+                    future.set_result(PageText(index, "", str(e)))
+                except Exception as e:
+                    if worker is not None:
+                        self._discard(worker)
+                        worker = None
+                    future.set_result(PageText(index, "", f"page worker failed: {str(e)}"))
+        finally:
+            if worker is not None:
+                self._idle.put(worker)
+
+    def iter_pages(self, pdf_bytes, page_count, lanes, page_timeout):
+        """Yield PageText for pages 0..page_count-1 in order, as each finishes."""
+        document_id = next(self._document_ids)
+        futures = [Future() for _ in range(page_count)]
+        lanes = max(1, min(lanes, page_count))
+        for lane in range(lanes):
+            # Interleaved, so the pages come back roughly in order
+            self._executor.submit(self._run_lane, document_id, pdf_bytes,
+                                  range(lane, page_count, lanes), futures, page_timeout)
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # The consumer stopped early: skip the pages not started yet
+            for future in futures:
+                future.cancel()
+
+
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+
+def page_pool():
+    global _page_pool
+    if _page_pool is None:
+        with _page_pool_lock:
+            if _page_pool is None:
+                _page_pool = PageWorkerPool(PDF_WORKERS)
+    return _page_pool
+
+
+def iter_pdf_pages(pdf_bytes, max_pages=MAX_PDF_PAGES, page_timeout=PAGE_TIMEOUT_SECONDS,
+                   parallel_threshold=PARALLEL_PAGE_THRESHOLD, workers=PDF_WORKERS, reader=None):
+    """
+    Yield PageText(index, text, error) for each page of a PDF, in order, as
+    soon as each page is done.
+
+    Pages are extracted by the page worker pool with a per-page timeout; a
+    page that fails or times out is yielded with an error instead of
+    aborting the document.
+
+    Args:
+        pdf_bytes (bytes): The PDF file contents
+        max_pages (int): Pages past this are not extracted
+        page_timeout (float): Seconds to wait for each page
+        parallel_threshold (int): Minimum page count to use several workers
+        workers (int): Most workers to use for this document; 0 extracts
+            inline in this process, with no timeout
+        reader (PyPDF2.PdfReader): Already-parsed reader for pdf_bytes, if any
+    """
+    if reader is None:
+        reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    page_count = min(len(reader.pages), max_pages)
+
+    if workers <= 0:
+        yield from _iter_pages_inline(reader, page_count)
+    else:
+        lanes = workers if page_count >= parallel_threshold else 1
+        yield from page_pool().iter_pages(pdf_bytes, page_count, lanes, page_timeout)
+
+
+def needs_ocr(page_text):
+    return len(page_text.strip()) < OCR_MIN_PAGE_CHARS
+
+
+def rasterize_pages(pdf_bytes, indices, scale=OCR_RENDER_SCALE):
+    """
+    Render the given pages to PNG bytes, yielding (index, png) in order.
+
+    Only the requested pages are rendered, so text pages never pay for it;
+    the document isn't even opened until the first index arrives.
+    """
+    document = None
+    try:
+        for index in indices:
+            if document is None:
+                import pypdfium2 as pdfium
+
+                document = pdfium.PdfDocument(pdf_bytes)
+            page = document[index]
+            image = page.render(scale=scale).to_pil()
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            page.close()
+            yield index, buffer.getvalue()
+    finally:
+        if document is not None:
+            document.close()
+
+
+def ocr_pages(pdf_bytes, indices, ocr_batch, batch_size=OCR_BATCH_SIZE, workers=OCR_WORKERS):
+    """
+    OCR the given pages in parallel batches.
+
+    Pages are rendered one at a time on this thread (pdfium isn't thread
+    safe) and each full batch is handed to a worker, so rendering overlaps
+    with the OCR calls already in flight. indices may be a generator; each
+    page is rendered as soon as it is yielded, and the generator is always
+    run to the end.
+
+    Args:
+        pdf_bytes (bytes): The PDF file contents
+        indices (iterable): Page indices to OCR
+        ocr_batch (callable): Takes a list of PNG bytes, returns their texts
+        batch_size (int): Images per ocr_batch call
+        workers (int): Concurrent ocr_batch calls
+
+    Returns:
+        tuple: ({index: text}, {index: error})
+    """
+    texts = {}
+    failures = {}
+    futures = []
+    indices = iter(indices)
+    requested = []
+
+    def requested_indices():
+        for index in indices:
+            requested.append(index)
+            yield index
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-ocr') as executor:
+        batch = []
+        try:
+            for index, image in rasterize_pages(pdf_bytes, requested_indices()):
+                batch.append((index, image))
+                if len(batch) == batch_size:
+                    futures.append((batch, executor.submit(ocr_batch, [image for _, image in batch])))
+                    batch = []
+        except Exception as e:
+            requested.extend(indices)
+            rendered = {index for batch_pages, _ in futures for index, _ in batch_pages}
+            rendered.update(index for index, _ in batch)
+            for index in requested:
+                if index not in rendered:
+                    failures[index] = f"rasterize failed: {str(e)}"
+        # Pages rendered before a failure still get read
+        if batch:
+            futures.append((batch, executor.submit(ocr_batch, [image for _, image in batch])))
+
+        for batch_pages, future in futures:
+            try:
+                for (index, _), text in zip(batch_pages, future.result()):
+                    texts[index] = text or ""
+            except Exception as e:
+                for index, _ in batch_pages:
+                    failures[index] = f"ocr failed: {str(e)}"
+
+    return texts, failures
+
+
+def extract_pdf(pdf_file, max_bytes=MAX_PDF_BYTES, max_pages=MAX_PDF_PAGES, ocr=None, **options):
+    """
+    Extract all text from an uploaded PDF.
+
+    Args:
+        pdf_file: File-like object with the PDF
+        max_bytes (int): Reject files larger than this
+        max_pages (int): Pages past this are not extracted
+        ocr (callable): Batch OCR function; if given, pages without a text
+            layer are rasterized and read with it
+
+    Returns:
+        PdfExtraction: Joined text plus per-page results and failures
+
+    Raises:
+        PdfTooLarge: If the file exceeds max_bytes
+    """
+    pdf_bytes = read_pdf_bytes(pdf_file, max_bytes)
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    page_count = len(reader.pages)
+
+    pages = []
+    failed_pages = {}
+    ocr_indices = []
+
+    def scanned_pages():
+        # Pages stream in as the workers finish them; a page without a text
+        # layer goes to OCR right away, while later pages are still parsing
+        for page in iter_pdf_pages(pdf_bytes, max_pages=max_pages, reader=reader, **options):
+            pages.append(page.text)
+            if page.error:
+                failed_pages[page.index] = page.error
+            if ocr is not None and needs_ocr(page.text):
+                ocr_indices.append(page.index)
+                yield page.index
+
+    if ocr is None:
+        for _ in scanned_pages():
+            pass
+    else:
+        ocr_texts, ocr_failures = ocr_pages(pdf_bytes, scanned_pages(), ocr)
+        for index, page_text in ocr_texts.items():
+            pages[index] = page_text
+            failed_pages.pop(index, None)
+        failed_pages.update(ocr_failures)
+
+    # Join once at the end; same layout as before, one newline after each page
+    text = "".join(f"{page_text}\n" for page_text in pages)
+    return PdfExtraction(text, page_count, pages, failed_pages, page_count > max_pages, tuple(ocr_indices))
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['--page-worker']:
+    _page_worker_main()
@@ -0,0 +1,271 @@
+"""
+Report analysis shared by the upload routes and the bulk tools: organ
+matching against the known conditions (mpnet + FAISS), the Groq organ
+summary and timeline entry, and the Firestore field-path update built from
+them.
+
+Importing this module only registers the model loaders; it opens no
+clients, starts no threads and loads no models, so command-line tools such
+as backfill_reports.py can use it without starting the server.
+"""
+import hashlib
+import os
+import time
+import uuid
+
+import numpy as np
+
+from condition_index import load_condition_index
+from llm_gateway import gateway
+from metrics import span, traced
+from model_registry import registry
+from report_chunker import iter_report_chunks
+
+
+condition_mapping = {
+    # Brain conditions
+    "brain migraine": "brain",
+    "brain concussion": "brain",
+    "brain stroke": "brain",
+    "brain tumor": "brain",
+    "brain seizure": "brain",
+
+    # Heart conditions
+    "heart attack": "heart",
+    "heart failure": "heart",
+    "heart arrhythmia": "heart",
+    "heart murmur": "heart",
+    "heart angina": "heart",
+
+    # Chest conditions
+    "chest pain": "chest",
+    "chest pneumonia": "chest",
+    "chest bronchitis": "chest",
+    "chest asthma": "chest",
+
+    # Arm conditions
+    "left arm fracture": "left arm",
+    "right arm fracture": "right arm",
+    "left arm strain": "left arm",
+    "right arm strain": "right arm",
+
+    # Leg conditions
+    "left leg fracture": "left leg",
+    "right leg fracture": "right leg",
+    "left leg sprain": "left leg",
+    "right leg sprain": "right leg",
+
+    # Stomach conditions
+    "stomach ulcer": "stomach",
+    "stomach gastritis": "stomach",
+    "stomach pain": "stomach",
+    "stomach infection": "stomach",
+
+    # Liver conditions
+    "liver cirrhosis": "liver",
+    "liver hepatitis": "liver",
+    "liver failure": "liver",
+    "liver disease": "liver",
+
+    # Kidney conditions
+    "left kidney stone": "left kidney",
+    "right kidney stone": "right kidney",
+    "left kidney infection": "left kidney",
+    "right kidney infection": "right kidney",
+
+    # Spine conditions
+    "cervical spine pain": "cervical spine",
+    "cervical spine herniation": "cervical spine",
+    "thoracic spine scoliosis": "thoracic spine",
+    "lumbar spine strain": "lumbar spine",
+
+    # Shoulder conditions
+    "shoulder blades pain": "shoulder blades",
+    "shoulder blades strain": "shoulder blades",
+
+    # Hip conditions
+    "left hip arthritis": "left hip",
+    "right hip arthritis": "right hip",
+    "left hip pain": "left hip",
+    "right hip pain": "right hip",
+
+    # Gluteus conditions
+    "left gluteus strain": "left gluteus",
+    "right gluteus strain": "right gluteus",
+    "left gluteus pain": "left gluteus",
+    "right gluteus pain": "right gluteus",
+
+    # Hamstring conditions
+    "left hamstring strain": "left hamstring",
+    "right hamstring strain": "right hamstring",
+    "left hamstring tear": "left hamstring",
+    "right hamstring tear": "right hamstring",
+
+    # Calf conditions
+    "left calf strain": "left calf",
+    "right calf strain": "right calf",
+    "left calf cramp": "left calf",
+    "right calf cramp": "right calf"
+}
+
+
+conditions_list = list(condition_mapping.keys())
+
+
+EMBEDDING_MODEL_NAME = 'all-mpnet-base-v2'
+
+
+def _load_mpnet():
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+
+def _load_condition_index():
+    # Served from the on-disk cache unless condition_mapping or the model
+    # changed, in which case mpnet is loaded to re-encode the conditions
+    return load_condition_index(
+        conditions_list,
+        EMBEDDING_MODEL_NAME,
+        lambda conditions: registry.get('mpnet').encode(conditions),
+    )
+
+
+registry.register('mpnet', _load_mpnet)
+registry.register('condition_index', _load_condition_index)
+
+
+@traced('llm_timeline')
+def discharge_summary_to_json(report_text):
+    return gateway.extract_timeline(report_text)
+
+
+@traced('llm_summary')
+def summarize_report(report_text):
+    """Ask Groq for a few-word summary of the report, e.g. "Mild Gastritis"."""
+    return gateway.summarize_organ(report_text)
+
+
+ENCODE_BATCH_SIZE = int(os.environ.get('MEDSNAP_ENCODE_BATCH_SIZE', '32'))
+
+# Chunked matching: each report is split into overlapping sentence windows,
+# every window is matched against the ORGAN_SEARCH_K nearest conditions, and
+# an organ is kept if its best window scores at least ORGAN_MATCH_THRESHOLD
+# cosine similarity. The top organ is always kept so every report updates
+# at least one organ, as before; a report updates at most
+# MAX_ORGANS_PER_REPORT organs in total, the top one included.
+MAX_REPORT_CHUNKS = int(os.environ.get('MEDSNAP_MAX_REPORT_CHUNKS', '32'))
+ORGAN_SEARCH_K = int(os.environ.get('MEDSNAP_ORGAN_SEARCH_K', '3'))
+ORGAN_MATCH_THRESHOLD = float(os.environ.get('MEDSNAP_ORGAN_MATCH_THRESHOLD', '0.45'))
+MAX_ORGANS_PER_REPORT = int(os.environ.get('MEDSNAP_MAX_ORGANS_PER_REPORT', '3'))
+
+
+def _aggregate_organ_scores(distances, ids):
+    """
+    Best cosine similarity per organ across a report's chunks, highest first.
+
+    mpnet embeddings are unit length and IndexFlatL2 returns squared L2
+    distance, so cosine similarity is 1 - d / 2.
+    """
+    scores = {}
+    for chunk_distances, chunk_ids in zip(distances, ids):
+        for distance, idx in zip(chunk_distances, chunk_ids):
+            if idx < 0:
+                continue
+            organ = condition_mapping[conditions_list[idx]]
+            similarity = 1.0 - float(distance) / 2.0
+            if similarity > scores.get(organ, -1.0):
+                scores[organ] = similarity
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _select_organs(ranked):
+    if not ranked:
+        return []
+    selected = [ranked[0][0]]
+    for organ, similarity in ranked[1:]:
+        if len(selected) >= MAX_ORGANS_PER_REPORT:
+            break
+        if similarity >= ORGAN_MATCH_THRESHOLD:
+            selected.append(organ)
+    return selected
+
+
+def match_organs_batch(reports, batch_size=ENCODE_BATCH_SIZE):
+    """
+    Match each report to the organs its conditions describe.
+
+    Every report is chunked (at most MAX_REPORT_CHUNKS windows), the chunks
+    of all reports are encoded in batches of batch_size and looked up with a
+    single FAISS search, and scores are aggregated back per report.
+
+    Returns:
+        list: List of organ names per report, in input order
+    """
+    chunks = []
+    owners = []
+    for position, report in enumerate(reports):
+        report_chunks = list(iter_report_chunks(report, max_chunks=MAX_REPORT_CHUNKS)) or [report]
+        chunks.extend(report_chunks)
+        owners.extend([position] * len(report_chunks))
+    if not chunks:
+        return [[] for _ in reports]
+
+    with span('mpnet_encode'):
+        chunk_embeddings = registry.get('mpnet').encode(chunks, batch_size=batch_size)
+    with span('faiss_search'):
+        D, I = registry.get('condition_index').search(
+            np.asarray(chunk_embeddings, dtype='float32'), k=ORGAN_SEARCH_K
+        )
+
+    per_report = [([], []) for _ in reports]
+    for owner, distances, ids in zip(owners, D, I):
+        per_report[owner][0].append(distances)
+        per_report[owner][1].append(ids)
+    return [_select_organs(_aggregate_organ_scores(d, i)) for d, i in per_report]
+
+
+def match_organs(report_text):
+    """Return the organs whose known conditions the report describes."""
+    return match_organs_batch([report_text])[0]
+
+
+def history_key(source=None, timestamp_ns=None):
+    """
+    Key for a new medicalHistory entry.
+
+    Nanosecond timestamps sort in upload order and, with a random suffix,
+    can't collide between concurrent uploads the way max(index) + 1 could.
+    Given the source the entry came from (e.g. a backfilled file's name)
+    and its timestamp, the key is derived from them instead, so writing the
+    same report again overwrites its entry rather than adding a second one.
+    """
+    stamp = time.time_ns() if timestamp_ns is None else timestamp_ns
+    if source is None:
+        suffix = uuid.uuid4().hex[:8]
+    else:
+        suffix = hashlib.sha256(source.encode('utf-8')).hexdigest()[:8]
+    return f"{stamp}-{suffix}"
+
+
+def patient_update_fields(organ_updates=None, history_entry=None, history_id=None):
+    """
+    Build the field-path update for new organ values and a history entry.
+
+    Field-path updates touch only the listed keys, so no read is needed to
+    preserve the other organs or existing history entries. history_id sets
+    the entry's key; by default a new one is generated.
+    """
+    from google.cloud.firestore import FieldPath
+
+    fields = {}
+    for organ, value in (organ_updates or {}).items():
+        fields[FieldPath('medicalDetails', 'organs', organ).to_api_repr()] = value
+
+    if history_entry:
+        fields[FieldPath('medicalDetails', 'medicalHistory', history_id or history_key()).to_api_repr()] = {
+            'date': history_entry['date'],
+            'issue': history_entry['issue'],
+            'treatment': history_entry['treatment']
+        }
+    return fields
@@ -0,0 +1,66 @@
+import re
+
+
+# mpnet truncates inputs at 384 word pieces; ~1200 characters of clinical
+# English stays comfortably under that
+MAX_CHUNK_CHARS = 1200
+
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def iter_sentences(text):
+    """Yield the non-empty sentences/lines of a report one at a time."""
+    start = 0
+    for match in _SENTENCE_BREAK.finditer(text):
+        sentence = text[start:match.start()].strip()
+        if sentence:
+            yield sentence
+        start = match.end()
+    sentence = text[start:].strip()
+    if sentence:
+        yield sentence
+
+
+def _split_long(sentence, max_chars):
+    for start in range(0, len(sentence), max_chars):
+        yield sentence[start:start + max_chars]
+
+
+def iter_report_chunks(text, window=4, stride=2, max_chunks=32, max_chars=MAX_CHUNK_CHARS):
+    """
+    Yield overlapping windows of sentences from a report.
+
+    Sentences are read lazily and each window is emitted as soon as it is
+    full, so encoding can start before the whole report has been split.
+
+    Args:
+        text (str): Report text
+        window (int): Sentences per chunk
+        stride (int): Sentences to advance between chunks
+        max_chunks (int): Stop after this many chunks to bound encode cost
+        max_chars (int): Longest chunk passed to the embedding model
+    """
+    buffer = []
+    emitted = 0
+    pending = False
+
+    def sentences():
+        for sentence in iter_sentences(text):
+            yield from _split_long(sentence, max_chars)
+
+    for sentence in sentences():
+        buffer.append(sentence)
+        pending = True
+        if len(buffer) == window:
+            yield ' '.join(buffer)[:max_chars]
+            emitted += 1
+            if emitted >= max_chunks:
+                return
+            # Keep the overlap for the next window; it was already emitted,
+            # so it alone doesn't warrant a trailing chunk
+            buffer = buffer[stride:]
+            pending = False
+
+    # Trailing sentences that never filled a window
+    if buffer and (pending or emitted == 0):
+        yield ' '.join(buffer)[:max_chars]
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+# enroll_faces decodes with OpenCV; skip rather than fail collection without it
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from enroll_faces import enroll  # noqa: E402
+
+
+# Stand-in for the deepface package, written to disk so worker processes
+# import it whatever their start method. It has no deepface.modules, so
+# face_service takes the DeepFace.represent path.
+FAKE_DEEPFACE = '''
+class DeepFace:
+    @staticmethod
+    def build_model(model_name):
+        return object()
+
+    @staticmethod
+    def represent(img, model_name=None, detector_backend=None):
+        return [{'embedding': [float(img.mean())] + [0.0] * 127}]
+'''
+
+
+class RecordingStore:
+    def __init__(self):
+        self.points = []
+        self.waits = []
+
+    def upsert(self, points, wait=True):
+        self.points.extend(points)
+        self.waits.append(wait)
+
+
+@pytest.fixture
+def photos(tmp_path, monkeypatch):
+    package = tmp_path / 'fake_modules' / 'deepface'
+    package.mkdir(parents=True)
+    (package / '__init__.py').write_text(FAKE_DEEPFACE)
+    monkeypatch.syspath_prepend(str(tmp_path / 'fake_modules'))
+
+    photos = tmp_path / 'photos'
+    photos.mkdir()
+    for aadhaar, shade in (('111122223333', 60), ('444455556666', 180)):
+        cv2.imwrite(str(photos / f'{aadhaar}.png'), np.full((64, 64, 3), shade, dtype=np.uint8))
+    return photos
+
+
+def test_enroll_two_images(photos, tmp_path):
+    checkpoint = str(tmp_path / 'photos.enrolled')
+
+    store = RecordingStore()
+    counts = enroll(str(photos), store, checkpoint=checkpoint, workers=1)
+
+    assert counts == {'enrolled': 2, 'skipped': 0, 'failed': 0}
+    assert sorted(point['payload']['aadhaar'] for point in store.points) == [111122223333, 444455556666]
+    assert all(len(point['vector']) == 128 for point in store.points)
+
+    # A second run finds both photos in the checkpoint
+    counts = enroll(str(photos), RecordingStore(), checkpoint=checkpoint, workers=1)
+    assert counts == {'enrolled': 0, 'skipped': 2, 'failed': 0}
+
+
+def test_enroll_rejects_short_aadhaar_and_waits_before_checkpoint(photos, tmp_path):
+    cv2.imwrite(str(photos / '12345.png'), np.zeros((64, 64, 3), dtype=np.uint8))
+    checkpoint = str(tmp_path / 'photos.enrolled')
+
+    store = RecordingStore()
+    counts = enroll(str(photos), store, checkpoint=checkpoint, workers=1, batch_size=1, checkpoint_every=4)
+
+    assert counts == {'enrolled': 2, 'skipped': 0, 'failed': 1}
+    # Both batches went out unwaited, so the last is re-sent with wait=True
+    # before the checkpoint records them
+    assert store.waits == [False, False, True]
+    with open(checkpoint) as f:
+        assert sorted(f.read().split()) == ['111122223333.png', '444455556666.png']
+    with open(checkpoint + '.errors') as f:
+        assert '12345.png\tinvalid Aadhaar number 12345' in f.read()
@@ -31,6 +31,7 @@ const Dashboard = () => {
   const [fileLoading, setFileLoading] = useState(false)
   const [files, setFiles] = useState([])
   const [uploadProgress, setUploadProgress] = useState(0)
+  const [processingStage, setProcessingStage] = useState('')
   const [error, setError] = useState('')
   const [successMessage, setSuccessMessage] = useState('')
   const [medicalDetails, setMedicalDetails] = useState(null)
@@ -125,6 +126,28 @@ const Dashboard = () => {
     }
   }
 
+  // /message queues the PDF and returns a job id; poll until the backend
+  // has parsed it, run the LLM extraction and saved the results
+  const waitForJob = async (jobId) => {
+    const deadline = Date.now() + 10 * 60 * 1000
+    while (Date.now() < deadline) {
+      const response = await fetch(`http://127.0.0.1:5000/jobs/${jobId}`)
+      if (!response.ok) {
+        throw new Error('Failed to check processing status')
+      }
+      const job = await response.json()
+      if (job.status === 'done') {
+        return job.result
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Failed to process PDF file')
+      }
+      setProcessingStage(job.stage || job.status)
+      await new Promise((resolve) => setTimeout(resolve, 1500))
+    }
+    throw new Error('Timed out waiting for the PDF to be processed')
+  }
+
   const handleFileUpload = async (e) => {
     const file = e.target.files[0]
     if (!file) return
@@ -150,12 +173,15 @@ const Dashboard = () => {
           }
 
           const data = await response.json()
-          console.log('Server response:', data)
+          const result = data.job_id ? await waitForJob(data.job_id) : data
+          console.log('Server response:', result)
         } catch (error) {
           console.error('Error sending to server:', error)
           setError('Failed to process PDF with server')
           setFileLoading(false)
           return
+        } finally {
+          setProcessingStage('')
         }
       }
 
@@ -453,7 +479,12 @@ const Dashboard = () => {
             </div>
           </CardHeader>
           <CardContent>
-            {fileLoading && (
+            {fileLoading && processingStage && (
+              <p className="mb-4 text-sm text-muted-foreground text-center animate-pulse">
+                Processing report: {processingStage}...
+              </p>
+            )}
+            {fileLoading && !processingStage && (
               <div className="mb-4">
                 <Progress value={uploadProgress} className="w-full" />
                 <p className="text-sm text-muted-foreground mt-2 text-center">